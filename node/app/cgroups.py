@@ -0,0 +1,174 @@
+"""Cgroup v2 leaves with CPU, memory and PID limits for tunnel processes
+
+Every tunnel process is moved into ``<cgroup_root>/<leaf>`` right after it
+is spawned, so a runaway process is throttled or OOM-killed on its own
+instead of starving the control plane. The same files give cheap
+per-tunnel CPU and memory figures. Without a writable cgroup2 mount
+(e.g. an unprivileged container) everything degrades to a no-op.
+"""
+import errno
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CGROUP2_MOUNT = Path("/sys/fs/cgroup")
+CONTROLLERS = ("cpu", "memory", "pids")
+AGENT_LEAF = "agent"
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def _read_int(path: Path) -> Optional[int]:
+    value = _read(path)
+    if value is None or value == "max":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _write(path: Path, value: str):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+class CgroupManager:
+    """Creates, limits, reads and removes per-tunnel cgroup leaves"""
+
+    def __init__(self, root: str, enabled: bool, limits: Dict[str, str]):
+        self.root = Path(root)
+        self.enabled = enabled
+        self.limits = limits
+        self._ready: Optional[bool] = None
+
+    @property
+    def available(self) -> bool:
+        if self._ready is None:
+            self._ready = self.enabled and self._prepare_root()
+        return self._ready
+
+    def _prepare_root(self) -> bool:
+        if not (CGROUP2_MOUNT / "cgroup.controllers").exists():
+            logger.info("cgroup v2 is not mounted, tunnel processes run without resource limits")
+            return False
+        try:
+            self._enable_controllers(self.root.parent)
+            self.root.mkdir(exist_ok=True)
+            self._enable_controllers(self.root)
+        except OSError as e:
+            logger.warning("Cannot set up cgroup %s, tunnel processes run without resource limits: %s", self.root, e)
+            return False
+        return True
+
+    def _enable_controllers(self, cgroup: Path):
+        available = set((_read(cgroup / "cgroup.controllers") or "").split())
+        wanted = [c for c in CONTROLLERS if c in available]
+        if not wanted:
+            return
+        request = " ".join(f"+{c}" for c in wanted)
+        try:
+            _write(cgroup / "cgroup.subtree_control", request)
+        except OSError as e:
+            if e.errno != errno.EBUSY:
+                raise
+            # A non-root cgroup that still holds processes cannot delegate
+            # controllers; move them (this agent included) into a sibling leaf
+            self._evict_processes(cgroup)
+            _write(cgroup / "cgroup.subtree_control", request)
+
+    def _evict_processes(self, cgroup: Path):
+        agent = cgroup / AGENT_LEAF
+        agent.mkdir(exist_ok=True)
+        for pid in (_read(cgroup / "cgroup.procs") or "").split():
+            try:
+                _write(agent / "cgroup.procs", pid)
+            except OSError:
+                pass
+
+    def leaf(self, name: str) -> Path:
+        return self.root / name
+
+    def prepare(self, name: str) -> Optional[Path]:
+        """Create (or reuse) a leaf with the configured limits; None when cgroups are unavailable"""
+        if not self.available:
+            return None
+        path = self.leaf(name)
+        try:
+            path.mkdir(exist_ok=True)
+            for key, value in self.limits.items():
+                if value and (path / key).exists():
+                    _write(path / key, str(value))
+            if (path / "memory.oom.group").exists():
+                _write(path / "memory.oom.group", "1")
+        except OSError as e:
+            logger.warning("Failed to prepare cgroup %s: %s", path, e)
+            return None
+        return path
+
+    def attach(self, leaf: Optional[Path], pid: int):
+        """Move a freshly spawned process (and its threads) into ``leaf``"""
+        if leaf is None:
+            return
+        try:
+            _write(leaf / "cgroup.procs", str(pid))
+        except OSError as e:
+            logger.warning("Failed to move pid %s into cgroup %s: %s", pid, leaf, e)
+
+    def release(self, name: str):
+        """Remove a leaf once its processes are gone"""
+        if not self._ready:
+            return
+        try:
+            os.rmdir(self.leaf(name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.debug("Could not remove cgroup %s: %s", self.leaf(name), e)
+
+    def stats(self, name: str) -> Optional[Dict[str, Any]]:
+        """Live CPU, memory and PID figures for a leaf"""
+        if not self._ready:
+            return None
+        path = self.leaf(name)
+        cpu_stat = _read(path / "cpu.stat")
+        if cpu_stat is None:
+            return None
+        cpu = {}
+        for line in cpu_stat.splitlines():
+            key, _, value = line.partition(" ")
+            if value.isdigit():
+                cpu[key] = int(value)
+        return {
+            "cpu_usage_usec": cpu.get("usage_usec"),
+            "cpu_user_usec": cpu.get("user_usec"),
+            "cpu_system_usec": cpu.get("system_usec"),
+            "cpu_nr_throttled": cpu.get("nr_throttled"),
+            "cpu_throttled_usec": cpu.get("throttled_usec"),
+            "cpu_max": _read(path / "cpu.max"),
+            "memory_current": _read_int(path / "memory.current"),
+            "memory_max": _read_int(path / "memory.max"),
+            "pids_current": _read_int(path / "pids.current"),
+            "pids_max": _read_int(path / "pids.max"),
+        }
+
+
+cgroups = CgroupManager(
+    root=settings.cgroup_root,
+    enabled=settings.cgroup_enabled,
+    limits={
+        "cpu.max": settings.tunnel_cpu_max,
+        "memory.max": settings.tunnel_memory_max,
+        "pids.max": settings.tunnel_pids_max,
+    },
+)
@@ -1,6 +1,7 @@
 """Application configuration"""
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Literal
 
 
 class Settings(BaseSettings):
@@ -10,6 +11,38 @@ class Settings(BaseSettings):
     panel_ca_path: str = "/etc/smite-node/ca.crt"
     panel_address: str = "panel.example.com:443"
     
+    tunnel_log_max_bytes: int = 10 * 1024 * 1024
+    tunnel_log_backup_count: int = 5
+    tunnel_log_max_age_hours: float = 24
+    
+    log_level: str = "INFO"
+    log_format: Literal["json", "text"] = "json"
+    log_sample_burst: int = 10
+    log_sample_window_seconds: float = 60
+    
+    loop_monitor_enabled: bool = False
+    loop_monitor_threshold_ms: int = 100
+    loop_monitor_interval_ms: int = 50
+    
+    tunnel_restart_policy: Literal["always", "on-failure", "never"] = "always"
+    tunnel_restart_initial_delay: float = 1.0
+    tunnel_restart_max_delay: float = 60.0
+    tunnel_restart_crash_limit: int = 5
+    tunnel_restart_crash_window_seconds: float = 300
+    
+    rathole_hot_reload: bool = True
+    
+    node_state_path: str = "/etc/smite-node/state.db"
+    
+    usage_report_interval_seconds: float = 60
+    limit_check_interval_seconds: float = 2
+    
+    cgroup_enabled: bool = True
+    cgroup_root: str = "/sys/fs/cgroup/smite-node"
+    tunnel_cpu_max: str = "max"
+    tunnel_memory_max: str = "max"
+    tunnel_pids_max: str = "max"
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
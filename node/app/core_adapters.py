@@ -1,22 +1,104 @@
 """Core adapters for different tunnel types"""
-from typing import Protocol, Dict, Any, Optional, List
-import subprocess
+from typing import Protocol, Dict, Any, Optional, List, Callable, Sequence, Tuple, Union
+import asyncio
+import hashlib
+import ipaddress
+import logging
 import os
-import psutil
+import signal
 import time
+import psutil
 from pathlib import Path
 import shutil
 
+from app.cgroups import cgroups
+from app.config import settings
+from app.log_rotation import ChildLogWatch, RotatingLogFile, open_process_log
+from app.logging_setup import bind
+from app.metrics import TUNNEL_LIMIT_CUTOFFS, TUNNEL_PROCESS_RESTARTS, forget_tunnel
+from app.sock_diag import Address, SocketByteCounter, TcpSocket, dump_tcp_sockets, socket_inodes
+from app.restart_policy import describe_exit, parse_restart_policy, restart_tracker, should_restart
+from app.state_store import state_store
+from app.tunnel_limits import LimitExceeded, TunnelLimits
+
+logger = logging.getLogger(__name__)
+
+STARTUP_GRACE_SECONDS = 0.5
+STOP_TIMEOUT_SECONDS = 5.0
+ADOPTED_EXIT_CODE = 1
+
+ExitListener = Callable[[str, str, int], None]
+
+
+async def spawn_process(commands: Sequence[List[str]], log_fh: RotatingLogFile) -> asyncio.subprocess.Process:
+    """Start the first command whose binary exists, with stdout and stderr going straight to ``log_fh``
+
+    The child writes to the file rather than a pipe and runs in its own
+    session, so it survives the agent dying: a pipe would break and kill it
+    with SIGPIPE on its next log line, and a signal to the agent's process
+    group would reach it too. ``log_fh`` must be opened with copytruncate.
+    """
+    try:
+        for index, argv in enumerate(commands):
+            try:
+                return await asyncio.create_subprocess_exec(
+                    *argv,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=log_fh.fileno(),
+                    stderr=asyncio.subprocess.STDOUT,
+                    start_new_session=True,
+                )
+            except FileNotFoundError:
+                if index == len(commands) - 1:
+                    raise
+    except Exception:
+        log_fh.close()
+        raise
+
+
+async def exited_during_startup(proc: asyncio.subprocess.Process) -> bool:
+    """Give a fresh child a moment to fail on bad config before reporting it up"""
+    try:
+        await asyncio.wait_for(proc.wait(), STARTUP_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+async def stop_process(proc: asyncio.subprocess.Process, timeout: float = STOP_TIMEOUT_SECONDS):
+    """SIGTERM, then SIGKILL if the child is still around after ``timeout``"""
+    if proc.returncode is not None:
+        return
+    try:
+        proc.terminate()
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+def read_log_tail(log_path: Path, default: str = "") -> str:
+    try:
+        return log_path.read_text(encoding="utf-8", errors="replace")[-1000:]
+    except Exception:
+        return default
+
 
 class CoreAdapter(Protocol):
     """Protocol for core adapters"""
     name: str
     
-    def apply(self, tunnel_id: str, spec: Dict[str, Any]) -> None:
+    async def apply(self, tunnel_id: str, spec: Dict[str, Any]) -> None:
         """Apply tunnel configuration"""
         ...
     
-    def remove(self, tunnel_id: str) -> None:
+    async def remove(self, tunnel_id: str) -> None:
         """Remove tunnel"""
         ...
     
@@ -29,17 +111,283 @@ class CoreAdapter(Protocol):
         ...
 
 
-class RatholeAdapter:
-    """Rathole reverse tunnel adapter"""
+class AdoptedProcess:
+    """A client that outlived the agent that started it, driven like an asyncio Process
+
+    It is not our child, so its exit status went to whoever reaped it; the
+    exit is reported as ``ADOPTED_EXIT_CODE``. Clients only outlive the agent
+    when something else keeps running: in the container the agent is PID 1,
+    so its exit takes every client with it and restore starts them afresh.
+    """
+    stdout = None
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+
+    async def wait(self) -> int:
+        if self.returncode is None:
+            try:
+                pidfd = os.pidfd_open(self.pid)
+            except (AttributeError, OSError):
+                pidfd = None
+            if pidfd is not None:
+                loop = asyncio.get_running_loop()
+                exited = loop.create_future()
+                loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+                try:
+                    await exited
+                finally:
+                    loop.remove_reader(pidfd)
+                    os.close(pidfd)
+            else:
+                while psutil.pid_exists(self.pid):
+                    await asyncio.sleep(1)
+            self.returncode = ADOPTED_EXIT_CODE
+        return self.returncode
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+
+class ClientGroup:
+    """One client process serving every tunnel that shares an upstream
+
+    ``members`` maps tunnel ids to whatever the adapter needs to render the
+    group's config. The process is started once and kept while any member
+    remains; its exit is reported for every member.
+    """
+
+    def __init__(self, core: str, key: str, config_path: Path, log_path: Path):
+        self.core = core
+        self.key = key
+        self.config_path = config_path
+        self.log_path = log_path
+        self.members: Dict[str, Dict[str, Any]] = {}
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.log_watch: Optional[ChildLogWatch] = None
+        self.exit_task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+        self.adopted = False
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    @property
+    def cgroup(self) -> str:
+        return f"{self.core}-{self.key}"
+
+    async def start(self, commands: Sequence[List[str]], banner: str, on_exit: Callable[[int], None]):
+        log_fh = open_process_log(self.log_path, copytruncate=True)
+        log_fh.write(banner)
+        leaf = cgroups.prepare(self.cgroup)
+        proc = await spawn_process(commands, log_fh)
+        cgroups.attach(leaf, proc.pid)
+        log_watch = ChildLogWatch(log_fh)
+        if await exited_during_startup(proc):
+            await log_watch.close()
+            cgroups.release(self.cgroup)
+            raise RuntimeError(read_log_tail(self.log_path, "Unknown error"))
+        self.log_watch = log_watch
+        self.adopt(proc, on_exit)
+        try:
+            create_time = psutil.Process(proc.pid).create_time()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            create_time = 0.0
+        state_store.save_process(self.core, self.key, proc.pid, create_time, str(self.config_path))
+
+    def adopt(self, proc: Union[asyncio.subprocess.Process, AdoptedProcess], on_exit: Callable[[int], None]):
+        self.proc = proc
+        if self.log_watch is None:
+            # An adopted client still writes to its log; keep rotating it
+            self.log_watch = ChildLogWatch(open_process_log(self.log_path, copytruncate=True))
+        self.exit_task = asyncio.create_task(self._wait_exit(proc, on_exit))
+
+    async def _wait_exit(self, proc: asyncio.subprocess.Process, on_exit: Callable[[int], None]):
+        returncode = await proc.wait()
+        if self.proc is not proc:
+            return
+        self.exit_task = None
+        log_watch, self.log_watch = self.log_watch, None
+        on_exit(returncode)
+        if log_watch is not None:
+            await log_watch.close()
+
+    async def stop(self):
+        task, self.exit_task = self.exit_task, None
+        if task is not None:
+            task.cancel()
+        proc, self.proc = self.proc, None
+        if proc is not None:
+            try:
+                await stop_process(proc)
+            except Exception:
+                pass
+            state_store.delete_process(self.core, self.key)
+            cgroups.release(self.cgroup)
+        log_watch, self.log_watch = self.log_watch, None
+        if log_watch is not None:
+            try:
+                await log_watch.close()
+            except Exception:
+                pass
+
+
+def group_key(*parts: Any) -> str:
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()[:16]
+
+
+def addr_matches(addr: Any, peer: Address) -> bool:
+    """Whether a configured ``host:port`` is the peer of a socket
+
+    Hostnames are compared by port only; they would need a resolver call
+    per sample otherwise.
+    """
+    if not isinstance(addr, str) or ":" not in addr:
+        return False
+    host, _, port = addr.rpartition(":")
+    if not port.isdigit() or int(port) != peer[1]:
+        return False
+    host = host.strip("[]")
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return True
+    return ip.is_unspecified or (ip.is_loopback and ipaddress.ip_address(peer[0]).is_loopback) or str(ip) == peer[0]
+
+
+class SharedClientAdapter:
+    """Bookkeeping common to adapters that run one client per group of tunnels"""
+    name = ""
+    config_dir: Path
+
+    def __init__(self):
+        self.groups: Dict[str, ClientGroup] = {}
+        self.tunnel_groups: Dict[str, str] = {}
+        self.usage_tracking: Dict[str, float] = {}
+        self.on_exit: Optional[ExitListener] = None
+
+    @property
+    def processes(self) -> Dict[str, Union[asyncio.subprocess.Process, AdoptedProcess]]:
+        return {key: group.proc for key, group in self.groups.items() if group.proc is not None}
+
+    def _group(self, key: str) -> ClientGroup:
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = ClientGroup(
+                self.name,
+                key,
+                self.config_dir / f"client-{key}.toml",
+                self.config_dir / f"{self.name}_client-{key}.log",
+            )
+        return group
+
+    def _group_of(self, tunnel_id: str) -> Optional[ClientGroup]:
+        key = self.tunnel_groups.get(tunnel_id)
+        return self.groups.get(key) if key else None
+
+    def _notify_exit(self, group: ClientGroup, returncode: int):
+        if self.on_exit is None:
+            return
+        for tunnel_id in list(group.members):
+            self.on_exit(self.name, tunnel_id, returncode)
+
+    def adopt(self, key: str, pid: int):
+        """Take over a client left running by a previous agent; members join as tunnels are re-applied"""
+        group = self._group(key)
+        group.adopted = True
+        group.adopt(AdoptedProcess(pid), lambda returncode: self._notify_exit(group, returncode))
+
+    async def prune(self):
+        """Settle adopted clients once restore has re-applied every tunnel
+
+        Clients no tunnel claimed are stopped; the rest get their final config.
+        """
+        for key, group in list(self.groups.items()):
+            if not group.adopted:
+                continue
+            async with group.lock:
+                group.adopted = False
+                if group.members:
+                    await self._settle(group)
+                    continue
+                await group.stop()
+                self.groups.pop(key, None)
+                group.config_path.unlink(missing_ok=True)
+
+    async def _settle(self, group: ClientGroup):
+        pass
+
+    async def shutdown(self):
+        """Stop every client but keep configs and recorded state for the next start"""
+        for group in list(self.groups.values()):
+            async with group.lock:
+                await group.stop()
+
+    def status(self, tunnel_id: str) -> Dict[str, Any]:
+        group = self._group_of(tunnel_id)
+        config_exists = group is not None and group.config_path.exists()
+        is_running = group is not None and group.running
+        return {
+            "active": config_exists and is_running,
+            "type": self.name,
+            "config_exists": config_exists,
+            "process_running": is_running,
+            "shared_with": len(group.members) - 1 if group else 0,
+            "resources": cgroups.stats(group.cgroup) if group else None,
+        }
+
+    def get_usage_mb(self, tunnel_id: str) -> float:
+        """Cumulative usage in MB as last collected by AdapterManager.collect_usage"""
+        return self.usage_tracking.get(tunnel_id, 0.0)
+
+    def add_usage(self, tunnel_id: str, byte_count: float):
+        if byte_count > 0:
+            self.usage_tracking[tunnel_id] = self.usage_tracking.get(tunnel_id, 0.0) + byte_count / (1024 * 1024)
+
+    def account(self, group: ClientGroup, traffic: List[Tuple[TcpSocket, int]]):
+        """Attribute socket byte deltas of a group's client to its tunnels
+
+        Only the local side is counted: the same payload crosses the upstream
+        connection to the panel as well. Members of a shared client cannot be
+        told apart, so the bytes are split evenly.
+        """
+        if not group.members:
+            return
+        upstreams = [member.get("remote_addr") for member in group.members.values()]
+        local_bytes = sum(
+            delta for sock, delta in traffic
+            if sock.peer[1] and not any(addr_matches(addr, sock.peer) for addr in upstreams)
+        )
+        share = local_bytes / len(group.members)
+        for tunnel_id in group.members:
+            self.add_usage(tunnel_id, share)
+
+    def forget_usage(self, tunnel_id: str):
+        self.usage_tracking.pop(tunnel_id, None)
+
+
+class RatholeAdapter(SharedClientAdapter):
+    """Rathole reverse tunnel adapter
+
+    Tunnels with the same ``remote_addr`` and token become
+    ``[client.services.*]`` sections of one shared client. Membership changes
+    rewrite that config in place and rathole's config watcher hot-reloads the
+    services without dropping the others. With ``rathole_hot_reload`` off
+    (for builds without the watcher) the shared client is restarted instead.
+    """
     name = "rathole"
     
     def __init__(self):
+        super().__init__()
         self.config_dir = Path("/etc/smite-node/rathole")
         self.config_dir.mkdir(parents=True, exist_ok=True)
-        self.processes = {}
-        self.usage_tracking = {}
     
-    def apply(self, tunnel_id: str, spec: Dict[str, Any]):
+    async def apply(self, tunnel_id: str, spec: Dict[str, Any]):
         """Apply Rathole tunnel"""
         remote_addr = spec.get('remote_addr', '').strip()
         token = spec.get('token', '').strip()
@@ -50,111 +398,141 @@ class RatholeAdapter:
         if not token:
             raise ValueError("Rathole requires 'token' in spec")
         
-        config = f"""[client]
-remote_addr = "{remote_addr}"
-default_token = "{token}"
-
-[client.services.{tunnel_id}]
-local_addr = "{local_addr}"
-"""
+        key = group_key(remote_addr, token)
+        if self.tunnel_groups.get(tunnel_id, key) != key:
+            await self._leave(tunnel_id)
+        group = self._group(key)
         
-        config_path = self.config_dir / f"{tunnel_id}.toml"
-        with open(config_path, "w") as f:
-            f.write(config)
-        
-        try:
-            proc = subprocess.Popen(
-                ["/usr/local/bin/rathole", "-c", str(config_path)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            self.processes[tunnel_id] = proc
-            time.sleep(0.5)
-            if proc.poll() is not None:
-                stderr = proc.stderr.read().decode() if proc.stderr else "Unknown error"
-                raise RuntimeError(f"rathole failed to start: {stderr}")
-        except FileNotFoundError:
-            proc = subprocess.Popen(
-                ["rathole", "-c", str(config_path)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            self.processes[tunnel_id] = proc
-            time.sleep(0.5)
-            if proc.poll() is not None:
-                stderr = proc.stderr.read().decode() if proc.stderr else "Unknown error"
-                raise RuntimeError(f"rathole failed to start: {stderr}")
+        async with group.lock:
+            existing = group.members.get(tunnel_id)
+            member = {"remote_addr": remote_addr, "token": token, "local_addr": local_addr}
+            group.members[tunnel_id] = member
+            self.tunnel_groups[tunnel_id] = key
+            if group.running and (member == existing or group.adopted):
+                # Adopted clients already serve the recorded services; the
+                # config is rewritten once in prune() after every tunnel is back
+                return
+            self._write_config(group)
+            if group.running and settings.rathole_hot_reload:
+                return
+            try:
+                await self._restart_group(group, f"Starting Rathole client for tunnel {tunnel_id}\n")
+            except Exception:
+                if existing is None:
+                    group.members.pop(tunnel_id, None)
+                    self.tunnel_groups.pop(tunnel_id, None)
+                else:
+                    group.members[tunnel_id] = existing
+                try:
+                    await self._reconcile(group)
+                except Exception as e:
+                    logger.warning("Failed to restore rathole client %s: %s", group.key, e)
+                raise
     
-    def remove(self, tunnel_id: str):
+    async def remove(self, tunnel_id: str):
         """Remove Rathole tunnel"""
-        config_path = self.config_dir / f"{tunnel_id}.toml"
+        await self._leave(tunnel_id)
+        self.forget_usage(tunnel_id)
         
-        if tunnel_id in self.processes:
-            proc = self.processes[tunnel_id]
+        # Clients started before tunnels were grouped ran one process per tunnel
+        legacy_config = self.config_dir / f"{tunnel_id}.toml"
+        if legacy_config.exists():
             try:
-                proc.terminate()
-                proc.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-            except:
+                pkill = await asyncio.create_subprocess_exec(
+                    "pkill", "-f", f"rathole.*{tunnel_id}",
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                try:
+                    await asyncio.wait_for(pkill.wait(), 3)
+                except asyncio.TimeoutError:
+                    pkill.kill()
+                    await pkill.wait()
+            except Exception:
                 pass
-            del self.processes[tunnel_id]
-        
+            legacy_config.unlink()
+    
+    async def _leave(self, tunnel_id: str):
+        key = self.tunnel_groups.pop(tunnel_id, None)
+        group = self.groups.get(key) if key else None
+        if group is None:
+            return
+        async with group.lock:
+            group.members.pop(tunnel_id, None)
+            try:
+                await self._reconcile(group)
+            except Exception as e:
+                logger.warning("Failed to reload rathole client %s: %s", group.key, e)
+    
+    async def _reconcile(self, group: ClientGroup):
+        """Bring the group's config and process in line with its current members"""
+        if not group.members:
+            await group.stop()
+            group.config_path.unlink(missing_ok=True)
+            self.groups.pop(group.key, None)
+            return
+        self._write_config(group)
+        if not group.running or not settings.rathole_hot_reload:
+            await self._restart_group(group, f"Restarting Rathole client {group.key}\n")
+    
+    async def _restart_group(self, group: ClientGroup, banner: str):
+        await group.stop()
+        config_path = str(group.config_path)
         try:
-            subprocess.run(["pkill", "-f", f"rathole.*{tunnel_id}"], check=False, timeout=3)
-        except:
-            pass
-            
-        if config_path.exists():
-            config_path.unlink()
+            await group.start(
+                [
+                    ["/usr/local/bin/rathole", "-c", config_path],
+                    ["rathole", "-c", config_path],
+                ],
+                banner,
+                lambda returncode: self._notify_exit(group, returncode),
+            )
+        except RuntimeError as e:
+            raise RuntimeError(f"rathole failed to start: {e}")
     
-    def status(self, tunnel_id: str) -> Dict[str, Any]:
-        """Get status"""
-        config_path = self.config_dir / f"{tunnel_id}.toml"
-        is_running = False
-        
-        if tunnel_id in self.processes:
-            proc = self.processes[tunnel_id]
-            is_running = proc.poll() is None
-        
-        return {
-            "active": config_path.exists() and is_running,
-            "type": "rathole",
-            "config_exists": config_path.exists(),
-            "process_running": is_running
-        }
+    def account(self, group: ClientGroup, traffic: List[Tuple[TcpSocket, int]]):
+        """Each service dials its own ``local_addr``, so bytes map to tunnels exactly"""
+        for sock, delta in traffic:
+            for tunnel_id, member in group.members.items():
+                if addr_matches(member["local_addr"], sock.peer):
+                    self.add_usage(tunnel_id, delta)
+                    break
     
-    def get_usage_mb(self, tunnel_id: str) -> float:
-        """Get usage in MB - tracks cumulative network I/O"""
-        if tunnel_id in self.processes:
-            proc = self.processes[tunnel_id]
-            try:
-                proc_info = psutil.Process(proc.pid)
-                connections = proc_info.connections()
-                
-                try:
-                    io_counters = proc_info.io_counters()
-                    total_bytes = io_counters.read_bytes + io_counters.write_bytes
-                    
-                    if tunnel_id not in self.usage_tracking:
-                        self.usage_tracking[tunnel_id] = 0.0
-                    
-                    current_mb = total_bytes / (1024 * 1024)
-                    if current_mb > self.usage_tracking[tunnel_id]:
-                        self.usage_tracking[tunnel_id] = current_mb
-                    
-                    return self.usage_tracking[tunnel_id]
-                except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError, OSError):
-                    if tunnel_id in self.usage_tracking:
-                        return self.usage_tracking[tunnel_id]
-            except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError, OSError):
-                if tunnel_id in self.usage_tracking:
-                    return self.usage_tracking[tunnel_id]
-        return 0.0
-
-
-class BackhaulAdapter:
-    """Backhaul reverse tunnel adapter"""
+    async def _settle(self, group: ClientGroup):
+        changed = self._write_config(group)
+        if not group.running or (changed and not settings.rathole_hot_reload):
+            await self._restart_group(group, f"Restarting Rathole client {group.key}\n")
+    
+    def _write_config(self, group: ClientGroup) -> bool:
+        """Render the group's config; returns False if the file already had this content"""
+        first = next(iter(group.members.values()))
+        config = f"""[client]
+remote_addr = "{first['remote_addr']}"
+default_token = "{first['token']}"
+"""
+        for tunnel_id, member in sorted(group.members.items()):
+            config += f"""
+[client.services.{tunnel_id}]
+local_addr = "{member['local_addr']}"
+"""
+        try:
+            if group.config_path.read_text() == config:
+                return False
+        except OSError:
+            pass
+        # Rewritten in place: rathole watches the file itself, and replacing
+        # the inode would drop that watch
+        with open(group.config_path, "w") as f:
+            f.write(config)
+        return True
+
+
+class BackhaulAdapter(SharedClientAdapter):
+    """Backhaul reverse tunnel adapter
+
+    A backhaul client carries no per-tunnel state, so tunnels whose rendered
+    client config is identical share one process.
+    """
     name = "backhaul"
 
     CLIENT_OPTION_KEYS = [
@@ -187,14 +565,12 @@ class BackhaulAdapter:
         config_dir: Optional[Path] = None,
         binary_path: Optional[Path] = None,
     ):
+        super().__init__()
         resolved_config = config_dir or Path(
             os.environ.get("SMITE_BACKHAUL_CLIENT_DIR", "/etc/smite-node/backhaul")
         )
         self.config_dir = Path(resolved_config)
         self.config_dir.mkdir(parents=True, exist_ok=True)
-        self.processes: Dict[str, subprocess.Popen] = {}
-        self.usage_tracking: Dict[str, float] = {}
-        self.log_handles: Dict[str, Any] = {}
         default_binary = binary_path or Path(
             os.environ.get("BACKHAUL_CLIENT_BINARY", "/usr/local/bin/backhaul")
         )
@@ -203,7 +579,7 @@ class BackhaulAdapter:
             Path("backhaul"),
         ]
 
-    def apply(self, tunnel_id: str, spec: Dict[str, Any]):
+    async def apply(self, tunnel_id: str, spec: Dict[str, Any]):
         remote_addr = spec.get("remote_addr") or spec.get("control_addr") or spec.get("bind_addr")
         if not remote_addr:
             raise ValueError("Backhaul requires 'remote_addr' in spec")
@@ -240,93 +616,62 @@ class BackhaulAdapter:
         if spec.get("accept_udp") and transport in {"tcp", "tcpmux"}:
             config_dict["accept_udp"] = True
 
-        config_path = self.config_dir / f"{tunnel_id}.toml"
-        config_path.write_text(self._render_toml({"client": config_dict}), encoding="utf-8")
-
-        binary_path = self._resolve_binary_path()
-
-        log_path = self.config_dir / f"backhaul_{tunnel_id}.log"
-        log_fh = log_path.open("w", buffering=1)
-        log_fh.write(f"Starting Backhaul client for tunnel {tunnel_id}\n")
-        log_fh.write(self._render_toml({"client": config_dict}))
-        log_fh.flush()
-
-        try:
-            proc = subprocess.Popen(
-                [str(binary_path), "-c", str(config_path)],
-                stdout=log_fh,
-                stderr=subprocess.STDOUT,
-            )
-        except Exception:
-            log_fh.close()
-            raise
+        config_text = self._render_toml({"client": config_dict})
+        key = group_key(config_text)
+        if self.tunnel_groups.get(tunnel_id, key) != key:
+            await self._leave(tunnel_id)
+        group = self._group(key)
 
-        time.sleep(0.5)
-        if proc.poll() is not None:
-            error_output = ""
+        async with group.lock:
+            group.members[tunnel_id] = config_dict
+            self.tunnel_groups[tunnel_id] = key
+            if group.running:
+                return
+            group.config_path.write_text(config_text, encoding="utf-8")
+            binary_path = self._resolve_binary_path()
             try:
-                error_output = log_path.read_text(encoding="utf-8")[-1000:]
-            except Exception:
-                pass
-            log_fh.close()
-            raise RuntimeError(f"backhaul failed to start: {error_output}")
-
-        self.processes[tunnel_id] = proc
-        self.log_handles[tunnel_id] = log_fh
-        self.usage_tracking.setdefault(tunnel_id, 0.0)
+                await group.start(
+                    [[str(binary_path), "-c", str(group.config_path)]],
+                    f"Starting Backhaul client for tunnel {tunnel_id}\n{config_text}",
+                    lambda returncode: self._notify_exit(group, returncode),
+                )
+            except Exception as e:
+                group.members.pop(tunnel_id, None)
+                self.tunnel_groups.pop(tunnel_id, None)
+                if not group.members:
+                    self.groups.pop(key, None)
+                    group.config_path.unlink(missing_ok=True)
+                if isinstance(e, RuntimeError):
+                    raise RuntimeError(f"backhaul failed to start: {e}")
+                raise
 
-    def remove(self, tunnel_id: str):
-        config_path = self.config_dir / f"{tunnel_id}.toml"
-        if tunnel_id in self.processes:
-            proc = self.processes[tunnel_id]
-            try:
-                proc.terminate()
-                proc.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-            except Exception:
-                pass
-            del self.processes[tunnel_id]
-        if tunnel_id in self.log_handles:
+    async def _leave(self, tunnel_id: str):
+        key = self.tunnel_groups.pop(tunnel_id, None)
+        group = self.groups.get(key) if key else None
+        if group is None:
+            return
+        async with group.lock:
+            group.members.pop(tunnel_id, None)
+            if group.members:
+                return
+            await group.stop()
+            self.groups.pop(key, None)
             try:
-                self.log_handles[tunnel_id].close()
+                group.config_path.unlink(missing_ok=True)
             except Exception:
                 pass
-            del self.log_handles[tunnel_id]
 
-        if config_path.exists():
+    async def remove(self, tunnel_id: str):
+        await self._leave(tunnel_id)
+        self.forget_usage(tunnel_id)
+
+        legacy_config = self.config_dir / f"{tunnel_id}.toml"
+        if legacy_config.exists():
             try:
-                config_path.unlink()
+                legacy_config.unlink()
             except Exception:
                 pass
 
-    def status(self, tunnel_id: str) -> Dict[str, Any]:
-        config_path = self.config_dir / f"{tunnel_id}.toml"
-        proc = self.processes.get(tunnel_id)
-        is_running = proc is not None and proc.poll() is None
-        return {
-            "active": config_path.exists() and is_running,
-            "type": "backhaul",
-            "config_exists": config_path.exists(),
-            "process_running": is_running,
-        }
-
-    def get_usage_mb(self, tunnel_id: str) -> float:
-        if tunnel_id in self.processes:
-            proc = self.processes[tunnel_id]
-            try:
-                proc_info = psutil.Process(proc.pid)
-                io_counters = proc_info.io_counters()
-                total_bytes = io_counters.read_bytes + io_counters.write_bytes
-                current_mb = total_bytes / (1024 * 1024)
-                previous = self.usage_tracking.get(tunnel_id, 0.0)
-                if current_mb > previous:
-                    self.usage_tracking[tunnel_id] = current_mb
-                return self.usage_tracking.get(tunnel_id, current_mb)
-            except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError, OSError):
-                return self.usage_tracking.get(tunnel_id, 0.0)
-        return self.usage_tracking.get(tunnel_id, 0.0)
-
     def _render_toml(self, data: Dict[str, Dict[str, Any]]) -> str:
         def format_value(value: Any) -> str:
             if isinstance(value, bool):
@@ -375,47 +720,311 @@ class AdapterManager:
         }
         self.active_tunnels: Dict[str, CoreAdapter] = {}
         self.usage_tracking: Dict[str, float] = {}
+        self.tunnel_specs: Dict[str, Dict[str, Any]] = {}
+        self.pending_restarts: Dict[str, asyncio.Task] = {}
+        self.tunnel_locks: Dict[str, asyncio.Lock] = {}
+        self.limits: Dict[str, TunnelLimits] = {}
+        self.socket_counter = SocketByteCounter()
+        self._usage_collected = False
+        for adapter in self.adapters.values():
+            adapter.on_exit = self._on_process_exit
     
     def get_adapter(self, tunnel_core: str) -> Optional[CoreAdapter]:
         """Get adapter for tunnel core"""
         return self.adapters.get(tunnel_core)
     
-    async def apply_tunnel(self, tunnel_id: str, tunnel_core: str, spec: Dict[str, Any]):
-        """Apply tunnel using appropriate adapter"""
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"Applying tunnel {tunnel_id}: core={tunnel_core}")
+    async def apply_tunnel(
+        self, tunnel_id: str, tunnel_core: str, spec: Dict[str, Any], limits: Optional[Dict[str, Any]] = None
+    ):
+        """Apply tunnel using appropriate adapter
+        
+        ``limits`` replaces the tunnel's quota and expiry; without it the
+        limits from the previous apply stay in force.
+        """
+        log = bind(logger, tunnel_id=tunnel_id, core=tunnel_core)
+        log.info("Applying tunnel %s: core=%s", tunnel_id, tunnel_core)
         
         adapter = self.get_adapter(tunnel_core)
         if not adapter:
             error_msg = f"Unknown tunnel core: {tunnel_core}"
-            logger.error(error_msg)
+            log.error(error_msg)
             raise ValueError(error_msg)
         
-        logger.info(f"Using adapter: {adapter.name}")
-        adapter.apply(tunnel_id, spec)
-        self.active_tunnels[tunnel_id] = adapter
-        if tunnel_id not in self.usage_tracking:
-            self.usage_tracking[tunnel_id] = 0.0
-        logger.info(f"Tunnel {tunnel_id} applied successfully")
+        async with self._lock(tunnel_id):
+            if limits is not None:
+                self.set_limits(tunnel_id, limits, adapter)
+            tunnel_limits = self.limits.get(tunnel_id)
+            if tunnel_limits is not None:
+                violation = tunnel_limits.violation(adapter.get_usage_mb(tunnel_id))
+                if violation is not None:
+                    raise LimitExceeded(violation[1])
+            self._cancel_restart(tunnel_id)
+            restart_tracker.reset(tunnel_id)
+            previous = self.active_tunnels.get(tunnel_id)
+            if previous is not None and previous is not adapter:
+                await previous.remove(tunnel_id)
+                del self.active_tunnels[tunnel_id]
+            log.debug("Using adapter: %s", adapter.name)
+            await adapter.apply(tunnel_id, spec)
+            self.active_tunnels[tunnel_id] = adapter
+            self.tunnel_specs[tunnel_id] = spec
+            if tunnel_id not in self.usage_tracking:
+                self.usage_tracking[tunnel_id] = 0.0
+            state_store.save_tunnel(tunnel_id, tunnel_core, spec)
+        log.info("Tunnel %s applied successfully", tunnel_id)
     
     async def remove_tunnel(self, tunnel_id: str):
         """Remove tunnel"""
-        if tunnel_id in self.active_tunnels:
-            adapter = self.active_tunnels[tunnel_id]
-            adapter.remove(tunnel_id)
-            del self.active_tunnels[tunnel_id]
-        if tunnel_id in self.usage_tracking:
-            del self.usage_tracking[tunnel_id]
+        async with self._lock(tunnel_id):
+            self._cancel_restart(tunnel_id)
+            restart_tracker.forget(tunnel_id)
+            self.tunnel_specs.pop(tunnel_id, None)
+            if tunnel_id in self.active_tunnels:
+                adapter = self.active_tunnels[tunnel_id]
+                await adapter.remove(tunnel_id)
+                del self.active_tunnels[tunnel_id]
+            if tunnel_id in self.usage_tracking:
+                del self.usage_tracking[tunnel_id]
+            self.limits.pop(tunnel_id, None)
+            state_store.delete_tunnel(tunnel_id)
+            forget_tunnel(tunnel_id)
+    
+    def set_limits(self, tunnel_id: str, limits: Dict[str, Any], adapter: Optional[CoreAdapter] = None):
+        """Replace a tunnel's quota and expiry; usage observed from now on counts against the quota"""
+        adapter = adapter or self.active_tunnels.get(tunnel_id)
+        observed = adapter.get_usage_mb(tunnel_id) if adapter is not None else 0.0
+        tunnel_limits = TunnelLimits(
+            quota_mb=limits.get("quota_mb"),
+            used_mb=limits.get("used_mb"),
+            baseline_mb=observed,
+            expires_at=limits.get("expires_at"),
+        )
+        if tunnel_limits.unlimited:
+            self.limits.pop(tunnel_id, None)
+            state_store.delete_limits(tunnel_id)
+        else:
+            self.limits[tunnel_id] = tunnel_limits
+            state_store.save_limits(tunnel_limits.to_row(tunnel_id))
+    
+    def limit_violations(self) -> List[Tuple[str, str, str]]:
+        """``(tunnel_id, limit, message)`` for every active tunnel past its quota or expiry"""
+        now = time.time()
+        violations = []
+        for tunnel_id, tunnel_limits in list(self.limits.items()):
+            adapter = self.active_tunnels.get(tunnel_id)
+            if adapter is None:
+                continue
+            violation = tunnel_limits.violation(adapter.get_usage_mb(tunnel_id), now)
+            if violation is not None:
+                violations.append((tunnel_id, *violation))
+        return violations
+    
+    async def cut_off(self, tunnel_id: str, limit: str, reason: str):
+        """Stop a tunnel that ran out of quota or expired, without waiting for the panel"""
+        bind(logger, tunnel_id=tunnel_id).warning("Stopping tunnel %s: %s", tunnel_id, reason)
+        TUNNEL_LIMIT_CUTOFFS.labels(limit).inc()
+        await self.remove_tunnel(tunnel_id)
+    
+    def _lock(self, tunnel_id: str) -> asyncio.Lock:
+        """Serializes apply/remove per tunnel; different tunnels proceed concurrently"""
+        lock = self.tunnel_locks.get(tunnel_id)
+        if lock is None:
+            lock = self.tunnel_locks[tunnel_id] = asyncio.Lock()
+        return lock
     
     async def get_tunnel_status(self, tunnel_id: str) -> Dict[str, Any]:
         """Get tunnel status"""
         if tunnel_id in self.active_tunnels:
             adapter = self.active_tunnels[tunnel_id]
-            return adapter.status(tunnel_id)
+            return {**adapter.status(tunnel_id), **restart_tracker.stats(tunnel_id)}
         return {"active": False}
     
+    def _cancel_restart(self, tunnel_id: str):
+        task = self.pending_restarts.pop(tunnel_id, None)
+        if task:
+            task.cancel()
+    
+    def _on_process_exit(self, core: str, tunnel_id: str, returncode: int):
+        bind(logger, tunnel_id=tunnel_id, core=core).warning(
+            "%s process for tunnel %s exited (%s)", core, tunnel_id, describe_exit(returncode)
+        )
+        restart_tracker.record_exit(tunnel_id, describe_exit(returncode))
+        spec = self.tunnel_specs.get(tunnel_id)
+        if spec is None or tunnel_id in self.pending_restarts:
+            return
+        if not should_restart(parse_restart_policy(spec), returncode):
+            return
+        self._schedule_restart(core, tunnel_id)
+    
+    def _schedule_restart(self, core: str, tunnel_id: str):
+        task = asyncio.get_running_loop().create_task(self._restart(core, tunnel_id))
+        self.pending_restarts[tunnel_id] = task
+        task.add_done_callback(
+            lambda t: self.pending_restarts.pop(tunnel_id) if self.pending_restarts.get(tunnel_id) is t else None
+        )
+    
+    async def _restart(self, core: str, tunnel_id: str):
+        """Re-apply a crashed tunnel with exponential backoff until it stays up or the circuit opens"""
+        log = bind(logger, tunnel_id=tunnel_id, core=core)
+        while True:
+            delay = restart_tracker.next_delay(tunnel_id)
+            if delay is None:
+                log.error("Tunnel %s is crash looping, giving up on restarts", tunnel_id)
+                return
+            log.warning("Restarting %s for tunnel %s in %.1fs", core, tunnel_id, delay)
+            await asyncio.sleep(delay)
+            
+            async with self._lock(tunnel_id):
+                adapter = self.active_tunnels.get(tunnel_id)
+                spec = self.tunnel_specs.get(tunnel_id)
+                if adapter is None or spec is None:
+                    return
+                try:
+                    await adapter.apply(tunnel_id, spec)
+                except Exception as e:
+                    restart_tracker.record_exit(tunnel_id, f"restart failed: {e}")
+                    log.warning("Restart of %s for tunnel %s failed: %s", core, tunnel_id, e)
+                    continue
+            restart_tracker.record_restart(tunnel_id)
+            TUNNEL_PROCESS_RESTARTS.labels(core).inc()
+            log.info("Restarted %s for tunnel %s", core, tunnel_id)
+            return
+    
+    async def restore(self):
+        """Bring back the tunnels recorded by a previous run of the agent
+
+        Clients that are still running are adopted instead of restarted, and
+        usage baselines are reloaded so the next report is a true delta.
+        """
+        for record in state_store.processes():
+            adapter = self.adapters.get(record["core"])
+            if adapter is None or not self._is_recorded_process(record):
+                state_store.delete_process(record["core"], record["group_key"])
+                continue
+            adapter.adopt(record["group_key"], record["pid"])
+            logger.info("Adopted %s client %s (pid %s)", record["core"], record["group_key"], record["pid"])
+        
+        usage = state_store.usage()
+        tunnels = state_store.tunnels()
+        for record in tunnels:
+            tunnel_id = record["tunnel_id"]
+            adapter = self.adapters.get(record["core"])
+            baseline = usage.get(tunnel_id)
+            if adapter is not None and baseline:
+                self.usage_tracking[tunnel_id] = baseline["reported_mb"]
+                adapter.usage_tracking[tunnel_id] = baseline["observed_mb"]
+        for tunnel_id, row in state_store.limits().items():
+            self.limits[tunnel_id] = TunnelLimits(
+                quota_mb=row["quota_mb"],
+                used_mb=row["used_mb"],
+                baseline_mb=row["baseline_mb"],
+                expires_at=row["expires_at"],
+            )
+        
+        results = await asyncio.gather(
+            *(self.apply_tunnel(r["tunnel_id"], r["core"], r["spec"]) for r in tunnels),
+            return_exceptions=True,
+        )
+        for record, result in zip(tunnels, results):
+            if not isinstance(result, Exception):
+                continue
+            tunnel_id, core = record["tunnel_id"], record["core"]
+            if isinstance(result, LimitExceeded):
+                logger.warning(
+                    "Not restoring tunnel %s: %s", tunnel_id, result,
+                    extra={"tunnel_id": tunnel_id, "core": core},
+                )
+                self.limits.pop(tunnel_id, None)
+                state_store.delete_tunnel(tunnel_id)
+                continue
+            logger.error(
+                "Failed to restore tunnel %s: %s", tunnel_id, result,
+                extra={"tunnel_id": tunnel_id, "core": core},
+            )
+            adapter = self.adapters.get(core)
+            if adapter is None:
+                state_store.delete_tunnel(tunnel_id)
+                continue
+            # Keep it known so the restart policy retries it with backoff
+            self.active_tunnels[tunnel_id] = adapter
+            self.tunnel_specs[tunnel_id] = record["spec"]
+            restart_tracker.record_exit(tunnel_id, f"restore failed: {result}")
+            if parse_restart_policy(record["spec"]) != "never":
+                self._schedule_restart(core, tunnel_id)
+        for adapter in self.adapters.values():
+            await adapter.prune()
+        logger.info("Restored %d tunnels from local state", len(tunnels))
+    
+    @staticmethod
+    def _is_recorded_process(record: Dict[str, Any]) -> bool:
+        """Guard against PID reuse: same start time and still running the recorded config"""
+        try:
+            proc = psutil.Process(record["pid"])
+            if record["create_time"] and abs(proc.create_time() - record["create_time"]) > 1:
+                return False
+            return record["config_path"] in proc.cmdline()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, OSError):
+            return False
+    
+    async def collect_usage(self):
+        """Attribute the TCP bytes moved by every client since the last call to tunnels
+        
+        One socket dump per address family covers all clients; the dump and
+        the /proc fd scans run in a worker thread.
+        """
+        groups = [
+            (adapter, group)
+            for adapter in self.adapters.values()
+            for group in list(adapter.groups.values())
+            if group.running
+        ]
+        if not groups:
+            return
+        pids = [group.proc.pid for _, group in groups]
+        try:
+            sockets, owned = await asyncio.to_thread(self._snapshot_sockets, pids)
+        except OSError as e:
+            logger.warning("Socket accounting failed: %s", e, extra={"sample": True})
+            return
+        
+        for (adapter, group), inodes in zip(groups, owned):
+            # Sockets of a client adopted from a previous run carry bytes that
+            # were already reported; the first pass only records a baseline
+            seed = not self._usage_collected and isinstance(group.proc, AdoptedProcess)
+            traffic = [
+                (sockets[inode], self.socket_counter.delta(sockets[inode], seed))
+                for inode in inodes if inode in sockets
+            ]
+            adapter.account(group, traffic)
+        self.socket_counter.prune(set(sockets))
+        self._usage_collected = True
+    
+    @staticmethod
+    def _snapshot_sockets(pids: List[int]) -> Tuple[Dict[int, TcpSocket], List[set]]:
+        return dump_tcp_sockets(), [socket_inodes(pid) for pid in pids]
+    
+    def save_usage(self):
+        """Persist usage counters so deltas stay correct across agent restarts"""
+        rows = []
+        for tunnel_id, adapter in self.active_tunnels.items():
+            rows.append({
+                "tunnel_id": tunnel_id,
+                "reported_mb": self.usage_tracking.get(tunnel_id, 0.0),
+                "observed_mb": adapter.usage_tracking.get(tunnel_id, 0.0),
+            })
+        if rows:
+            state_store.save_usage(rows)
+    
     async def cleanup(self):
-        """Cleanup all tunnels"""
-        for tunnel_id in list(self.active_tunnels.keys()):
-            await self.remove_tunnel(tunnel_id)
+        """Stop all tunnel processes on shutdown; recorded state is kept for the next start"""
+        for tunnel_id in list(self.pending_restarts):
+            self._cancel_restart(tunnel_id)
+        try:
+            self.save_usage()
+        except Exception as e:
+            logger.warning("Failed to save usage state: %s", e)
+        await asyncio.gather(
+            *(adapter.shutdown() for adapter in self.adapters.values()),
+            return_exceptions=True,
+        )
+        state_store.close()
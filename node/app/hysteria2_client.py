@@ -4,9 +4,11 @@ import httpx
 import hashlib
 import socket
 import logging
+import time
 from pathlib import Path
 from typing import Optional
 from app.config import settings
+from app.metrics import PANEL_RPC_ERRORS, PANEL_RPC_LATENCY
 
 logger = logging.getLogger(__name__)
 
@@ -34,7 +36,7 @@ class Hysteria2Client:
             verify=False
         )
         
-        print(f"Node client ready, panel address: {self.panel_address}")
+        logger.info("Node client ready, panel address: %s", self.panel_address)
     
     async def stop(self):
         """Stop client"""
@@ -89,23 +91,23 @@ class Hysteria2Client:
         
         try:
             url = f"{panel_api_url}/api/nodes"
-            print(f"Registering with panel at {url}...")
+            logger.info("Registering with panel at %s...", url)
             response = await self.client.post(url, json=registration_data, timeout=10.0)
             
             if response.status_code in [200, 201]:
                 data = response.json()
                 self.node_id = data.get("id")
                 self.registered = True
-                logger.info(f"Node registered successfully with ID: {self.node_id}")
+                logger.info("Node registered successfully with ID: %s", self.node_id)
                 return True
             else:
-                logger.error(f"Registration failed: {response.status_code} - {response.text}")
+                logger.error("Registration failed: %s - %s", response.status_code, response.text)
                 return False
         except httpx.ConnectError as e:
-            logger.error(f"Cannot connect to panel at {panel_api_url}: {str(e)}. Make sure panel is running and accessible")
+            logger.error("Cannot connect to panel at %s: %s. Make sure panel is running and accessible", panel_api_url, str(e))
             return False
         except Exception as e:
-            logger.error(f"Registration error: {str(e)}")
+            logger.error("Registration error: %s", str(e))
             return False
     
     async def _generate_fingerprint(self):
@@ -114,7 +116,7 @@ class Hysteria2Client:
         hostname = socket.gethostname()
         fingerprint_data = f"{hostname}-{settings.node_name}".encode()
         self.fingerprint = hashlib.sha256(fingerprint_data).hexdigest()[:16]
-        print(f"Node fingerprint: {self.fingerprint}")
+        logger.info("Node fingerprint: %s", self.fingerprint)
     
     async def push_usage_to_panel(self, tunnel_id: str, node_id: str, bytes_used: int):
         """Push usage data to panel"""
@@ -136,6 +138,7 @@ class Hysteria2Client:
         panel_api_port = 8000
         panel_api_url = f"http://{panel_host}:{panel_api_port}"
         
+        started = time.perf_counter()
         try:
             url = f"{panel_api_url}/api/usage/push"
             response = await self.client.post(
@@ -147,7 +150,16 @@ class Hysteria2Client:
                 },
                 timeout=10.0
             )
-            return response.status_code in [200, 201]
+            if response.status_code not in [200, 201]:
+                PANEL_RPC_ERRORS.labels("/api/usage/push", "http").inc()
+                return False
+            return True
         except Exception as e:
-            print(f"Warning: Failed to push usage to panel: {e}")
+            PANEL_RPC_ERRORS.labels("/api/usage/push", "network").inc()
+            logger.warning(
+                "Failed to push usage to panel: %s", e,
+                extra={"tunnel_id": tunnel_id, "sample": True},
+            )
             return False
+        finally:
+            PANEL_RPC_LATENCY.labels("/api/usage/push").observe(time.perf_counter() - started)
@@ -0,0 +1,206 @@
+"""Rotating log sinks for tunnel process output"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Optional, Union
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Compression runs off the event loop; a single worker keeps generations ordered
+_compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compress")
+
+READ_CHUNK = 64 * 1024
+# How often the size and age of a log a child writes to directly are checked
+CHILD_LOG_CHECK_SECONDS = 5.0
+
+
+class RotatingLogFile:
+    """Log file capped by size and age, keeping N gzip-compressed generations
+
+    Generations are named ``<file>.1.gz`` (newest) to ``<file>.N.gz`` (oldest).
+
+    With ``copytruncate`` a child process writes to the file itself through
+    an inherited O_APPEND descriptor, so the file is never renamed under it:
+    a rotation copies it to a generation and truncates it in place, and
+    ``check`` must be called periodically since most writes bypass us.
+    Output written between the copy and the truncate is lost.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        max_age_seconds: float = 0,
+        copytruncate: bool = False,
+    ):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_age_seconds = max_age_seconds
+        self.copytruncate = copytruncate
+        self._lock = threading.Lock()
+        self._fh: Optional[IO[bytes]] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._pending = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # A child may still be writing to a copytruncate file; check() rotates it
+        if not copytruncate and self.path.exists() and self.path.stat().st_size > 0:
+            self._rotate_file()
+        self._open()
+
+    def _open(self):
+        self._fh = open(self.path, "ab", buffering=0)
+        self._size = os.fstat(self._fh.fileno()).st_size
+        self._opened_at = time.monotonic()
+
+    def write(self, data: Union[bytes, str]):
+        """Append data, rotating first if it would exceed the size or age cap"""
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        with self._lock:
+            if self._fh is None:
+                return
+            if self.copytruncate:
+                self._size = os.fstat(self._fh.fileno()).st_size
+            if self._should_rotate(len(data)):
+                self._fh.close()
+                self._rotate_file()
+                self._open()
+            self._fh.write(data)
+            self._size += len(data)
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self._size == 0:
+            return False
+        if self.max_bytes > 0 and self._size + incoming > self.max_bytes:
+            return True
+        if self.max_age_seconds > 0 and time.monotonic() - self._opened_at >= self.max_age_seconds:
+            return True
+        return False
+
+    def _rotate_file(self):
+        if self.backup_count <= 0:
+            try:
+                if self.copytruncate:
+                    # The child keeps writing to this inode; unlinking would orphan it
+                    os.truncate(self.path, 0)
+                else:
+                    self.path.unlink()
+            except FileNotFoundError:
+                pass
+            return
+        self._pending += 1
+        pending = self.path.with_name(f"{self.path.name}.{os.getpid()}.{self._pending}.pending")
+        try:
+            if self.copytruncate:
+                shutil.copyfile(self.path, pending)
+                os.truncate(self.path, 0)
+            else:
+                os.replace(self.path, pending)
+        except FileNotFoundError:
+            return
+        _compressor.submit(self._compress_generation, pending)
+
+    def _compress_generation(self, pending: Path):
+        try:
+            for index in range(self.backup_count - 1, 0, -1):
+                src = self.path.with_name(f"{self.path.name}.{index}.gz")
+                if src.exists():
+                    os.replace(src, self.path.with_name(f"{self.path.name}.{index + 1}.gz"))
+            target = self.path.with_name(f"{self.path.name}.1.gz")
+            with open(pending, "rb") as src_fh, gzip.open(target, "wb", compresslevel=6) as dst_fh:
+                shutil.copyfileobj(src_fh, dst_fh, READ_CHUNK)
+            pending.unlink()
+        except Exception as e:
+            logger.warning(f"Failed to compress rotated log {pending}: {e}")
+
+    def rotate(self):
+        """Force a rotation now"""
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.close()
+            self._rotate_file()
+            self._open()
+
+    def check(self):
+        """Rotate if the file outgrew its caps through writes that bypassed ``write``"""
+        with self._lock:
+            if self._fh is None:
+                return
+            self._size = os.fstat(self._fh.fileno()).st_size
+            if self._should_rotate(0):
+                self._fh.close()
+                self._rotate_file()
+                self._open()
+
+    def fileno(self) -> int:
+        """Descriptor to hand a child as its stdout; opened with O_APPEND"""
+        return self._fh.fileno()
+
+    def reopen(self):
+        """Reopen the file handle, e.g. after an external tool moved it"""
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.close()
+            self._open()
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                try:
+                    self._fh.close()
+                finally:
+                    self._fh = None
+
+    @property
+    def closed(self) -> bool:
+        return self._fh is None
+
+
+class ChildLogWatch:
+    """Keeps a copytruncate RotatingLogFile within its caps from a task"""
+
+    def __init__(self, sink: RotatingLogFile, interval: float = CHILD_LOG_CHECK_SECONDS):
+        self.sink = sink
+        self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # A rotation copies the whole file, so keep it off the loop
+                await asyncio.to_thread(self.sink.check)
+            except Exception as e:
+                logger.warning("Failed to rotate %s: %s", self.sink.path, e)
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.sink.close()
+
+
+def open_process_log(path: Union[str, Path], copytruncate: bool = False) -> RotatingLogFile:
+    """Open a tunnel process log using the configured rotation limits"""
+    return RotatingLogFile(
+        path,
+        max_bytes=settings.tunnel_log_max_bytes,
+        backup_count=settings.tunnel_log_backup_count,
+        max_age_seconds=settings.tunnel_log_max_age_hours * 3600,
+        copytruncate=copytruncate,
+    )
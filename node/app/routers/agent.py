@@ -1,19 +1,35 @@
 """Agent API endpoints"""
 from fastapi import APIRouter, Request, HTTPException
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import logging
 
+from app.logging_setup import bind
+from app.loop_monitor import loop_monitor
+from app.tunnel_limits import LimitExceeded
+
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
 
+class Limits(BaseModel):
+    quota_mb: float = 0
+    used_mb: float = 0
+    expires_at: Optional[str] = None
+
+
 class TunnelApply(BaseModel):
     tunnel_id: str
     core: str
     type: str
     spec: Dict[str, Any]
+    limits: Optional[Limits] = None
+
+
+class TunnelLimitsUpdate(BaseModel):
+    tunnel_id: str
+    limits: Limits
 
 
 class TunnelRemove(BaseModel):
@@ -28,20 +44,24 @@ class UsagePush(BaseModel):
 @router.post("/tunnels/apply")
 async def apply_tunnel(data: TunnelApply, request: Request):
     """Apply tunnel configuration"""
-    logger = logging.getLogger(__name__)
     adapter_manager = request.app.state.adapter_manager
     
-    logger.info(f"Applying tunnel {data.tunnel_id}: core={data.core}, type={data.type}")
+    log = bind(logger, tunnel_id=data.tunnel_id, core=data.core)
+    log.info("Applying tunnel %s: core=%s, type=%s", data.tunnel_id, data.core, data.type)
     try:
         await adapter_manager.apply_tunnel(
             tunnel_id=data.tunnel_id,
             tunnel_core=data.core,
-            spec=data.spec
+            spec=data.spec,
+            limits=data.limits.model_dump() if data.limits else None
         )
-        logger.info(f"Tunnel {data.tunnel_id} applied successfully")
+        log.info("Tunnel %s applied successfully", data.tunnel_id)
         return {"status": "success", "message": "Tunnel applied"}
+    except LimitExceeded as e:
+        log.warning("Refusing to apply tunnel %s: %s", data.tunnel_id, e)
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        logger.error(f"Failed to apply tunnel {data.tunnel_id}: {e}", exc_info=True)
+        log.error("Failed to apply tunnel %s: %s", data.tunnel_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -57,6 +77,17 @@ async def remove_tunnel(data: TunnelRemove, request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/tunnels/limits")
+async def update_tunnel_limits(data: TunnelLimitsUpdate, request: Request):
+    """Replace the quota and expiry of an applied tunnel without touching its process"""
+    adapter_manager = request.app.state.adapter_manager
+    
+    if data.tunnel_id not in adapter_manager.active_tunnels:
+        raise HTTPException(status_code=404, detail="Tunnel not found")
+    adapter_manager.set_limits(data.tunnel_id, data.limits.model_dump())
+    return {"status": "success", "message": "Limits updated"}
+
+
 @router.get("/tunnels/status")
 async def get_tunnel_status(tunnel_id: str, request: Request):
     """Get tunnel status"""
@@ -95,3 +126,16 @@ async def get_status(request: Request):
         "active_tunnels": len(adapter_manager.active_tunnels),
         "tunnels": list(adapter_manager.active_tunnels.keys())
     }
+
+
+@router.get("/loop")
+async def get_loop_report(limit: int = 20):
+    """Event loop stalls grouped by the call that blocked the loop"""
+    return loop_monitor.report(limit)
+
+
+@router.delete("/loop")
+async def reset_loop_report():
+    """Clear collected event loop stall data"""
+    loop_monitor.reset()
+    return {"status": "reset"}
@@ -0,0 +1,161 @@
+"""TCP byte counters per socket via NETLINK_SOCK_DIAG
+
+One ``inet_diag`` dump per address family returns every TCP socket on the
+host together with its ``tcp_info``. That is the same data ``ss -tiH``
+prints, without forking ``ss`` or walking per-process psutil structures.
+Sockets are tied to processes through the ``socket:[inode]`` links under
+``/proc/<pid>/fd``. UDP sockets carry no byte counters in sock_diag and
+are not accounted.
+"""
+import ipaddress
+import os
+import socket
+import struct
+from typing import Dict, NamedTuple, Set, Tuple
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+ALL_TCP_STATES = 0xFFFFFFFF
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+# family, protocol, ext, pad, states, then an empty inet_diag_sockid
+INET_DIAG_REQ_V2 = struct.Struct("=BBBBI48x")
+# family, state, timer, retrans, sport, dport, src, dst, if, cookie, expires, rqueue, wqueue, uid, inode
+INET_DIAG_MSG = struct.Struct("=BBBB2H16s16sI8sIIIII")
+RTATTR_HEADER = struct.Struct("=HH")
+
+TCP_INFO_BYTES_ACKED = 120
+TCP_INFO_BYTES_RECEIVED = 128
+TCP_INFO_MIN_LEN = TCP_INFO_BYTES_RECEIVED + 8
+
+RECV_BUFFER = 1 << 20
+
+Address = Tuple[str, int]
+
+
+class TcpSocket(NamedTuple):
+    inode: int
+    local: Address
+    peer: Address
+    bytes_acked: int
+    bytes_received: int
+
+    @property
+    def total_bytes(self) -> int:
+        return self.bytes_acked + self.bytes_received
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _address(family: int, raw: bytes, port: int) -> Address:
+    if family == socket.AF_INET:
+        return socket.inet_ntop(family, raw[:4]), port
+    ip = ipaddress.IPv6Address(raw)
+    # Dual-stack listeners report IPv4 peers as ::ffff:a.b.c.d
+    return str(ip.ipv4_mapped or ip), port
+
+
+def _parse(family: int, payload: bytes, sockets: Dict[int, TcpSocket]) -> bool:
+    """Collect the sockets in one netlink read; returns True once the dump is complete"""
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(payload):
+        length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(payload, offset)
+        if length < NLMSG_HEADER.size or msg_type in (NLMSG_DONE, NLMSG_ERROR):
+            return True
+        body = offset + NLMSG_HEADER.size
+        (_, _, _, _, sport, dport, src, dst, _, _, _, _, _, _, inode) = INET_DIAG_MSG.unpack_from(payload, body)
+        acked = received = None
+        attr = body + INET_DIAG_MSG.size
+        end = offset + length
+        while attr + RTATTR_HEADER.size <= end:
+            attr_len, attr_type = RTATTR_HEADER.unpack_from(payload, attr)
+            if attr_len < RTATTR_HEADER.size:
+                break
+            if attr_type == INET_DIAG_INFO and attr_len - RTATTR_HEADER.size >= TCP_INFO_MIN_LEN:
+                info = attr + RTATTR_HEADER.size
+                acked, received = struct.unpack_from("=QQ", payload, info + TCP_INFO_BYTES_ACKED)
+            attr += _align(attr_len)
+        if inode and acked is not None:
+            sockets[inode] = TcpSocket(
+                inode,
+                _address(family, src, socket.ntohs(sport)),
+                _address(family, dst, socket.ntohs(dport)),
+                acked,
+                received,
+            )
+        offset += _align(length)
+    return False
+
+
+def _dump_family(family: int, sockets: Dict[int, TcpSocket]):
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as nl:
+        request = INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), 0, ALL_TCP_STATES)
+        header = NLMSG_HEADER.pack(
+            NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST | NLM_F_DUMP, 1, 0
+        )
+        nl.send(header + request)
+        while True:
+            payload = nl.recv(RECV_BUFFER)
+            if not payload or _parse(family, payload, sockets):
+                return
+
+
+def dump_tcp_sockets() -> Dict[int, TcpSocket]:
+    """Every TCP socket on the host with its byte counters, keyed by inode"""
+    sockets: Dict[int, TcpSocket] = {}
+    for family in (socket.AF_INET, socket.AF_INET6):
+        _dump_family(family, sockets)
+    return sockets
+
+
+def socket_inodes(pid: int) -> Set[int]:
+    """Inodes of the sockets a process holds open"""
+    inodes: Set[int] = set()
+    fd_dir = f"/proc/{pid}/fd"
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError:
+        return inodes
+    for fd in fds:
+        try:
+            target = os.readlink(f"{fd_dir}/{fd}")
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            inodes.add(int(target[8:-1]))
+    return inodes
+
+
+class SocketByteCounter:
+    """Turns successive dumps into per-socket deltas
+
+    Only growth since the previous dump is counted, so a long-lived socket
+    is never counted twice and a closed one simply stops contributing.
+    """
+
+    def __init__(self):
+        self.last: Dict[int, int] = {}
+
+    def delta(self, sock: TcpSocket, seed: bool = False) -> int:
+        """Bytes moved since the last dump; ``seed`` records a baseline without counting"""
+        total = sock.total_bytes
+        previous = self.last.get(sock.inode)
+        self.last[sock.inode] = total
+        if seed:
+            return 0
+        if previous is None or total < previous:
+            # New socket, or an inode reused by one that started from zero
+            return total
+        return total - previous
+
+    def prune(self, live: Set[int]):
+        """Forget sockets that were not seen in the latest dump"""
+        for inode in [i for i in self.last if i not in live]:
+            del self.last[inode]
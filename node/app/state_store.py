@@ -0,0 +1,139 @@
+"""Durable node-side record of applied tunnels, client processes, usage baselines and limits
+
+Stored in SQLite under ``/etc/smite-node`` so a restarted agent can bring its
+tunnels back, adopt clients that survived it and keep usage deltas continuous
+without waiting for the panel. Writes are small single-row upserts on a WAL
+database, cheap enough to run on the event loop.
+"""
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tunnels (
+    tunnel_id TEXT PRIMARY KEY,
+    core TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    applied_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processes (
+    core TEXT NOT NULL,
+    group_key TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    create_time REAL NOT NULL,
+    config_path TEXT NOT NULL,
+    PRIMARY KEY (core, group_key)
+);
+CREATE TABLE IF NOT EXISTS usage (
+    tunnel_id TEXT PRIMARY KEY,
+    reported_mb REAL NOT NULL DEFAULT 0,
+    observed_mb REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS limits (
+    tunnel_id TEXT PRIMARY KEY,
+    quota_mb REAL NOT NULL DEFAULT 0,
+    used_mb REAL NOT NULL DEFAULT 0,
+    baseline_mb REAL NOT NULL DEFAULT 0,
+    expires_at REAL
+);
+"""
+
+
+class StateStore:
+    """Tunnels, client PIDs and usage counters that must survive an agent restart"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def save_tunnel(self, tunnel_id: str, core: str, spec: Dict[str, Any]):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tunnels (tunnel_id, core, spec, applied_at) VALUES (?, ?, ?, ?)",
+                (tunnel_id, core, json.dumps(spec), time.time()),
+            )
+
+    def delete_tunnel(self, tunnel_id: str):
+        with self.conn:
+            self.conn.execute("DELETE FROM tunnels WHERE tunnel_id = ?", (tunnel_id,))
+            self.conn.execute("DELETE FROM usage WHERE tunnel_id = ?", (tunnel_id,))
+            self.conn.execute("DELETE FROM limits WHERE tunnel_id = ?", (tunnel_id,))
+
+    def tunnels(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("SELECT tunnel_id, core, spec FROM tunnels ORDER BY applied_at").fetchall()
+        loaded = []
+        for row in rows:
+            try:
+                spec = json.loads(row["spec"])
+            except ValueError:
+                logger.warning("Discarding unreadable stored spec for tunnel %s", row["tunnel_id"])
+                continue
+            loaded.append({"tunnel_id": row["tunnel_id"], "core": row["core"], "spec": spec})
+        return loaded
+
+    def save_process(self, core: str, group_key: str, pid: int, create_time: float, config_path: str):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO processes (core, group_key, pid, create_time, config_path) VALUES (?, ?, ?, ?, ?)",
+                (core, group_key, pid, create_time, config_path),
+            )
+
+    def delete_process(self, core: str, group_key: str):
+        with self.conn:
+            self.conn.execute("DELETE FROM processes WHERE core = ? AND group_key = ?", (core, group_key))
+
+    def processes(self) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self.conn.execute("SELECT * FROM processes").fetchall()]
+
+    def save_usage(self, rows: List[Dict[str, Any]]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO usage (tunnel_id, reported_mb, observed_mb) "
+                "VALUES (:tunnel_id, :reported_mb, :observed_mb)",
+                rows,
+            )
+
+    def usage(self) -> Dict[str, Dict[str, float]]:
+        return {row["tunnel_id"]: dict(row) for row in self.conn.execute("SELECT * FROM usage").fetchall()}
+
+    def save_limits(self, row: Dict[str, Any]):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO limits (tunnel_id, quota_mb, used_mb, baseline_mb, expires_at) "
+                "VALUES (:tunnel_id, :quota_mb, :used_mb, :baseline_mb, :expires_at)",
+                row,
+            )
+
+    def delete_limits(self, tunnel_id: str):
+        with self.conn:
+            self.conn.execute("DELETE FROM limits WHERE tunnel_id = ?", (tunnel_id,))
+
+    def limits(self) -> Dict[str, Dict[str, Any]]:
+        return {row["tunnel_id"]: dict(row) for row in self.conn.execute("SELECT * FROM limits").fetchall()}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+state_store = StateStore(settings.node_state_path)
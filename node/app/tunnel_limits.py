@@ -0,0 +1,63 @@
+"""Quota and expiry the panel attaches to a tunnel, enforced locally
+
+The panel sends the quota, the usage it has recorded so far and the expiry
+with every apply. The node adds what it has observed since then, so it can
+cut a client off within one accounting pass instead of waiting for the
+panel to receive a usage report and send a remove back.
+"""
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+
+class LimitExceeded(Exception):
+    """A tunnel was applied after running out of quota or past its expiry"""
+
+
+def _timestamp(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.rstrip("Z"))
+    if value.tzinfo is None:
+        # The panel stores and sends naive UTC
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class TunnelLimits:
+    """Limits of one tunnel and the observed usage they are measured from"""
+
+    __slots__ = ("quota_mb", "used_mb", "baseline_mb", "expires_at")
+
+    def __init__(self, quota_mb: float = 0, used_mb: float = 0, baseline_mb: float = 0, expires_at: Any = None):
+        self.quota_mb = float(quota_mb or 0)
+        self.used_mb = float(used_mb or 0)
+        self.baseline_mb = float(baseline_mb or 0)
+        self.expires_at = _timestamp(expires_at)
+
+    @property
+    def unlimited(self) -> bool:
+        return self.quota_mb <= 0 and self.expires_at is None
+
+    def violation(self, observed_mb: float, now: Optional[float] = None) -> Optional[Tuple[str, str]]:
+        """``(limit, message)`` once the tunnel must stop, None while it is within its limits"""
+        if self.quota_mb > 0:
+            used = self.used_mb + max(0.0, observed_mb - self.baseline_mb)
+            if used >= self.quota_mb:
+                return "quota", f"Quota exceeded: {used:.1f} of {self.quota_mb:.1f} MB used"
+        if self.expires_at is not None and self.expires_at <= (now or time.time()):
+            expired = datetime.fromtimestamp(self.expires_at, timezone.utc).isoformat()
+            return "expiry", f"Tunnel expired at {expired}"
+        return None
+
+    def to_row(self, tunnel_id: str) -> Dict[str, Any]:
+        return {
+            "tunnel_id": tunnel_id,
+            "quota_mb": self.quota_mb,
+            "used_mb": self.used_mb,
+            "baseline_mb": self.baseline_mb,
+            "expires_at": self.expires_at,
+        }
@@ -7,64 +7,105 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 
 from app.config import settings
 from app.routers import agent
 from app.hysteria2_client import Hysteria2Client
 from app.core_adapters import AdapterManager
+from app.logging_setup import configure_logging, set_default_fields, shutdown_logging
+from app import metrics
+from app.loop_monitor import loop_monitor
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
+async def report_usage(app: FastAPI):
+    """Push the usage each tunnel accumulated since the last report to the panel"""
+    adapter_manager = app.state.adapter_manager
+    h2_client = app.state.h2_client
+    if not h2_client or not hasattr(h2_client, 'node_id') or not h2_client.node_id:
+        return
+    
+    for tunnel_id, adapter in list(adapter_manager.active_tunnels.items()):
+        try:
+            usage_mb = adapter.get_usage_mb(tunnel_id)
+            
+            previous_mb = adapter_manager.usage_tracking.get(tunnel_id, 0.0)
+            
+            if usage_mb > previous_mb:
+                incremental_mb = usage_mb - previous_mb
+                adapter_manager.usage_tracking[tunnel_id] = usage_mb
+                
+                incremental_bytes = int(incremental_mb * 1024 * 1024)
+                
+                if incremental_bytes > 0:
+                    pushed = await h2_client.push_usage_to_panel(
+                        tunnel_id=tunnel_id,
+                        node_id=h2_client.node_id,
+                        bytes_used=incremental_bytes
+                    )
+                    # Removed meanwhile: its series is gone and must not come back
+                    if pushed and tunnel_id in adapter_manager.active_tunnels:
+                        metrics.TUNNEL_USAGE_BYTES.labels(tunnel_id).inc(incremental_bytes)
+            elif previous_mb == 0.0 and usage_mb > 0:
+                adapter_manager.usage_tracking[tunnel_id] = usage_mb
+        except Exception as e:
+            logger.warning(
+                "Failed to report usage for tunnel %s: %s", tunnel_id, e,
+                extra={"tunnel_id": tunnel_id, "sample": True},
+            )
+
+
 async def usage_reporting_task(app: FastAPI):
-    """Periodic task to collect and report usage"""
-    import asyncio
+    """Periodic task to collect usage, enforce tunnel limits and report usage
+    
+    Usage is collected every ``limit_check_interval_seconds`` so a tunnel is
+    cut off within seconds of running out; it is reported to the panel every
+    ``usage_report_interval_seconds``, and right away before a cutoff so the
+    panel records the final figure and stops its side too.
+    """
+    loop = asyncio.get_running_loop()
+    last_report = loop.time()
     while True:
         try:
-            await asyncio.sleep(60)
+            await asyncio.sleep(settings.limit_check_interval_seconds)
             
             adapter_manager = app.state.adapter_manager
-            h2_client = app.state.h2_client
-            
-            if not adapter_manager or not h2_client or not hasattr(h2_client, 'node_id') or not h2_client.node_id:
+            if not adapter_manager:
                 continue
+            await adapter_manager.collect_usage()
             
-            for tunnel_id, adapter in adapter_manager.active_tunnels.items():
-                try:
-                    usage_mb = adapter.get_usage_mb(tunnel_id)
-                    
-                    previous_mb = adapter_manager.usage_tracking.get(tunnel_id, 0.0)
-                    
-                    if usage_mb > previous_mb:
-                        incremental_mb = usage_mb - previous_mb
-                        adapter_manager.usage_tracking[tunnel_id] = usage_mb
-                        
-                        incremental_bytes = int(incremental_mb * 1024 * 1024)
-                        
-                        if incremental_bytes > 0:
-                            await h2_client.push_usage_to_panel(
-                                tunnel_id=tunnel_id,
-                                node_id=h2_client.node_id,
-                                bytes_used=incremental_bytes
-                            )
-                    elif previous_mb == 0.0 and usage_mb > 0:
-                        adapter_manager.usage_tracking[tunnel_id] = usage_mb
-                except Exception as e:
-                    print(f"Warning: Failed to report usage for tunnel {tunnel_id}: {e}")
+            violations = adapter_manager.limit_violations()
+            if violations or loop.time() - last_report >= settings.usage_report_interval_seconds:
+                await report_usage(app)
+                adapter_manager.save_usage()
+                last_report = loop.time()
+            for tunnel_id, limit, reason in violations:
+                await adapter_manager.cut_off(tunnel_id, limit, reason)
         except asyncio.CancelledError:
             break
         except Exception as e:
-            print(f"Error in usage reporting task: {e}")
-            await asyncio.sleep(60)
+            logger.error("Error in usage reporting task: %s", e)
+            await asyncio.sleep(settings.limit_check_interval_seconds)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
+    adapter_manager = AdapterManager()
+    app.state.adapter_manager = adapter_manager
+    for core, adapter in adapter_manager.adapters.items():
+        metrics.register_process_source(
+            core,
+            lambda adapter=adapter: sum(1 for proc in adapter.processes.values() if proc.returncode is None),
+        )
+    try:
+        await adapter_manager.restore()
+    except Exception as e:
+        logger.error("Failed to restore tunnels from local state: %s", e, exc_info=True)
+    
     h2_client = Hysteria2Client()
     try:
         await h2_client.start()
@@ -72,23 +113,26 @@ async def lifespan(app: FastAPI):
         
         try:
             await h2_client.register_with_panel()
+            set_default_fields(node_id=h2_client.node_id)
         except Exception as e:
-            logger.warning(f"Could not register with panel: {e}")
+            logger.warning("Could not register with panel: %s", e)
             logger.warning("Node will continue running but manual registration may be needed")
     except Exception as e:
-        logger.error(f"Failed to start Hysteria2 client: {e}")
+        logger.error("Failed to start Hysteria2 client: %s", e)
         logger.error("Node API will still be available, but panel connection will not work")
         logger.error("Make sure CA certificate is available at the configured path")
         app.state.h2_client = None
     
-    adapter_manager = AdapterManager()
-    app.state.adapter_manager = adapter_manager
-    
     usage_task = asyncio.create_task(usage_reporting_task(app))
     app.state.usage_task = usage_task
+    lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+    if settings.loop_monitor_enabled:
+        loop_monitor.start()
     
     yield
     
+    lag_task.cancel()
+    await loop_monitor.stop()
     if hasattr(app.state, 'usage_task'):
         app.state.usage_task.cancel()
         try:
@@ -102,6 +146,8 @@ async def lifespan(app: FastAPI):
             pass
     if hasattr(app.state, 'adapter_manager'):
         await app.state.adapter_manager.cleanup()
+    
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -109,6 +155,7 @@ app = FastAPI(
     description="Lightweight Tunnel Agent",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -118,6 +165,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 app.include_router(agent.router, prefix="/api/agent", tags=["agent"])
@@ -128,10 +176,17 @@ async def root():
     return {"status": "ok", "service": "smite-node"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    payload, content_type = metrics.render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+
 if __name__ == "__main__":
     import uvicorn
     try:
         uvicorn.run(app, host="0.0.0.0", port=8888)
     except Exception as e:
-        logger.error(f"Failed to start server: {e}", exc_info=True)
+        logger.error("Failed to start server: %s", e, exc_info=True)
         raise
@@ -0,0 +1,74 @@
+"""TTL/LRU cache of verified access tokens and the admins they belong to"""
+import hmac
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect
+
+from app.config import settings
+from app.models import Admin
+
+
+class AuthCache:
+    """Maps a token signature to its decoded claims and Admin row
+
+    Entries live until the earlier of ``ttl`` and the token's own expiry. The
+    full token is kept alongside so a forged payload that reuses a cached
+    signature never matches.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str, Dict[str, Any], Admin]]" = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return token.rsplit(".", 1)[-1]
+
+    def get(self, token: str) -> Optional[Tuple[Dict[str, Any], Admin]]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, cached_token, claims, admin = entry
+        if expires_at <= time.monotonic() or not hmac.compare_digest(cached_token, token):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return claims, admin
+
+    def put(self, token: str, claims: Dict[str, Any], admin: Admin):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            ttl = min(ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        key = self._key(token)
+        self._entries[key] = (time.monotonic() + ttl, token, claims, admin)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        for key in [k for k, entry in self._entries.items() if entry[3].username == username]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+auth_cache = AuthCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl_seconds)
+
+
+@event.listens_for(Admin, "after_update")
+@event.listens_for(Admin, "after_delete")
+def _invalidate_admin(mapper, connection, target):
+    auth_cache.invalidate_user(target.username)
+    history = inspect(target).attrs.username.history
+    for old_name in history.deleted or ():
+        auth_cache.invalidate_user(old_name)
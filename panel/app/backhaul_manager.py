@@ -3,10 +3,14 @@ import logging
 import os
 import shutil
 import subprocess
+import threading
 import time
 from pathlib import Path
 from typing import Dict, List, Optional, Any
 
+from app.cgroups import cgroups, tunnel_leaf
+from app.log_rotation import LogPump, open_process_log
+from app.process_watcher import process_watcher
 
 logger = logging.getLogger(__name__)
 
@@ -52,7 +56,10 @@ class BackhaulManager:
         self.config_dir = Path(resolved_config)
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.processes: Dict[str, subprocess.Popen] = {}
-        self.log_handles: Dict[str, Any] = {}
+        self.log_handles: Dict[str, LogPump] = {}
+        # Starts and stops run in worker threads as well as on the loop
+        self._lock = threading.RLock()
+        self.server_specs: Dict[str, dict] = {}
         default_binary = binary_path or Path(
             os.environ.get("BACKHAUL_SERVER_BINARY", "/usr/local/bin/backhaul")
         )
@@ -63,103 +70,128 @@ class BackhaulManager:
 
     def start_server(self, tunnel_id: str, spec: dict) -> bool:
         """Start a Backhaul server for a tunnel"""
-        config_path = self.config_dir / f"{tunnel_id}.toml"
-        log_path = self.config_dir / f"backhaul_{tunnel_id}.log"
+        with self._lock:
+            config_path = self.config_dir / f"{tunnel_id}.toml"
+            log_path = self.config_dir / f"backhaul_{tunnel_id}.log"
 
-        config_content = self._build_server_config(spec or {})
-        if not config_content.strip():
-            raise ValueError("Backhaul config is empty")
+            config_content = self._build_server_config(spec or {})
+            if not config_content.strip():
+                raise ValueError("Backhaul config is empty")
 
-        config_path.write_text(config_content, encoding="utf-8")
+            config_path.write_text(config_content, encoding="utf-8")
 
-        if tunnel_id in self.processes:
-            self.stop_server(tunnel_id)
+            if tunnel_id in self.processes:
+                self.stop_server(tunnel_id)
 
-        binary_path = self._resolve_binary_path()
+            binary_path = self._resolve_binary_path()
 
-        log_fh = log_path.open("w", buffering=1)
-        log_fh.write(f"Starting Backhaul server for tunnel {tunnel_id}\n")
-        log_fh.write(config_content)
-        log_fh.flush()
+            log_fh = open_process_log(log_path)
+            log_fh.write(f"Starting Backhaul server for tunnel {tunnel_id}\n")
+            log_fh.write(config_content)
+            leaf = cgroups.prepare(tunnel_leaf(tunnel_id))
 
-        try:
-            proc = subprocess.Popen(
-                [str(binary_path), "-c", str(config_path)],
-                stdout=log_fh,
-                stderr=subprocess.STDOUT,
-                cwd=str(self.config_dir),
-                start_new_session=True,
-            )
-        except Exception:
-            log_fh.close()
-            raise
-
-        self.processes[tunnel_id] = proc
-        self.log_handles[tunnel_id] = log_fh
-
-        time.sleep(1.0)
-        if proc.poll() is not None:
-            error_output = ""
             try:
-                error_output = log_path.read_text(encoding="utf-8")[-1000:]
+                proc = subprocess.Popen(
+                    [str(binary_path), "-c", str(config_path)],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    cwd=str(self.config_dir),
+                    start_new_session=True,
+                )
             except Exception:
-                pass
-            self._cleanup_process(tunnel_id)
-            raise RuntimeError(
-                f"Backhaul server failed to start (exit code {proc.returncode}). "
-                f"Log tail: {error_output}"
-            )
+                log_fh.close()
+                raise
+
+            cgroups.attach(leaf, proc.pid)
+            self.processes[tunnel_id] = proc
+            self.log_handles[tunnel_id] = LogPump(proc.stdout, log_fh)
+
+            time.sleep(1.0)
+            if proc.poll() is not None:
+                error_output = ""
+                try:
+                    self.log_handles[tunnel_id].drain()
+                    error_output = log_path.read_text(encoding="utf-8")[-1000:]
+                except Exception:
+                    pass
+                self._cleanup_process(tunnel_id)
+                raise RuntimeError(
+                    f"Backhaul server failed to start (exit code {proc.returncode}). "
+                    f"Log tail: {error_output}"
+                )
 
-        logger.info("Started Backhaul server for tunnel %s using config %s", tunnel_id, config_path)
-        return True
+            self.server_specs[tunnel_id] = dict(spec or {})
+            process_watcher.watch(proc, "backhaul", tunnel_id, on_exit=lambda rc: self._on_process_exit(tunnel_id, proc))
+            logger.info("Started Backhaul server for tunnel %s using config %s", tunnel_id, config_path)
+            return True
 
     def stop_server(self, tunnel_id: str):
         """Stop Backhaul server for a tunnel"""
-        if tunnel_id in self.processes:
-            proc = self.processes[tunnel_id]
-            try:
-                proc.terminate()
-                proc.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-                proc.wait(timeout=5)
-            except Exception as exc:
-                logger.warning("Error stopping Backhaul server for tunnel %s: %s", tunnel_id, exc)
-            finally:
-                self._cleanup_process(tunnel_id)
-
-        config_path = self.config_dir / f"{tunnel_id}.toml"
-        if config_path.exists():
-            try:
-                config_path.unlink()
-            except Exception as exc:
-                logger.warning("Failed to remove Backhaul config %s: %s", config_path, exc)
+        with self._lock:
+            if tunnel_id in self.processes:
+                proc = self.processes[tunnel_id]
+                process_watcher.unwatch(proc)
+                try:
+                    proc.terminate()
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait(timeout=5)
+                except Exception as exc:
+                    logger.warning("Error stopping Backhaul server for tunnel %s: %s", tunnel_id, exc)
+                finally:
+                    self._cleanup_process(tunnel_id)
+
+            self.server_specs.pop(tunnel_id, None)
+            config_path = self.config_dir / f"{tunnel_id}.toml"
+            if config_path.exists():
+                try:
+                    config_path.unlink()
+                except Exception as exc:
+                    logger.warning("Failed to remove Backhaul config %s: %s", config_path, exc)
 
     def is_running(self, tunnel_id: str) -> bool:
         """Return True if server process is running"""
         proc = self.processes.get(tunnel_id)
         return proc is not None and proc.poll() is None
 
+    def restart(self, tunnel_id: str) -> bool:
+        """Start a dead server again from its last spec; False if there is nothing to restart"""
+        with self._lock:
+            spec = self.server_specs.get(tunnel_id)
+            if spec is None or self.is_running(tunnel_id):
+                return False
+            return self.start_server(tunnel_id, spec)
+
     def cleanup_all(self):
         """Stop all Backhaul servers"""
-        for tunnel_id in list(self.processes.keys()):
-            self.stop_server(tunnel_id)
+        with self._lock:
+            for tunnel_id in list(self.processes.keys()):
+                self.stop_server(tunnel_id)
 
     def get_active_servers(self) -> List[str]:
         """Return active Backhaul tunnel IDs"""
-        active = []
-        for tunnel_id, proc in list(self.processes.items()):
-            if proc.poll() is None:
-                active.append(tunnel_id)
-            else:
-                self._cleanup_process(tunnel_id)
-        return active
+        with self._lock:
+            active = []
+            for tunnel_id, proc in list(self.processes.items()):
+                if proc.poll() is None:
+                    active.append(tunnel_id)
+                else:
+                    self._cleanup_process(tunnel_id)
+            return active
+
+    def _on_process_exit(self, tunnel_id: str, proc: subprocess.Popen):
+        if self.processes.get(tunnel_id) is proc and tunnel_id in self.log_handles:
+            self.log_handles[tunnel_id].drain()
+            self.log_handles.pop(tunnel_id).close()
 
     def _cleanup_process(self, tunnel_id: str):
         if tunnel_id in self.processes:
             del self.processes[tunnel_id]
+            cgroups.release(tunnel_leaf(tunnel_id))
         if tunnel_id in self.log_handles:
             try:
+                self.log_handles[tunnel_id].drain()
                 self.log_handles[tunnel_id].close()
             except Exception:
                 pass
@@ -0,0 +1,101 @@
+"""Per-tunnel bandwidth limits from the ``rate_limit`` spec section
+
+::
+
+    "rate_limit": {"upload_mbps": 20, "download_mbps": 100, "burst_kb": 512}
+
+``upload`` is traffic from end users into the tunnel, ``download`` the
+traffic sent back to them. A missing or zero rate leaves that direction
+unlimited. The limit caps the tunnel as a whole, not each connection.
+"""
+import asyncio
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+DEFAULT_BURST_KB = 256
+MIN_BURST_BYTES = 16 * 1024
+
+
+class RateLimit(NamedTuple):
+    upload_bps: int
+    download_bps: int
+    burst_bytes: int
+
+    def burst_for(self, bps: int) -> int:
+        # At least one packet train's worth, or the shaper stalls on large writes
+        return max(self.burst_bytes, MIN_BURST_BYTES, bps // 8 // 100)
+
+
+def _mbps(section: Dict[str, Any], key: str) -> int:
+    value = section.get(key) or 0
+    try:
+        mbps = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"rate_limit.{key} must be a number of Mbit/s")
+    if mbps < 0:
+        raise ValueError(f"rate_limit.{key} must not be negative")
+    return int(mbps * 1_000_000)
+
+
+def parse_rate_limit(spec: Optional[Dict[str, Any]]) -> Optional[RateLimit]:
+    """Read ``rate_limit`` from a tunnel spec; None when the tunnel is unlimited
+
+    Raises ValueError for a malformed section so it can be rejected at the API.
+    """
+    section = (spec or {}).get("rate_limit")
+    if not section:
+        return None
+    if not isinstance(section, dict):
+        raise ValueError("rate_limit must be an object")
+    upload = _mbps(section, "upload_mbps")
+    download = _mbps(section, "download_mbps")
+    if not upload and not download:
+        return None
+    burst_kb = section.get("burst_kb") or DEFAULT_BURST_KB
+    try:
+        burst = int(float(burst_kb) * 1024)
+    except (TypeError, ValueError):
+        raise ValueError("rate_limit.burst_kb must be a number")
+    return RateLimit(upload, download, burst)
+
+
+def safe_rate_limit(spec: Optional[Dict[str, Any]]) -> Optional[RateLimit]:
+    """``parse_rate_limit`` for specs already stored, where a bad section means no limit"""
+    try:
+        return parse_rate_limit(spec)
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Byte-rate limiter shared by every connection of a forward
+
+    Consumers may overdraw the bucket and then sleep off the debt, so a
+    single large read never deadlocks on a small burst. ``set_rate`` takes
+    effect for the next chunk, which is what makes live changes possible.
+    """
+
+    def __init__(self, bps: int, burst_bytes: int):
+        self.rate = bps / 8
+        self.burst = burst_bytes
+        self.tokens = float(burst_bytes)
+        self.updated = time.monotonic()
+
+    def set_rate(self, bps: int, burst_bytes: int):
+        self._refill()
+        self.rate = bps / 8
+        self.burst = burst_bytes
+        self.tokens = min(self.tokens, float(burst_bytes))
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount: int):
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
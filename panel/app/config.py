@@ -25,6 +25,59 @@ class Settings(BaseSettings):
     hysteria2_key_path: str = "./certs/ca.key"
     
     secret_key: str = "changeme-secret-key-change-in-production"
+    auth_cache_size: int = 1024
+    auth_cache_ttl_seconds: float = 60
+    password_hash_workers: int = 2
+    password_hash_queue: int = 16
+    login_rate_limit: int = 10
+    login_rate_window_seconds: float = 60
+    
+    tunnel_log_max_bytes: int = 10 * 1024 * 1024
+    tunnel_log_backup_count: int = 5
+    tunnel_log_max_age_hours: float = 24
+    
+    log_level: str = "INFO"
+    log_format: Literal["json", "text"] = "json"
+    log_sample_burst: int = 10
+    log_sample_window_seconds: float = 60
+    
+    loop_monitor_enabled: bool = False
+    loop_monitor_threshold_ms: int = 100
+    loop_monitor_interval_ms: int = 50
+    
+    tunnel_restart_policy: Literal["always", "on-failure", "never"] = "always"
+    tunnel_restart_initial_delay: float = 1.0
+    tunnel_restart_max_delay: float = 60.0
+    tunnel_restart_crash_limit: int = 5
+    tunnel_restart_crash_window_seconds: float = 300
+    
+    bulk_apply_concurrency: int = 8
+    bulk_max_items: int = 5000
+    
+    port_auto_range_start: int = 20000
+    port_auto_range_end: int = 29999
+    
+    cgroup_enabled: bool = True
+    cgroup_root: str = "/sys/fs/cgroup/smite"
+    tunnel_cpu_max: str = "max"
+    tunnel_memory_max: str = "max"
+    tunnel_pids_max: str = "max"
+    
+    quota_check_interval_seconds: float = 5
+    
+    # Opt-in: replaces the root qdisc of the host interface (see traffic_shaper)
+    traffic_shaping_enabled: bool = False
+    traffic_shaping_interface: str = ""
+    
+    dns_cache_ttl_seconds: float = 60
+    dns_negative_ttl_seconds: float = 5
+    dns_cache_max_entries: int = 1024
+    happy_eyeballs_delay_seconds: float = 0.25
+    
+    # Idle upstream pool of "forwarder": "panel" tunnels unless their spec says otherwise
+    forward_pool_min_idle: int = 2
+    forward_pool_max_idle: int = 16
+    forward_pool_idle_ttl_seconds: float = 30
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,168 @@
+"""Cached name resolution and happy-eyeballs connects for forward targets
+
+``getaddrinfo`` runs in the loop's thread pool and reports no TTL, so
+answers are kept for ``dns_cache_ttl_seconds`` and failures for
+``dns_negative_ttl_seconds``. An expired answer is still served while a
+single background lookup refreshes it, so a hostname target costs no
+resolution latency after its first connection. Concurrent lookups of the
+same name share one ``getaddrinfo`` call.
+
+``happy_eyeballs_connect`` follows RFC 8305: addresses alternate between
+families, starting with the resolver's preferred one, and a new attempt
+starts every ``happy_eyeballs_delay_seconds`` (or as soon as one fails)
+until the first connect wins.
+"""
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+Target = Tuple[int, tuple]  # (family, sockaddr)
+
+
+def _interleave(targets: List[Target]) -> List[Target]:
+    """Alternate address families, keeping the resolver's order within each"""
+    by_family: Dict[int, List[Target]] = {}
+    for target in targets:
+        by_family.setdefault(target[0], []).append(target)
+    queues = list(by_family.values())
+    ordered = []
+    while any(queues):
+        for queue in queues:
+            if queue:
+                ordered.append(queue.pop(0))
+    return ordered
+
+
+def _literal(host: str, port: int) -> Optional[List[Target]]:
+    try:
+        ip = ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return None
+    if ip.version == 6:
+        return [(socket.AF_INET6, (str(ip), port, 0, 0))]
+    return [(socket.AF_INET, (str(ip), port))]
+
+
+class DnsCache:
+    """TTL cache of resolved TCP targets with negative caching and stale-while-refresh"""
+
+    def __init__(self, ttl: float, negative_ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # (host, port) -> (expires_at, targets, error)
+        self.entries: Dict[Tuple[str, int], Tuple[float, Optional[List[Target]], Optional[OSError]]] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Task] = {}
+
+    async def resolve(self, host: str, port: int) -> List[Target]:
+        literal = _literal(host, port)
+        if literal is not None:
+            return literal
+        key = (host, port)
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, targets, error = entry
+            if time.monotonic() < expires_at:
+                if error is not None:
+                    raise error
+                return targets
+            if targets:
+                self._lookup(key)
+                return targets
+        return await asyncio.shield(self._lookup(key))
+
+    def _lookup(self, key: Tuple[str, int]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._resolve(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _resolve(self, key: Tuple[str, int]) -> List[Target]:
+        host, port = key
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)
+            targets = _interleave(list(dict.fromkeys((family, sockaddr) for family, _, _, _, sockaddr in infos)))
+            if not targets:
+                raise socket.gaierror(socket.EAI_NONAME, f"No addresses for {host}")
+        except OSError as e:
+            previous = self.entries.get(key)
+            if previous is not None and previous[1]:
+                # Keep serving the last good answer through a resolver outage
+                self._store(key, (time.monotonic() + self.negative_ttl, previous[1], None))
+                logger.warning("Re-resolving %s failed, keeping the cached addresses: %s", host, e)
+                return previous[1]
+            self._store(key, (time.monotonic() + self.negative_ttl, None, e))
+            raise
+        self._store(key, (time.monotonic() + self.ttl, targets, None))
+        return targets
+
+    def _store(self, key, entry):
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+
+async def happy_eyeballs_connect(
+    targets: List[Target],
+    delay: float,
+    prepare: Optional[Callable[[socket.socket], None]] = None,
+) -> socket.socket:
+    """Connect to the first target that answers, staggering attempts by ``delay``"""
+    loop = asyncio.get_running_loop()
+
+    async def attempt(family: int, sockaddr: tuple) -> socket.socket:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            if prepare is not None:
+                prepare(sock)
+            sock.setblocking(False)
+            await loop.sock_connect(sock, sockaddr)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    remaining = list(targets)
+    pending: Set[asyncio.Task] = set()
+    errors: List[BaseException] = []
+    winner: Optional[socket.socket] = None
+    try:
+        while winner is None and (remaining or pending):
+            if remaining:
+                pending.add(loop.create_task(attempt(*remaining.pop(0))))
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if remaining else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result().close()
+    finally:
+        for task in pending:
+            task.cancel()
+    if winner is None:
+        if len(errors) == 1:
+            raise errors[0]
+        raise OSError(f"All {len(errors)} connection attempts failed: {'; '.join(str(e) for e in errors)}")
+    return winner
+
+
+dns_cache = DnsCache(
+    ttl=settings.dns_cache_ttl_seconds,
+    negative_ttl=settings.dns_negative_ttl_seconds,
+    max_entries=settings.dns_cache_max_entries,
+)
@@ -1,13 +1,39 @@
 """Gost-based forwarding service for stable TCP/UDP/WS/gRPC tunnels"""
 import subprocess
+import threading
 import time
 import logging
 from pathlib import Path
 from typing import Dict, Optional
 
+from app.cgroups import cgroups, tunnel_leaf
+from app.load_balancer import ROUND_ROBIN, LoadBalance, format_target, parse_targets
+from app.log_rotation import LogPump, open_process_log
+from app.process_watcher import process_watcher
+
 logger = logging.getLogger(__name__)
 
 
+def _gost_remote(forward_to: str, load_balance: LoadBalance) -> str:
+    """Gost target for ``forward_to``; several targets become a node list with a selector
+
+    gost 2 selects by round, random or fifo only and ejects targets
+    passively: ``max_fails`` failed connects take a target out of rotation
+    for ``fail_timeout``. Other strategies fall back to round robin there.
+    """
+    targets = parse_targets(forward_to)
+    remote = ",".join(format_target(target) for target in targets)
+    if len(targets) == 1:
+        return remote
+    if load_balance.strategy != ROUND_ROBIN:
+        logger.info("gost has no %s selector, balancing %s round robin", load_balance.strategy, remote)
+    params = ["strategy=round"]
+    if load_balance.health_check is not None:
+        params.append(f"max_fails={load_balance.health_check.fall}")
+        params.append(f"fail_timeout={int(load_balance.health_check.interval)}s")
+    return f"{remote}?{'&'.join(params)}"
+
+
 class GostForwarder:
     """Manages TCP/UDP/WS/gRPC forwarding using gost"""
     
@@ -16,193 +42,167 @@ class GostForwarder:
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.active_forwards: Dict[str, subprocess.Popen] = {}
         self.forward_configs: Dict[str, dict] = {}
+        self.log_pumps: Dict[str, LogPump] = {}
+        # Starts and stops run in worker threads as well as on the loop
+        self._lock = threading.RLock()
     
-    def start_forward(self, tunnel_id: str, local_port: int, forward_to: str, tunnel_type: str = "tcp", path: str = None) -> bool:
+    def start_forward(
+        self,
+        tunnel_id: str,
+        local_port: int,
+        forward_to: str,
+        tunnel_type: str = "tcp",
+        path: str = None,
+        load_balance: Optional[LoadBalance] = None,
+    ) -> bool:
         """
         Start forwarding using gost - forwards directly to target (no node)
 
         Args:
             tunnel_id: Unique tunnel identifier
             local_port: Port on panel to listen on
-            forward_to: Target address:port (e.g., "127.0.0.1:9999" or "1.2.3.4:443")
+            forward_to: Target address:port (e.g., "127.0.0.1:9999" or "1.2.3.4:443"),
+                or several of them separated by commas
             tunnel_type: Type of forwarding (tcp, udp, ws, grpc)
             path: Optional path for WS tunnels (ignored, kept for compatibility)
+            load_balance: Strategy and failure handling when there are several targets
 
         Returns:
             True if started successfully
         """
-        try:
-            if tunnel_id in self.active_forwards:
-                logger.warning(f"Forward for tunnel {tunnel_id} already exists, stopping it first")
-                self.stop_forward(tunnel_id)
-                time.sleep(0.5)
+        with self._lock:
+            try:
+                if tunnel_id in self.active_forwards:
+                    logger.warning(f"Forward for tunnel {tunnel_id} already exists, stopping it first")
+                    self.stop_forward(tunnel_id)
+                    time.sleep(0.5)
             
-            if tunnel_type == "tcp":
-                if ":" in forward_to:
-                    forward_host, forward_port = forward_to.rsplit(":", 1)
-                else:
-                    forward_host = forward_to
-                    forward_port = "8080"
-                cmd = [
-                    "/usr/local/bin/gost",
-                    f"-L=tcp://0.0.0.0:{local_port}/{forward_host}:{forward_port}"
-                ]
-            elif tunnel_type == "udp":
-                if ":" in forward_to:
-                    forward_host, forward_port = forward_to.rsplit(":", 1)
-                else:
-                    forward_host = forward_to
-                    forward_port = "8080"
-                cmd = [
-                    "/usr/local/bin/gost",
-                    f"-L=udp://0.0.0.0:{local_port}/{forward_host}:{forward_port}"
-                ]
-            elif tunnel_type == "ws":
-                if ":" in forward_to:
-                    forward_host, forward_port = forward_to.rsplit(":", 1)
-                else:
-                    forward_host = forward_to
-                    forward_port = "8080"
-                import socket
-                try:
-                    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    s.connect(("8.8.8.8", 80))
-                    bind_ip = s.getsockname()[0]
-                    s.close()
-                except Exception:
-                    bind_ip = "0.0.0.0"
-                cmd = [
-                    "/usr/local/bin/gost",
-                    f"-L=ws://{bind_ip}:{local_port}/tcp://{forward_host}:{forward_port}"
-                ]
-            elif tunnel_type == "grpc":
-                if ":" in forward_to:
-                    forward_host, forward_port = forward_to.rsplit(":", 1)
-                else:
-                    forward_host = forward_to
-                    forward_port = "8080"
-                cmd = [
-                    "/usr/local/bin/gost",
-                    f"-L=grpc://0.0.0.0:{local_port}/{forward_host}:{forward_port}"
-                ]
-            elif tunnel_type == "tcpmux":
-                if ":" in forward_to:
-                    forward_host, forward_port = forward_to.rsplit(":", 1)
+                remote = _gost_remote(forward_to, load_balance or LoadBalance())
+                if tunnel_type == "tcp":
+                    cmd = [
+                        "/usr/local/bin/gost",
+                        f"-L=tcp://0.0.0.0:{local_port}/{remote}"
+                    ]
+                elif tunnel_type == "udp":
+                    cmd = [
+                        "/usr/local/bin/gost",
+                        f"-L=udp://0.0.0.0:{local_port}/{remote}"
+                    ]
+                elif tunnel_type == "ws":
+                    import socket
+                    try:
+                        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                        s.connect(("8.8.8.8", 80))
+                        bind_ip = s.getsockname()[0]
+                        s.close()
+                    except Exception:
+                        bind_ip = "0.0.0.0"
+                    cmd = [
+                        "/usr/local/bin/gost",
+                        f"-L=ws://{bind_ip}:{local_port}/tcp://{remote}"
+                    ]
+                elif tunnel_type == "grpc":
+                    cmd = [
+                        "/usr/local/bin/gost",
+                        f"-L=grpc://0.0.0.0:{local_port}/{remote}"
+                    ]
+                elif tunnel_type == "tcpmux":
+                    cmd = [
+                        "/usr/local/bin/gost",
+                        f"-L=tcpmux://0.0.0.0:{local_port}/{remote}"
+                    ]
                 else:
-                    forward_host = forward_to
-                    forward_port = "8080"
-                cmd = [
-                    "/usr/local/bin/gost",
-                    f"-L=tcpmux://0.0.0.0:{local_port}/{forward_host}:{forward_port}"
-                ]
-            else:
-                raise ValueError(f"Unsupported tunnel type: {tunnel_type}")
+                    raise ValueError(f"Unsupported tunnel type: {tunnel_type}")
             
-            gost_binary = "/usr/local/bin/gost"
-            import os
-            if not os.path.exists(gost_binary):
-                import shutil
-                gost_binary = shutil.which("gost")
-                if not gost_binary:
-                    error_msg = "gost binary not found at /usr/local/bin/gost or in PATH"
-                    logger.error(error_msg)
-                    raise RuntimeError(error_msg)
-            else:
-                if not os.access(gost_binary, os.X_OK):
-                    error_msg = f"gost binary at {gost_binary} is not executable"
-                    logger.error(error_msg)
-                    raise RuntimeError(error_msg)
-            
-            cmd[0] = gost_binary
-            logger.info(f"Starting gost: {' '.join(cmd)}")
+                gost_binary = "/usr/local/bin/gost"
+                import os
+                if not os.path.exists(gost_binary):
+                    import shutil
+                    gost_binary = shutil.which("gost")
+                    if not gost_binary:
+                        error_msg = "gost binary not found at /usr/local/bin/gost or in PATH"
+                        logger.error(error_msg)
+                        raise RuntimeError(error_msg)
+                else:
+                    if not os.access(gost_binary, os.X_OK):
+                        error_msg = f"gost binary at {gost_binary} is not executable"
+                        logger.error(error_msg)
+                        raise RuntimeError(error_msg)
             
-            try:
-                log_file = self.config_dir / f"gost_{tunnel_id}.log"
-                log_file.parent.mkdir(parents=True, exist_ok=True)
-                log_f = open(log_file, 'w', buffering=1)
-                log_f.write(f"Starting gost with command: {' '.join(cmd)}\n")
-                log_f.write(f"Tunnel ID: {tunnel_id}\n")
-                log_f.write(f"Local port: {local_port}, Forward to: {forward_to}\n")
-                log_f.flush()
-                proc = subprocess.Popen(
-                    cmd,
-                    stdout=log_f,
-                    stderr=subprocess.STDOUT,
-                    cwd=str(self.config_dir),
-                    start_new_session=True,
-                    close_fds=False
-                )
-                log_f.write(f"Process started with PID: {proc.pid}\n")
-                log_f.flush()
-                self.active_forwards[f"{tunnel_id}_log"] = log_f
-                logger.info(f"Started gost process for tunnel {tunnel_id}, PID={proc.pid}")
-            except Exception as e:
-                error_msg = f"Failed to start gost process: {e}"
-                logger.error(error_msg, exc_info=True)
-                raise RuntimeError(error_msg)
+                cmd[0] = gost_binary
+                logger.info(f"Starting gost: {' '.join(cmd)}")
             
-            time.sleep(1.5)
-            poll_result = proc.poll()
-            if poll_result is not None:
                 try:
-                    if log_file.exists():
-                        with open(log_file, 'r') as f:
-                            stderr = f.read()
-                    else:
-                        stderr = "Log file not found"
-                    stdout = ""
+                    log_file = self.config_dir / f"gost_{tunnel_id}.log"
+                    log_f = open_process_log(log_file)
+                    log_f.write(f"Starting gost with command: {' '.join(cmd)}\n")
+                    log_f.write(f"Tunnel ID: {tunnel_id}\n")
+                    log_f.write(f"Local port: {local_port}, Forward to: {forward_to}\n")
+                    leaf = cgroups.prepare(tunnel_leaf(tunnel_id))
+                    try:
+                        proc = subprocess.Popen(
+                            cmd,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            cwd=str(self.config_dir),
+                            start_new_session=True,
+                            close_fds=False
+                        )
+                    except Exception:
+                        log_f.close()
+                        raise
+                    log_f.write(f"Process started with PID: {proc.pid}\n")
+                    cgroups.attach(leaf, proc.pid)
+                    self.log_pumps[tunnel_id] = LogPump(proc.stdout, log_f)
+                    logger.info(f"Started gost process for tunnel {tunnel_id}, PID={proc.pid}")
                 except Exception as e:
-                    stderr = f"Could not read log file: {e}"
-                    stdout = ""
-                error_msg = f"gost failed to start (exit code: {poll_result}): {stderr[-500:] if len(stderr) > 500 else stderr or 'Unknown error'}"
-                logger.error(error_msg)
-                raise RuntimeError(error_msg)
+                    error_msg = f"Failed to start gost process: {e}"
+                    logger.error(error_msg, exc_info=True)
+                    raise RuntimeError(error_msg)
             
-            if tunnel_type != "udp":
-                time.sleep(0.5)
+                time.sleep(1.5)
                 poll_result = proc.poll()
                 if poll_result is not None:
                     try:
                         if log_file.exists():
-                            with open(log_file, 'r') as f:
-                                error_output = f.read()
-                            error_msg = f"gost process died after startup (exit code: {poll_result}): {error_output[-500:] if len(error_output) > 500 else error_output}"
+                            stderr = self._read_log(tunnel_id, log_file)
                         else:
-                            error_msg = f"gost process died after startup (exit code: {poll_result}), log file not found"
-                        logger.error(error_msg)
-                        raise RuntimeError(error_msg)
+                            stderr = "Log file not found"
+                        stdout = ""
                     except Exception as e:
-                        error_msg = f"gost process died after startup (exit code: {poll_result}), could not read error: {e}"
-                        logger.error(error_msg)
-                        raise RuntimeError(error_msg)
+                        stderr = f"Could not read log file: {e}"
+                        stdout = ""
+                    error_msg = f"gost failed to start (exit code: {poll_result}): {stderr[-500:] if len(stderr) > 500 else stderr or 'Unknown error'}"
+                    logger.error(error_msg)
+                    raise RuntimeError(error_msg)
+            
+                if tunnel_type != "udp":
+                    time.sleep(0.5)
+                    poll_result = proc.poll()
+                    if poll_result is not None:
+                        try:
+                            if log_file.exists():
+                                error_output = self._read_log(tunnel_id, log_file)
+                                error_msg = f"gost process died after startup (exit code: {poll_result}): {error_output[-500:] if len(error_output) > 500 else error_output}"
+                            else:
+                                error_msg = f"gost process died after startup (exit code: {poll_result}), log file not found"
+                            logger.error(error_msg)
+                            raise RuntimeError(error_msg)
+                        except Exception as e:
+                            error_msg = f"gost process died after startup (exit code: {poll_result}), could not read error: {e}"
+                            logger.error(error_msg)
+                            raise RuntimeError(error_msg)
                 
-                if tunnel_type != "ws":
-                    import socket
-                    port_listening = False
-                    try:
-                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        sock.settimeout(1)
-                        result = sock.connect_ex(('127.0.0.1', local_port))
-                        sock.close()
-                        port_listening = (result == 0)
-                        if not port_listening:
-                            try:
-                                sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-                                sock.settimeout(1)
-                                result = sock.connect_ex(('::1', local_port))
-                                sock.close()
-                                port_listening = (result == 0)
-                            except:
-                                pass
-                        if not port_listening:
-                            time.sleep(0.5)
+                    if tunnel_type != "ws":
+                        import socket
+                        port_listening = False
+                        try:
                             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                             sock.settimeout(1)
                             result = sock.connect_ex(('127.0.0.1', local_port))
                             sock.close()
-                            if result == 0:
-                                port_listening = True
-                            else:
+                            port_listening = (result == 0)
+                            if not port_listening:
                                 try:
                                     sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
                                     sock.settimeout(1)
@@ -211,139 +211,174 @@ class GostForwarder:
                                     port_listening = (result == 0)
                                 except:
                                     pass
-                        
-                        poll_result = proc.poll()
-                        if poll_result is not None:
-                            try:
-                                if log_file.exists():
-                                    with open(log_file, 'r') as f:
-                                        error_output = f.read()
-                                    error_msg = f"gost process died after startup (exit code: {poll_result}): {error_output[-500:] if len(error_output) > 500 else error_output}"
+                            if not port_listening:
+                                time.sleep(0.5)
+                                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                                sock.settimeout(1)
+                                result = sock.connect_ex(('127.0.0.1', local_port))
+                                sock.close()
+                                if result == 0:
+                                    port_listening = True
                                 else:
-                                    error_msg = f"gost process died after startup (exit code: {poll_result}), log file not found"
-                                logger.error(error_msg)
-                                raise RuntimeError(error_msg)
-                            except Exception as e:
-                                error_msg = f"gost process died after startup (exit code: {poll_result}), could not read error: {e}"
+                                    try:
+                                        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+                                        sock.settimeout(1)
+                                        result = sock.connect_ex(('::1', local_port))
+                                        sock.close()
+                                        port_listening = (result == 0)
+                                    except:
+                                        pass
+                        
+                            poll_result = proc.poll()
+                            if poll_result is not None:
+                                try:
+                                    if log_file.exists():
+                                        error_output = self._read_log(tunnel_id, log_file)
+                                        error_msg = f"gost process died after startup (exit code: {poll_result}): {error_output[-500:] if len(error_output) > 500 else error_output}"
+                                    else:
+                                        error_msg = f"gost process died after startup (exit code: {poll_result}), log file not found"
+                                    logger.error(error_msg)
+                                    raise RuntimeError(error_msg)
+                                except Exception as e:
+                                    error_msg = f"gost process died after startup (exit code: {poll_result}), could not read error: {e}"
+                                    logger.error(error_msg)
+                                    raise RuntimeError(error_msg)
+                            elif not port_listening:
+                                logger.warning(f"Port {local_port} not listening after gost start (checked IPv4 and IPv6), but process is running. PID: {proc.pid}")
+                        except Exception as e:
+                            logger.warning(f"Could not verify port {local_port} is listening: {e}")
+                            poll_result = proc.poll()
+                            if poll_result is not None:
+                                error_msg = f"gost process died during port check (exit code: {poll_result})"
                                 logger.error(error_msg)
                                 raise RuntimeError(error_msg)
-                        elif not port_listening:
-                            logger.warning(f"Port {local_port} not listening after gost start (checked IPv4 and IPv6), but process is running. PID: {proc.pid}")
-                    except Exception as e:
-                        logger.warning(f"Could not verify port {local_port} is listening: {e}")
-                        poll_result = proc.poll()
-                        if poll_result is not None:
-                            error_msg = f"gost process died during port check (exit code: {poll_result})"
+                    else:
+                        logger.info(f"WS tunnel on port {local_port}: skipping port verification (WebSocket requires handshake)")
+                else:
+                    time.sleep(0.5)
+                    poll_result = proc.poll()
+                    if poll_result is not None:
+                        try:
+                            if log_file.exists():
+                                error_output = self._read_log(tunnel_id, log_file)
+                                error_msg = f"gost UDP process died after startup (exit code: {poll_result}): {error_output[-500:] if len(error_output) > 500 else error_output}"
+                            else:
+                                error_msg = f"gost UDP process died after startup (exit code: {poll_result}), log file not found"
+                            logger.error(error_msg)
+                            raise RuntimeError(error_msg)
+                        except Exception as e:
+                            error_msg = f"gost UDP process died after startup (exit code: {poll_result}), could not read error: {e}"
                             logger.error(error_msg)
                             raise RuntimeError(error_msg)
-                else:
-                    logger.info(f"WS tunnel on port {local_port}: skipping port verification (WebSocket requires handshake)")
-            else:
-                time.sleep(0.5)
-                poll_result = proc.poll()
-                if poll_result is not None:
-                    try:
-                        if log_file.exists():
-                            with open(log_file, 'r') as f:
-                                error_output = f.read()
-                            error_msg = f"gost UDP process died after startup (exit code: {poll_result}): {error_output[-500:] if len(error_output) > 500 else error_output}"
-                        else:
-                            error_msg = f"gost UDP process died after startup (exit code: {poll_result}), log file not found"
-                        logger.error(error_msg)
-                        raise RuntimeError(error_msg)
-                    except Exception as e:
-                        error_msg = f"gost UDP process died after startup (exit code: {poll_result}), could not read error: {e}"
-                        logger.error(error_msg)
-                        raise RuntimeError(error_msg)
             
-            self.active_forwards[tunnel_id] = proc
-            self.forward_configs[tunnel_id] = {
-                "local_port": local_port,
-                "forward_to": forward_to,
-                "tunnel_type": tunnel_type
-            }
+                self.active_forwards[tunnel_id] = proc
+                process_watcher.watch(proc, "gost", tunnel_id, on_exit=lambda rc: self._on_process_exit(tunnel_id, proc))
+                self.forward_configs[tunnel_id] = {
+                    "local_port": local_port,
+                    "forward_to": forward_to,
+                    "tunnel_type": tunnel_type,
+                    "load_balance": load_balance
+                }
             
-            logger.info(f"Started gost forwarding for tunnel {tunnel_id}: {tunnel_type}://:{local_port} -> {forward_to}, PID={proc.pid}")
-            return True
+                logger.info(f"Started gost forwarding for tunnel {tunnel_id}: {tunnel_type}://:{local_port} -> {forward_to}, PID={proc.pid}")
+                return True
             
-        except Exception as e:
-            logger.error(f"Failed to start gost forwarding for tunnel {tunnel_id}: {e}")
-            raise
+            except Exception as e:
+                logger.error(f"Failed to start gost forwarding for tunnel {tunnel_id}: {e}")
+                if tunnel_id not in self.active_forwards:
+                    self._close_log(tunnel_id)
+                    cgroups.release(tunnel_leaf(tunnel_id))
+                raise
     
     def stop_forward(self, tunnel_id: str):
         """Stop forwarding for a tunnel"""
-        if tunnel_id in self.active_forwards:
-            proc = self.active_forwards[tunnel_id]
-            try:
-                proc.terminate()
-                proc.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-                proc.wait()
-            except Exception as e:
-                logger.warning(f"Error stopping gost forward for tunnel {tunnel_id}: {e}")
-            finally:
-                del self.active_forwards[tunnel_id]
-                log_key = f"{tunnel_id}_log"
-                if log_key in self.active_forwards:
-                    try:
-                        self.active_forwards[log_key].close()
-                    except:
-                        pass
-                    del self.active_forwards[log_key]
-                logger.info(f"Stopped gost forwarding for tunnel {tunnel_id}")
-        
-        if tunnel_id in self.forward_configs:
-            config = self.forward_configs[tunnel_id]
-            local_port = config.get("local_port")
-            if local_port:
+        with self._lock:
+            if tunnel_id in self.active_forwards:
+                proc = self.active_forwards[tunnel_id]
+                process_watcher.unwatch(proc)
                 try:
-                    subprocess.run(['pkill', '-f', f'gost.*{local_port}'], timeout=3, check=False, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+                    proc.terminate()
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
                 except Exception as e:
-                    logger.debug(f"Could not cleanup port {local_port} (non-critical): {e}")
+                    logger.warning(f"Error stopping gost forward for tunnel {tunnel_id}: {e}")
+                finally:
+                    del self.active_forwards[tunnel_id]
+                    self._close_log(tunnel_id)
+                    cgroups.release(tunnel_leaf(tunnel_id))
+                    logger.info(f"Stopped gost forwarding for tunnel {tunnel_id}")
+        
+            if tunnel_id in self.forward_configs:
+                config = self.forward_configs[tunnel_id]
+                local_port = config.get("local_port")
+                if local_port:
+                    try:
+                        subprocess.run(['pkill', '-f', f'gost.*{local_port}'], timeout=3, check=False, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+                    except Exception as e:
+                        logger.debug(f"Could not cleanup port {local_port} (non-critical): {e}")
         
-        if tunnel_id in self.forward_configs:
-            del self.forward_configs[tunnel_id]
+            if tunnel_id in self.forward_configs:
+                del self.forward_configs[tunnel_id]
+    
+    def _read_log(self, tunnel_id: str, log_file: Path) -> str:
+        """Read the process log after copying any output still in the pipe"""
+        pump = self.log_pumps.get(tunnel_id)
+        if pump:
+            pump.drain()
+        return log_file.read_text(errors="replace")
+    
+    def _close_log(self, tunnel_id: str):
+        pump = self.log_pumps.pop(tunnel_id, None)
+        if pump:
+            pump.drain()
+            pump.close()
+    
+    def _on_process_exit(self, tunnel_id: str, proc: subprocess.Popen):
+        if self.active_forwards.get(tunnel_id) is proc:
+            self._close_log(tunnel_id)
     
     def is_forwarding(self, tunnel_id: str) -> bool:
         """Check if forwarding is active for a tunnel"""
         if tunnel_id not in self.active_forwards:
             return False
-        proc = self.active_forwards[tunnel_id]
-        is_alive = proc.poll() is None
-        if not is_alive and tunnel_id in self.forward_configs:
-            logger.warning(f"Gost process for tunnel {tunnel_id} died, attempting restart...")
-            try:
-                config = self.forward_configs[tunnel_id]
-                self.start_forward(
-                    tunnel_id=tunnel_id,
-                    local_port=config["local_port"],
-                    forward_to=config["forward_to"],
-                    tunnel_type=config["tunnel_type"]
-                )
-                return True
-            except Exception as e:
-                logger.error(f"Failed to restart gost for tunnel {tunnel_id}: {e}")
+        return self.active_forwards[tunnel_id].poll() is None
+    
+    def restart(self, tunnel_id: str) -> bool:
+        """Start a dead forward again from its last config; False if there is nothing to restart"""
+        with self._lock:
+            config = self.forward_configs.get(tunnel_id)
+            if not config or self.is_forwarding(tunnel_id):
                 return False
-        return is_alive
+            return self.start_forward(
+                tunnel_id=tunnel_id,
+                local_port=config["local_port"],
+                forward_to=config["forward_to"],
+                tunnel_type=config["tunnel_type"],
+                load_balance=config.get("load_balance")
+            )
     
     def get_forwarding_tunnels(self) -> list:
         """Get list of tunnel IDs with active forwarding"""
-        active = []
-        for tunnel_id, proc in list(self.active_forwards.items()):
-            if proc.poll() is None:
-                active.append(tunnel_id)
-            else:
-                del self.active_forwards[tunnel_id]
-                if tunnel_id in self.forward_configs:
-                    del self.forward_configs[tunnel_id]
-        return active
+        with self._lock:
+            active = []
+            for tunnel_id, proc in list(self.active_forwards.items()):
+                if proc.poll() is None:
+                    active.append(tunnel_id)
+                else:
+                    del self.active_forwards[tunnel_id]
+                    self._close_log(tunnel_id)
+                    if tunnel_id in self.forward_configs:
+                        del self.forward_configs[tunnel_id]
+            return active
     
     def cleanup_all(self):
         """Stop all forwarding"""
-        tunnel_ids = list(self.active_forwards.keys())
-        for tunnel_id in tunnel_ids:
-            self.stop_forward(tunnel_id)
+        with self._lock:
+            tunnel_ids = list(self.active_forwards.keys())
+            for tunnel_id in tunnel_ids:
+                self.stop_forward(tunnel_id)
 
 
 gost_forwarder = GostForwarder()
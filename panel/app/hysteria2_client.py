@@ -1,12 +1,11 @@
 """Client for panel to communicate with nodes"""
 import httpx
 import ssl
+import time
 from typing import Dict, Any, Optional
 from pathlib import Path
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.database import AsyncSessionLocal
-from app.models import Node
+from app.tunnel_registry import tunnel_registry
+from app.metrics import NODE_RPC_ERRORS, NODE_RPC_LATENCY
 
 
 class Hysteria2Client:
@@ -19,32 +18,31 @@ class Hysteria2Client:
         """
         Send request to node via HTTPS
         """
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(select(Node).where(Node.id == node_id))
-            node = result.scalar_one_or_none()
-            
-            if not node:
-                return {"status": "error", "message": f"Node {node_id} not found"}
-            
-            node_address = node.node_metadata.get("api_address", f"http://localhost:8888") if node.node_metadata else f"http://localhost:8888"
-            
-            if not node_address.startswith("http"):
-                node_address = f"http://{node_address}"
-            
-            url = f"{node_address.rstrip('/')}{endpoint}"
-            
+        node = await tunnel_registry.get_node(node_id)
+        if not node:
+            NODE_RPC_ERRORS.labels(endpoint, "node_not_found").inc()
+            return {"status": "error", "message": f"Node {node_id} not found"}
+        
+        url = f"{node.api_address}{endpoint}"
+        
+        started = time.perf_counter()
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
+                response = await client.post(url, json=data)
+                response.raise_for_status()
+                return response.json()
+        except httpx.RequestError as e:
+            NODE_RPC_ERRORS.labels(endpoint, "network").inc()
+            return {"status": "error", "message": f"Network error: {str(e)}"}
+        except httpx.HTTPStatusError as e:
+            NODE_RPC_ERRORS.labels(endpoint, "http").inc()
             try:
-                async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
-                    response = await client.post(url, json=data)
-                    response.raise_for_status()
-                    return response.json()
-            except httpx.RequestError as e:
-                return {"status": "error", "message": f"Network error: {str(e)}"}
-            except httpx.HTTPStatusError as e:
-                try:
-                    error_detail = e.response.json().get("detail", str(e))
-                except:
-                    error_detail = str(e)
-                return {"status": "error", "message": f"Node error (HTTP {e.response.status_code}): {error_detail}"}
-            except Exception as e:
-                return {"status": "error", "message": f"Error: {str(e)}"}
+                error_detail = e.response.json().get("detail", str(e))
+            except:
+                error_detail = str(e)
+            return {"status": "error", "message": f"Node error (HTTP {e.response.status_code}): {error_detail}"}
+        except Exception as e:
+            NODE_RPC_ERRORS.labels(endpoint, "other").inc()
+            return {"status": "error", "message": f"Error: {str(e)}"}
+        finally:
+            NODE_RPC_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
@@ -0,0 +1,90 @@
+"""Keyset pagination, field projection and ETags for list endpoints"""
+import base64
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request
+import orjson
+from fastapi.responses import Response
+from sqlalchemy import and_, or_
+
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(ordered_at: Optional[datetime], row_id: str) -> str:
+    raw = json.dumps([ordered_at.isoformat() if ordered_at else "", row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ordered_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (datetime.fromisoformat(ordered_at) if ordered_at else None), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """Split a ``fields=a,b`` query parameter, rejecting unknown names"""
+    if not fields:
+        return None
+    allowed = list(allowed)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return [f for f in allowed if f in requested]
+
+
+def apply_keyset(query, model, cursor: Optional[str], limit: Optional[int], order_column=None):
+    """Order by (``order_column``, id) and continue after ``cursor``
+
+    ``order_column`` defaults to ``model.created_at``. One extra row is fetched
+    so :func:`split_page` can tell whether there is a next page.
+    """
+    order_column = order_column if order_column is not None else model.created_at
+    query = query.order_by(order_column, model.id)
+    if cursor:
+        ordered_at, row_id = decode_cursor(cursor)
+        if ordered_at is None:
+            query = query.where(or_(order_column.isnot(None), model.id > row_id))
+        else:
+            query = query.where(or_(
+                order_column > ordered_at,
+                and_(order_column == ordered_at, model.id > row_id),
+            ))
+    if limit:
+        query = query.limit(limit + 1)
+    return query
+
+
+def split_page(rows: Sequence[Any], limit: Optional[int], order_key: str = "created_at") -> Tuple[Sequence[Any], Optional[str]]:
+    """Trim the look-ahead row and build the cursor for the next page"""
+    if not limit or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, order_key), last.id)
+
+
+def etag_response(request: Request, payload: Any, next_cursor: Optional[str] = None) -> Response:
+    """Serialize ``payload`` and answer 304 when the client already has this exact body
+
+    ``payload`` is encoded by orjson as-is (datetimes included), so callers hand
+    over plain dicts and skip the response_model validate-then-encode pass.
+    """
+    body = orjson.dumps(payload)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
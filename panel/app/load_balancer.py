@@ -0,0 +1,274 @@
+"""Spreading one forward over several targets
+
+A gost or in-process forward may list more than one target::
+
+    "forward_to": ["10.0.0.1:443", "10.0.0.2:443"],
+    "load_balance": {
+        "strategy": "least_conn",
+        "health_check": {"interval_seconds": 5, "timeout_seconds": 2, "fall": 2, "rise": 1}
+    }
+
+``forward_to`` may also be a comma separated string. Strategies are
+``round_robin`` (the default), ``least_conn`` and ``ip_hash``, a consistent
+hash of the client address so a client keeps hitting the same target and
+only the clients of a removed target move. ``"health_check": null`` turns
+active checks off; failed connects still count against a target either way.
+"""
+import asyncio
+import hashlib
+import logging
+import socket
+from bisect import bisect
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = "round_robin"
+LEAST_CONN = "least_conn"
+IP_HASH = "ip_hash"
+STRATEGIES = (ROUND_ROBIN, LEAST_CONN, IP_HASH)
+
+DEFAULT_PORT = 8080
+# Points per target on the hash ring; enough for an even spread of a few dozen targets
+RING_REPLICAS = 64
+
+Target = Tuple[str, int]
+
+
+class HealthCheck(NamedTuple):
+    interval: float = 5.0
+    timeout: float = 2.0
+    fall: int = 2
+    rise: int = 1
+
+
+DEFAULT_HEALTH_CHECK = HealthCheck()
+
+
+class LoadBalance(NamedTuple):
+    strategy: str = ROUND_ROBIN
+    health_check: Optional[HealthCheck] = DEFAULT_HEALTH_CHECK
+
+
+def _split_target(entry: str) -> Target:
+    entry = entry.strip()
+    if entry.startswith("["):
+        host, _, port = entry[1:].partition("]")
+        port = port.lstrip(":")
+    elif entry.count(":") == 1:
+        host, port = entry.split(":")
+    else:
+        host, port = entry, ""  # bare hostname or IPv6 literal
+    if not host:
+        raise ValueError(f"forward_to target {entry!r} has no host")
+    try:
+        port = int(port) if port else DEFAULT_PORT
+    except ValueError:
+        raise ValueError(f"forward_to target {entry!r} has an invalid port")
+    if not 0 < port < 65536:
+        raise ValueError(f"forward_to target {entry!r} has an invalid port")
+    return host, port
+
+
+def parse_targets(forward_to: Any) -> List[Target]:
+    """``forward_to`` as a list of (host, port); raises ValueError when malformed"""
+    if isinstance(forward_to, str):
+        entries = [entry for entry in forward_to.split(",") if entry.strip()]
+    elif isinstance(forward_to, (list, tuple)):
+        if not all(isinstance(entry, str) for entry in forward_to):
+            raise ValueError("forward_to entries must be host:port strings")
+        entries = list(forward_to)
+    else:
+        raise ValueError("forward_to must be a host:port string or a list of them")
+    if not entries:
+        raise ValueError("forward_to has no targets")
+    return list(dict.fromkeys(_split_target(entry) for entry in entries))
+
+
+def format_target(target: Target) -> str:
+    host, port = target
+    return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+
+
+def _positive(section: Dict[str, Any], key: str, default: float) -> float:
+    value = section.get(key, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"load_balance.health_check.{key} must be a number")
+    if value <= 0:
+        raise ValueError(f"load_balance.health_check.{key} must be positive")
+    return value
+
+
+def parse_load_balance(spec: Optional[Dict[str, Any]]) -> LoadBalance:
+    """Read ``load_balance`` from a tunnel spec; raises ValueError when malformed"""
+    section = (spec or {}).get("load_balance")
+    if section is None:
+        return LoadBalance()
+    if not isinstance(section, dict):
+        raise ValueError("load_balance must be an object")
+    strategy = section.get("strategy") or ROUND_ROBIN
+    if strategy not in STRATEGIES:
+        raise ValueError(f"load_balance.strategy must be one of {', '.join(STRATEGIES)}")
+    if "health_check" in section and section["health_check"] is None:
+        return LoadBalance(strategy, None)
+    check = section.get("health_check") or {}
+    if not isinstance(check, dict):
+        raise ValueError("load_balance.health_check must be an object or null")
+    defaults = DEFAULT_HEALTH_CHECK
+    return LoadBalance(strategy, HealthCheck(
+        interval=_positive(check, "interval_seconds", defaults.interval),
+        timeout=_positive(check, "timeout_seconds", defaults.timeout),
+        fall=int(_positive(check, "fall", defaults.fall)),
+        rise=int(_positive(check, "rise", defaults.rise)),
+    ))
+
+
+def safe_load_balance(spec: Optional[Dict[str, Any]]) -> LoadBalance:
+    """``parse_load_balance`` for specs already stored, where a bad section means the defaults"""
+    try:
+        return parse_load_balance(spec)
+    except ValueError:
+        return LoadBalance()
+
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class Backend:
+    """One target of a balanced forward and its health"""
+
+    __slots__ = ("host", "port", "healthy", "active", "fails", "passes", "pool")
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.healthy = True
+        self.active = 0
+        self.fails = 0
+        self.passes = 0
+        self.pool = None  # Optional UpstreamPool, owned by the forwarder
+
+    @property
+    def address(self) -> str:
+        return format_target((self.host, self.port))
+
+
+class TargetBalancer:
+    """Orders a forward's targets per connection and tracks their health"""
+
+    def __init__(
+        self,
+        targets: Sequence[Target],
+        load_balance: LoadBalance,
+        probe: Callable[[str, int], Awaitable[socket.socket]],
+    ):
+        self.backends = [Backend(host, port) for host, port in targets]
+        self.strategy = load_balance.strategy
+        self.health_check = load_balance.health_check
+        self.probe = probe
+        self._next = 0
+        self._ring: List[int] = []
+        self._ring_backends: List[Backend] = []
+        if self.strategy == IP_HASH:
+            points = sorted(
+                (_ring_hash(f"{backend.address}#{replica}"), index)
+                for index, backend in enumerate(self.backends)
+                for replica in range(RING_REPLICAS)
+            )
+            self._ring = [point for point, _ in points]
+            self._ring_backends = [self.backends[index] for _, index in points]
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.health_check is not None and len(self.backends) > 1:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def candidates(self, client_ip: Optional[str]) -> List[Backend]:
+        """Targets to try for a new connection, best first
+
+        Unhealthy targets are left out; if none is healthy all of them are
+        tried, since a failing health check is better than refusing outright.
+        """
+        backends = self.backends
+        if len(backends) == 1:
+            return backends
+        healthy = [backend for backend in backends if backend.healthy] or backends
+        if self.strategy == IP_HASH and client_ip:
+            return self._ring_order(client_ip, healthy)
+        start = self._next % len(healthy)
+        self._next += 1
+        ordered = healthy[start:] + healthy[:start]
+        if self.strategy == LEAST_CONN:
+            # Stable sort: ties keep the rotation, so equal targets still alternate
+            ordered.sort(key=lambda backend: backend.active)
+        return ordered
+
+    def _ring_order(self, client_ip: str, healthy: List[Backend]) -> List[Backend]:
+        allowed = set(map(id, healthy))
+        ordered: List[Backend] = []
+        seen = set()
+        start = bisect(self._ring, _ring_hash(client_ip))
+        ring = self._ring_backends
+        for offset in range(len(ring)):
+            backend = ring[(start + offset) % len(ring)]
+            if id(backend) in allowed and id(backend) not in seen:
+                seen.add(id(backend))
+                ordered.append(backend)
+                if len(ordered) == len(healthy):
+                    break
+        return ordered
+
+    def acquire(self, backend: Backend):
+        backend.active += 1
+
+    def release(self, backend: Backend):
+        backend.active -= 1
+
+    def report(self, backend: Backend, ok: bool):
+        """Count a connect or probe result; ``fall`` failures eject, ``rise`` passes restore"""
+        check = self.health_check or DEFAULT_HEALTH_CHECK
+        fall, rise = check.fall, check.rise
+        if ok:
+            backend.fails = 0
+            backend.passes += 1
+            if not backend.healthy and backend.passes >= rise:
+                backend.healthy = True
+                logger.info("Forward target %s is healthy again", backend.address)
+        else:
+            backend.passes = 0
+            backend.fails += 1
+            if backend.healthy and backend.fails >= fall and len(self.backends) > 1:
+                backend.healthy = False
+                logger.warning("Forward target %s is unhealthy, taking it out of rotation", backend.address)
+
+    async def _check(self, backend: Backend):
+        try:
+            sock = await asyncio.wait_for(self.probe(backend.host, backend.port), timeout=self.health_check.timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.report(backend, False)
+            return
+        sock.close()
+        self.report(backend, True)
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(*(self._check(backend) for backend in self.backends))
+            await asyncio.sleep(self.health_check.interval)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [
+            {"target": backend.address, "healthy": backend.healthy, "active": backend.active}
+            for backend in self.backends
+        ]
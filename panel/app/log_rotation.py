@@ -0,0 +1,308 @@
+"""Rotating log sinks for tunnel process output"""
+import asyncio
+import concurrent.futures
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Optional, Union
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Compression runs off the event loop; a single worker keeps generations ordered
+_compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compress")
+
+READ_CHUNK = 64 * 1024
+MAX_CHUNKS_PER_WAKEUP = 16
+# How long a worker thread waits for the loop to drain or close a pump
+CROSS_THREAD_TIMEOUT = 5.0
+
+# Loop that pumps created from worker threads hand their pipe to
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def bind_event_loop(loop: asyncio.AbstractEventLoop):
+    """Let pumps started from worker threads be driven by ``loop`` instead of a thread each"""
+    global _event_loop
+    _event_loop = loop
+
+
+class RotatingLogFile:
+    """Log file capped by size and age, keeping N gzip-compressed generations
+
+    Generations are named ``<file>.1.gz`` (newest) to ``<file>.N.gz`` (oldest).
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        max_age_seconds: float = 0,
+    ):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._fh: Optional[IO[bytes]] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._pending = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists() and self.path.stat().st_size > 0:
+            self._rotate_file()
+        self._open()
+
+    def _open(self):
+        self._fh = open(self.path, "ab", buffering=0)
+        self._size = os.fstat(self._fh.fileno()).st_size
+        self._opened_at = time.monotonic()
+
+    def write(self, data: Union[bytes, str]):
+        """Append data, rotating first if it would exceed the size or age cap"""
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        with self._lock:
+            if self._fh is None:
+                return
+            if self._should_rotate(len(data)):
+                self._fh.close()
+                self._rotate_file()
+                self._open()
+            self._fh.write(data)
+            self._size += len(data)
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self._size == 0:
+            return False
+        if self.max_bytes > 0 and self._size + incoming > self.max_bytes:
+            return True
+        if self.max_age_seconds > 0 and time.monotonic() - self._opened_at >= self.max_age_seconds:
+            return True
+        return False
+
+    def _rotate_file(self):
+        if self.backup_count <= 0:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            return
+        self._pending += 1
+        pending = self.path.with_name(f"{self.path.name}.{os.getpid()}.{self._pending}.pending")
+        try:
+            os.replace(self.path, pending)
+        except FileNotFoundError:
+            return
+        _compressor.submit(self._compress_generation, pending)
+
+    def _compress_generation(self, pending: Path):
+        try:
+            for index in range(self.backup_count - 1, 0, -1):
+                src = self.path.with_name(f"{self.path.name}.{index}.gz")
+                if src.exists():
+                    os.replace(src, self.path.with_name(f"{self.path.name}.{index + 1}.gz"))
+            target = self.path.with_name(f"{self.path.name}.1.gz")
+            with open(pending, "rb") as src_fh, gzip.open(target, "wb", compresslevel=6) as dst_fh:
+                shutil.copyfileobj(src_fh, dst_fh, READ_CHUNK)
+            pending.unlink()
+        except Exception as e:
+            logger.warning(f"Failed to compress rotated log {pending}: {e}")
+
+    def rotate(self):
+        """Force a rotation now"""
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.close()
+            self._rotate_file()
+            self._open()
+
+    def reopen(self):
+        """Reopen the file handle, e.g. after an external tool moved it"""
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.close()
+            self._open()
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                try:
+                    self._fh.close()
+                finally:
+                    self._fh = None
+
+    @property
+    def closed(self) -> bool:
+        return self._fh is None
+
+
+class LogPump:
+    """Copies a child process's output pipe into a RotatingLogFile
+
+    Inside a running event loop the pipe is drained by a reader callback, so no
+    thread is spent per process; otherwise a daemon thread does the copying.
+    The reader owns the fd, so ``drain`` and ``close`` from a worker thread
+    are handed to the loop instead of racing it.
+
+    Tying the child to the pipe is deliberate. The panel never adopts
+    processes: on startup it restores tunnels by starting fresh ones on the
+    same ports, so a child that outlived the panel would only hold its port
+    against its replacement. When the panel goes away without stopping them,
+    children die of SIGPIPE on their next line of output, and at once in the
+    container, where the panel is PID 1. Only ``close`` after the child was
+    stopped gives up the reading end while the panel runs.
+    """
+
+    def __init__(self, pipe: IO[bytes], sink: RotatingLogFile):
+        self.pipe = pipe
+        self.fd = pipe.fileno()
+        self.sink = sink
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        on_loop = True
+        try:
+            self._loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            on_loop = False
+            self._loop = _event_loop if _event_loop is not None and _event_loop.is_running() else None
+
+        if self._loop is not None:
+            os.set_blocking(self.fd, False)
+            if on_loop:
+                self._attach()
+            else:
+                self._loop.call_soon_threadsafe(self._attach)
+        else:
+            self._thread = threading.Thread(
+                target=self._run, name=f"log-pump-{sink.path.name}", daemon=True
+            )
+            self._thread.start()
+
+    def _attach(self):
+        if not self._closed:
+            self._loop.add_reader(self.fd, self._read_available, MAX_CHUNKS_PER_WAKEUP)
+
+    def _read_available(self, max_chunks: int = 0) -> bool:
+        """Copy pending output; returns False once the child closed the pipe"""
+        chunks = 0
+        while not self._closed:
+            try:
+                chunk = os.read(self.fd, READ_CHUNK)
+            except BlockingIOError:
+                return True
+            except OSError:
+                chunk = b""
+            if not chunk:
+                self.close()
+                return False
+            self.sink.write(chunk)
+            chunks += 1
+            if max_chunks and chunks >= max_chunks:
+                return True
+        return False
+
+    def _run(self):
+        try:
+            while not self._closed:
+                chunk = os.read(self.fd, READ_CHUNK)
+                if not chunk:
+                    break
+                self.sink.write(chunk)
+        except OSError:
+            pass
+        finally:
+            self._closed = True
+            try:
+                self.pipe.close()
+            except Exception:
+                pass
+            self.sink.close()
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _call_on_loop(self, func):
+        """Run ``func`` on the pump's loop and wait for it; the fd is only touched there"""
+        done = concurrent.futures.Future()
+
+        def call():
+            try:
+                done.set_result(func())
+            except BaseException as e:
+                done.set_exception(e)
+
+        try:
+            self._loop.call_soon_threadsafe(call)
+        except RuntimeError:
+            # Loop closed: nobody else can be reading the fd any more
+            return func()
+        try:
+            return done.result(timeout=CROSS_THREAD_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            logger.warning("Event loop did not service log pump %s in time", self.sink.path.name)
+            return None
+
+    def drain(self):
+        """Copy everything the child has written so far into the log file"""
+        if self._loop is None or self._closed:
+            return
+        if self._on_loop():
+            self._read_available()
+        else:
+            self._call_on_loop(self._read_available)
+
+    def close(self):
+        """Stop pumping; safe to call from worker threads, the pipe is closed on its loop"""
+        if self._closed:
+            return
+        if self._thread is not None:
+            self._closed = True
+            self.sink.close()
+            # The pump thread owns the pipe and closes it when the child exits
+            return
+        if self._on_loop() or self._loop.is_closed():
+            self._close_on_loop()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._close_on_loop)
+            except RuntimeError:
+                self._close_on_loop()
+
+    def _close_on_loop(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.sink.close()
+        if not self._loop.is_closed():
+            try:
+                self._loop.remove_reader(self.fd)
+            except Exception:
+                pass
+        try:
+            self.pipe.close()
+        except Exception:
+            pass
+
+
+def open_process_log(path: Union[str, Path]) -> RotatingLogFile:
+    """Open a tunnel process log using the configured rotation limits"""
+    return RotatingLogFile(
+        path,
+        max_bytes=settings.tunnel_log_max_bytes,
+        backup_count=settings.tunnel_log_backup_count,
+        max_age_seconds=settings.tunnel_log_max_age_hours * 3600,
+    )
@@ -0,0 +1,146 @@
+"""Logging pipeline: records are queued as-is and formatted on a listener thread"""
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+STRUCTURED_FIELDS = ("tunnel_id", "node_id", "core")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_default_fields: Dict[str, Any] = {}
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records untouched so no message formatting happens on the caller"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Rate-limits high-frequency records logged with ``extra={"sample": True}``
+
+    Per (logger, message template) the first ``burst`` records of each window
+    pass; the rest are dropped and counted on the next record that gets through.
+    Opted-in warnings are sampled too, since the hot-path failures that flood
+    are logged at that level; errors always pass.
+    """
+
+    def __init__(self, burst: int, window_seconds: float):
+        super().__init__()
+        self.burst = burst
+        self.window_seconds = window_seconds
+        self._windows: Dict[Tuple[str, Any], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or not getattr(record, "sample", False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.window_seconds:
+            if window is not None and window[1] > self.burst:
+                record.suppressed = window[1] - self.burst
+            self._windows[key] = [now, 1]
+            return True
+        window[1] += 1
+        return window[1] <= self.burst
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with tunnel_id/node_id/core lifted to top-level keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is None:
+                value = _default_fields.get(field)
+            if value is not None:
+                entry[field] = value
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ContextAdapter(logging.LoggerAdapter):
+    """Logger adapter that merges bound fields with any per-call ``extra``"""
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get("extra")
+        kwargs["extra"] = {**self.extra, **extra} if extra else self.extra
+        return msg, kwargs
+
+
+def bind(logger: logging.Logger, **fields: Any) -> ContextAdapter:
+    """Return a logger that tags every record with the given structured fields"""
+    return ContextAdapter(logger, {k: v for k, v in fields.items() if v})
+
+
+def set_default_fields(**fields: Any):
+    """Set fields added to every JSON record that does not carry its own value"""
+    _default_fields.update({k: v for k, v in fields.items() if v is not None})
+
+
+def configure_logging():
+    """Route the root logger through a queue drained by a background listener"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    if settings.log_format == "json":
+        stream.setFormatter(JSONFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    handlers = [stream]
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+        handlers.append(existing)
+
+    # uvicorn installs its own synchronous handlers before importing the app
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uv_logger = logging.getLogger(name)
+        uv_logger.handlers.clear()
+        uv_logger.propagate = True
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.log_sample_burst, settings.log_sample_window_seconds))
+    root.addHandler(queue_handler)
+    root.setLevel(settings.log_level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def add_handler(handler: logging.Handler):
+    """Attach a handler that runs on the listener thread"""
+    if _listener is None:
+        logging.getLogger().addHandler(handler)
+        return
+    _listener.handlers = _listener.handlers + (handler,)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
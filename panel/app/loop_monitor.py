@@ -0,0 +1,169 @@
+"""Event loop stall detector
+
+A heartbeat coroutine stamps the time every ``interval``; a watchdog thread
+notices when the stamp goes stale and samples the loop thread's stack while it
+is still blocked, so the report names the call that froze the loop.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.metrics import EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+STACK_DEPTH = 12
+
+
+class LoopMonitor:
+    """Tracks event loop stalls and aggregates them by blocking call site"""
+
+    def __init__(self, threshold: float, interval: float, max_offenders: int = 100):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_offenders = max_offenders
+        self.offenders: Dict[str, Dict[str, Any]] = {}
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.enabled = False
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._current_key: Optional[str] = None
+        self._current_beat = 0.0
+
+    def start(self):
+        """Start monitoring the running event loop"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Event loop monitor started (threshold=%.0fms, interval=%.0fms)",
+            self.threshold * 1000,
+            self.interval * 1000,
+        )
+
+    async def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - expected
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self):
+        poll = max(self.threshold / 4, 0.005)
+        while not self._stop.wait(poll):
+            beat = self._last_beat
+            stalled_for = time.monotonic() - beat - self.interval
+            if stalled_for < self.threshold:
+                self._current_key = None
+                continue
+            if beat != self._current_beat or self._current_key is None:
+                self._current_beat = beat
+                self._current_key = self._capture(stalled_for)
+            else:
+                self._extend(self._current_key, stalled_for)
+
+    def _capture(self, stalled_for: float) -> Optional[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)[-STACK_DEPTH:]
+        del frame
+        if not stack:
+            return None
+        top = stack[-1]
+        key = f"{top.filename}:{top.lineno} in {top.name}"
+        now = time.time()
+        self.stalls += 1
+        EVENT_LOOP_STALLS.inc()
+        with self._lock:
+            entry = self.offenders.get(key)
+            if entry is None:
+                if len(self.offenders) >= self.max_offenders:
+                    smallest = min(self.offenders, key=lambda k: self.offenders[k]["total_ms"])
+                    del self.offenders[smallest]
+                entry = {
+                    "location": key,
+                    "count": 0,
+                    "max_ms": 0.0,
+                    "total_ms": 0.0,
+                    "last_seen": now,
+                    "stack": [f"{f.filename}:{f.lineno} in {f.name}: {f.line}" for f in stack],
+                }
+                self.offenders[key] = entry
+            entry["count"] += 1
+            entry["last_seen"] = now
+            entry["_stall_ms"] = stalled_for * 1000
+            entry["total_ms"] += stalled_for * 1000
+            entry["max_ms"] = max(entry["max_ms"], stalled_for * 1000)
+        logger.warning("Event loop blocked for over %.0fms at %s", stalled_for * 1000, key)
+        return key
+
+    def _extend(self, key: str, stalled_for: float):
+        with self._lock:
+            entry = self.offenders.get(key)
+            if entry is None:
+                return
+            stalled_ms = stalled_for * 1000
+            entry["total_ms"] += stalled_ms - entry["_stall_ms"]
+            entry["_stall_ms"] = stalled_ms
+            entry["max_ms"] = max(entry["max_ms"], stalled_ms)
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        """Worst blocking call sites, ordered by total time the loop was stalled"""
+        with self._lock:
+            offenders: List[Dict[str, Any]] = sorted(
+                ({k: v for k, v in entry.items() if not k.startswith("_")} for entry in self.offenders.values()),
+                key=lambda entry: entry["total_ms"],
+                reverse=True,
+            )[:limit]
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "offenders": offenders,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.offenders.clear()
+        self.stalls = 0
+        self.max_lag = 0.0
+
+
+loop_monitor = LoopMonitor(
+    threshold=settings.loop_monitor_threshold_ms / 1000,
+    interval=settings.loop_monitor_interval_ms / 1000,
+)
@@ -0,0 +1,208 @@
+"""Prometheus metrics for the panel"""
+import asyncio
+import time
+from typing import Callable, Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+from app.session_table import (
+    BYTES_DOWN, BYTES_UP, CLOSED, CONNECT_BUCKETS, CONNECT_FAILED, CONNECT_TIMEOUTS, OPENED, POOL_HITS,
+    SessionTable,
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUEST_LATENCY = Histogram(
+    "smite_http_request_duration_seconds",
+    "HTTP request latency by API router",
+    ["router", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+NODE_RPC_LATENCY = Histogram(
+    "smite_node_rpc_duration_seconds",
+    "Latency of panel-to-node RPC calls",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+NODE_RPC_ERRORS = Counter(
+    "smite_node_rpc_errors_total",
+    "Failed panel-to-node RPC calls",
+    ["endpoint", "reason"],
+)
+TUNNEL_PROCESS_RESTARTS = Counter(
+    "smite_tunnel_process_restarts_total",
+    "Tunnel process restarts",
+    ["core"],
+)
+TUNNEL_USAGE_BYTES = Counter(
+    "smite_tunnel_usage_bytes_total",
+    "Traffic reported by nodes per tunnel",
+    ["tunnel_id"],
+)
+TUNNEL_LIMIT_CUTOFFS = Counter(
+    "smite_tunnel_limit_cutoffs_total",
+    "Tunnels stopped for running out of quota or passing their expiry",
+    ["reason"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "smite_event_loop_lag_seconds",
+    "Delay between a scheduled event loop wakeup and when it actually ran",
+    buckets=LAG_BUCKETS,
+)
+EVENT_LOOP_STALLS = Counter(
+    "smite_event_loop_stalls_total",
+    "Event loop stalls longer than the loop monitor threshold",
+)
+
+
+def forget_tunnel(tunnel_id: str):
+    """Drop a removed tunnel's series so /metrics does not keep every tunnel ever seen"""
+    try:
+        TUNNEL_USAGE_BYTES.remove(tunnel_id)
+    except KeyError:
+        pass
+
+
+class TunnelProcessCollector:
+    """Counts running tunnel processes per core at scrape time"""
+
+    def __init__(self):
+        self.sources: Dict[str, Callable[[], int]] = {}
+
+    def collect(self):
+        family = GaugeMetricFamily(
+            "smite_tunnel_processes",
+            "Running tunnel processes by core",
+            labels=["core"],
+        )
+        for core, count in self.sources.items():
+            try:
+                family.add_metric([core], count())
+            except Exception:
+                continue
+        yield family
+
+
+tunnel_processes = TunnelProcessCollector()
+REGISTRY.register(tunnel_processes)
+
+
+def register_process_source(core: str, count: Callable[[], int]):
+    """Register a callable returning the number of running processes for a core"""
+    tunnel_processes.sources[core] = count
+
+
+class ForwardSessionCollector:
+    """Reads the in-process forwarder's session tables at scrape time"""
+
+    EVENTS = (
+        ("opened", OPENED),
+        ("closed", CLOSED),
+        ("connect_failed", CONNECT_FAILED),
+        ("connect_timeout", CONNECT_TIMEOUTS),
+        ("pool_hit", POOL_HITS),
+    )
+
+    def __init__(self):
+        self.source: Optional[Callable[[], Dict[int, SessionTable]]] = None
+
+    def collect(self):
+        connections = CounterMetricFamily(
+            "smite_forward_connections",
+            "Forwarder connection events by listening port",
+            labels=["port", "event"],
+        )
+        active = GaugeMetricFamily(
+            "smite_forward_active_connections",
+            "Open forwarder connections by listening port",
+            labels=["port"],
+        )
+        relayed = CounterMetricFamily(
+            "smite_forward_bytes",
+            "Bytes relayed by the forwarder by listening port and direction",
+            labels=["port", "direction"],
+        )
+        connect_time = HistogramMetricFamily(
+            "smite_forward_connect_duration_seconds",
+            "Time to connect to the forward target",
+            labels=["port"],
+        )
+        tables = self.source() if self.source else {}
+        for port, table in list(tables.items()):
+            label = str(port)
+            for event, index in self.EVENTS:
+                connections.add_metric([label, event], table.counters[index])
+            active.add_metric([label], table.active)
+            relayed.add_metric([label, "up"], table.counters[BYTES_UP])
+            relayed.add_metric([label, "down"], table.counters[BYTES_DOWN])
+            buckets, cumulative = [], 0
+            for bound, hits in zip(CONNECT_BUCKETS + (float("inf"),), table.connect_hist):
+                cumulative += hits
+                buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+            connect_time.add_metric([label], buckets, table.connect_sum)
+        yield connections
+        yield active
+        yield relayed
+        yield connect_time
+
+
+forward_sessions = ForwardSessionCollector()
+REGISTRY.register(forward_sessions)
+
+
+def register_forward_source(tables: Callable[[], Dict[int, SessionTable]]):
+    """Register a callable returning the forwarder's session tables by port"""
+    forward_sessions.source = tables
+
+
+def router_label(path: str) -> str:
+    """Map a request path to the router that serves it (``/api/<router>/...``)"""
+    if path.startswith("/api/"):
+        return path[5:].split("/", 1)[0] or "api"
+    if path == "/metrics":
+        return "metrics"
+    return "frontend"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per router"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(
+                router_label(scope["path"]), scope["method"], str(status_code)
+            ).observe(time.perf_counter() - start)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Sample event loop lag by measuring how late a fixed sleep wakes up"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+def render_metrics():
+    """Return the exposition payload and its content type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,5 +1,5 @@
 """Database models"""
-from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, Boolean, Text
+from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, Boolean, Text, Index
 from sqlalchemy.dialects.sqlite import DATETIME as SQLiteDATETIME
 from datetime import datetime
 from app.database import Base
@@ -21,6 +21,11 @@ class Node(Base):
     last_seen = Column(DateTime, default=datetime.utcnow)
     node_metadata = Column("metadata", JSON, default=dict)
     
+    __table_args__ = (
+        Index("ix_nodes_registered_at_id", "registered_at", "id"),
+        Index("ix_nodes_status", "status"),
+    )
+    
 
 class Tunnel(Base):
     __tablename__ = "tunnels"
@@ -39,6 +44,14 @@ class Tunnel(Base):
     revision = Column(Integer, default=1)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_tunnels_created_at_id", "created_at", "id"),
+        Index("ix_tunnels_status", "status"),
+        Index("ix_tunnels_core", "core"),
+        Index("ix_tunnels_node_id", "node_id"),
+        Index("ix_tunnels_type", "type"),
+    )
 
 
 class Admin(Base):
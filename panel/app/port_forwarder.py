@@ -1,12 +1,93 @@
-"""Port forwarding service for panel to forward connections to nodes"""
+"""Port forwarding service for panel to forward connections to nodes
+
+A tcp xray tunnel is served by a gost child by default. With
+``"forwarder": "panel"`` in its spec the panel relays it in process instead,
+which is what enables the ``pool`` section (see upstream_pool) and
+``proxy_protocol`` (see proxy_protocol).
+"""
 import asyncio
 import socket
-from typing import Dict, Optional
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Tuple
 from asyncio import StreamReader, StreamWriter
 import logging
 
+from app.bandwidth import RateLimit, TokenBucket
+from app.config import settings
+from app.dns_cache import dns_cache, happy_eyeballs_connect
+from app.load_balancer import Backend, LoadBalance, Target, TargetBalancer, parse_targets
+from app.proxy_protocol import header_encoder, parse_proxy_protocol
+from app.session_table import DOWN, UP, SessionTable
+from app.upstream_pool import PoolSettings, UpstreamPool, parse_pool
+
 logger = logging.getLogger(__name__)
 
+CONNECT_TIMEOUT_SECONDS = 10.0
+# Targets tried for one client before giving up on it
+MAX_CONNECT_ATTEMPTS = 2
+
+GOST = "gost"
+PANEL = "panel"
+FORWARDERS = (GOST, PANEL)
+PANEL_TYPES = frozenset({"tcp"})
+
+
+class ForwardOptions(NamedTuple):
+    forwarder: str = GOST
+    pool: Optional[PoolSettings] = None
+    proxy_protocol: Optional[int] = None
+
+
+def parse_forward_options(spec: Optional[Dict[str, Any]], tunnel_type: Optional[str] = None) -> ForwardOptions:
+    """Read ``forwarder``, ``pool`` and ``proxy_protocol`` from a tunnel spec; raises ValueError when malformed
+
+    A forward that sends PROXY headers keeps no pool: a warm connection sits
+    idle before its header can be written, and backends drop connections
+    that send no header within their read timeout.
+    """
+    spec = spec or {}
+    forwarder = spec.get("forwarder") or GOST
+    if forwarder not in FORWARDERS:
+        raise ValueError(f"forwarder must be one of {', '.join(FORWARDERS)}")
+    proxy_protocol = parse_proxy_protocol(spec)
+    if forwarder != PANEL:
+        for key in ("pool", "proxy_protocol"):
+            if spec.get(key) is not None:
+                raise ValueError(f'{key} needs "forwarder": "{PANEL}"')
+        return ForwardOptions()
+    if tunnel_type is not None and tunnel_type not in PANEL_TYPES:
+        raise ValueError(f'"forwarder": "{PANEL}" only carries {", ".join(sorted(PANEL_TYPES))} tunnels')
+    if proxy_protocol is not None:
+        if spec.get("pool") is not None:
+            raise ValueError("pool cannot be combined with proxy_protocol")
+        return ForwardOptions(PANEL, None, proxy_protocol)
+    return ForwardOptions(PANEL, parse_pool(spec))
+
+
+def safe_forward_options(spec: Optional[Dict[str, Any]], tunnel_type: str) -> ForwardOptions:
+    """``parse_forward_options`` for specs already stored, where a bad section means gost"""
+    try:
+        return parse_forward_options(spec, tunnel_type)
+    except ValueError:
+        return ForwardOptions()
+
+
+def _node_host(node_address: str) -> str:
+    if "://" in node_address:
+        node_address = node_address.split("://")[-1]
+    if node_address.startswith("["):
+        return node_address[1:].split("]", 1)[0]
+    if node_address.count(":") > 1:
+        return node_address  # bare IPv6 literal
+    return node_address.split(":")[0] if ":" in node_address else node_address
+
+
+def _prepare_upstream(sock: socket.socket):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
 
 class PortForwarder:
     """Manages TCP port forwarding from panel to nodes"""
@@ -14,24 +95,115 @@ class PortForwarder:
     def __init__(self):
         self.active_forwards: Dict[int, asyncio.Task] = {}
         self.forward_configs: Dict[int, dict] = {}  # port -> {node_address, remote_port}
+        # port -> (upload, download) buckets shared by every connection of the forward
+        self.rate_limiters: Dict[int, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self.session_tables: Dict[int, SessionTable] = {}
+        self.balancers: Dict[int, TargetBalancer] = {}
+        # port -> PROXY protocol header encoder, for forwards that send one
+        self.proxy_headers: Dict[int, Callable[..., bytes]] = {}
+        # tunnel id -> port, for forwards started by start_tunnel
+        self.tunnel_ports: Dict[str, int] = {}
+    
+    def install(self):
+        """Follow rate_limit changes of the tunnels this forwarder serves"""
+        from app.tunnel_registry import tunnel_registry
+        self._registry = tunnel_registry
+        tunnel_registry.add_listener(self._sync_rate_limit)
+    
+    def _sync_rate_limit(self, tunnel_id: str):
+        local_port = self.tunnel_ports.get(tunnel_id)
+        route = self._registry.get_tunnel(tunnel_id)
+        if local_port is not None and route is not None and local_port in self.rate_limiters:
+            self.set_rate_limit(local_port, route.rate_limit)
+    
+    async def start_tunnel(self, route):
+        """Serve a ``"forwarder": "panel"`` tunnel descriptor; raises on failure"""
+        if not route.panel_port:
+            raise ValueError("listen_port or remote_port is required for forwarded tunnels")
+        (host, port), *targets = parse_targets(route.forward_to)
+        await self.stop_tunnel(route.id)
+        started = await self.start_forward(
+            route.panel_port,
+            host,
+            port,
+            rate_limit=route.rate_limit,
+            pool=route.forward_pool,
+            targets=targets,
+            load_balance=route.load_balance,
+            proxy_protocol=route.proxy_protocol,
+        )
+        if not started:
+            raise RuntimeError(f"Forward on port {route.panel_port} failed to start, see the panel log")
+        self.tunnel_ports[route.id] = route.panel_port
+    
+    async def stop_tunnel(self, tunnel_id: str):
+        local_port = self.tunnel_ports.pop(tunnel_id, None)
+        if local_port is not None:
+            await self.stop_forward(local_port)
+        
+    async def start_forward(
+        self,
+        local_port: int,
+        node_address: str,
+        remote_port: int,
+        rate_limit: Optional[RateLimit] = None,
+        pool: Optional[PoolSettings] = None,
+        targets: Sequence[Target] = (),
+        load_balance: Optional[LoadBalance] = None,
+        proxy_protocol: Optional[int] = None,
+    ) -> bool:
+        """Start forwarding from local_port to node_address:remote_port
         
-    async def start_forward(self, local_port: int, node_address: str, remote_port: int) -> bool:
-        """Start forwarding from local_port to node_address:remote_port"""
+        With ``pool``, idle upstream connections are kept ready so clients
+        skip the connect round trip. ``targets`` are further (host, port)
+        targets that share the clients with node_address:remote_port as
+        ``load_balance`` says. With ``proxy_protocol`` (1 or 2) every
+        upstream connection starts with a PROXY header carrying the client
+        address, and ``pool`` is ignored.
+        """
         try:
             # Check if already forwarding on this port
             if local_port in self.active_forwards:
                 logger.warning(f"Port {local_port} already being forwarded, stopping old forward")
                 await self.stop_forward(local_port)
             
+            encode_header = header_encoder(proxy_protocol)
+            if encode_header is not None:
+                pool = None  # see parse_forward_options
+            
             # Store config
             self.forward_configs[local_port] = {
                 "node_address": node_address,
                 "remote_port": remote_port
             }
+            if encode_header is not None:
+                self.proxy_headers[local_port] = encode_header
+            self.set_rate_limit(local_port, rate_limit)
+            self.session_tables[local_port] = SessionTable()
+            balancer = self.balancers[local_port] = TargetBalancer(
+                list(dict.fromkeys([(_node_host(node_address), remote_port), *targets])),
+                load_balance or LoadBalance(),
+                self._open_upstream,
+            )
+            for backend in balancer.backends:
+                if pool is not None and pool.max_idle > 0:
+                    backend.pool = UpstreamPool(
+                        lambda backend=backend: self._open_upstream(backend.host, backend.port), pool
+                    )
+                    backend.pool.start()
+            balancer.start()
             
-            # Start forwarding task
-            task = asyncio.create_task(self._forward_loop(local_port, node_address, remote_port))
+            # Start forwarding task and wait until it listens or fails to
+            ready = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(self._forward_loop(local_port, node_address, remote_port, ready))
             self.active_forwards[local_port] = task
+            await asyncio.wait((ready, task), return_when=asyncio.FIRST_COMPLETED)
+            if not ready.done():
+                del self.active_forwards[local_port]
+                if not task.cancelled():
+                    task.exception()  # logged by the loop already
+                await self.stop_forward(local_port)
+                return False
             
             logger.info(f"Started forwarding {local_port} -> {node_address}:{remote_port}")
             return True
@@ -52,26 +224,49 @@ class PortForwarder:
             
         if local_port in self.forward_configs:
             del self.forward_configs[local_port]
+        self.rate_limiters.pop(local_port, None)
+        self.session_tables.pop(local_port, None)
+        self.proxy_headers.pop(local_port, None)
+        balancer = self.balancers.pop(local_port, None)
+        if balancer is not None:
+            await balancer.stop()
+            for backend in balancer.backends:
+                if backend.pool is not None:
+                    await backend.pool.stop()
             
         logger.info(f"Stopped forwarding on port {local_port}")
     
-    async def _forward_loop(self, local_port: int, node_address: str, remote_port: int):
+    def set_rate_limit(self, local_port: int, rate_limit: Optional[RateLimit]):
+        """Change the bandwidth cap of a forward; open connections pick it up on their next read"""
+        upload, download = self.rate_limiters.get(local_port, (None, None))
+        upload = self._rebucket(upload, rate_limit.upload_bps if rate_limit else 0, rate_limit)
+        download = self._rebucket(download, rate_limit.download_bps if rate_limit else 0, rate_limit)
+        self.rate_limiters[local_port] = (upload, download)
+    
+    @staticmethod
+    def _rebucket(bucket: Optional[TokenBucket], bps: int, rate_limit: Optional[RateLimit]) -> Optional[TokenBucket]:
+        if not bps:
+            return None
+        if bucket is None:
+            return TokenBucket(bps, rate_limit.burst_for(bps))
+        bucket.set_rate(bps, rate_limit.burst_for(bps))
+        return bucket
+    
+    async def _forward_loop(self, local_port: int, node_address: str, remote_port: int, ready: asyncio.Future):
         """Main forwarding loop - accepts connections and forwards them"""
         try:
-            # Parse node address
-            if "://" in node_address:
-                node_address = node_address.split("://")[-1]
-            node_host = node_address.split(":")[0] if ":" in node_address else node_address
+            node_host = _node_host(node_address)
             
             try:
                 server = await asyncio.start_server(
-                    lambda r, w: self._handle_client(r, w, node_host, remote_port),
+                    lambda r, w: self._handle_client(r, w, node_host, remote_port, local_port),
                     host='0.0.0.0',
                     port=local_port,
                     reuse_address=True,
                     reuse_port=False
                 )
                 logger.info(f"Forwarding server started on 0.0.0.0:{local_port} -> {node_host}:{remote_port}")
+                ready.set_result(None)
             except OSError as e:
                 if "Address already in use" in str(e) or e.errno == 98:
                     logger.error(f"Port {local_port} is already in use. Please ensure:")
@@ -90,33 +285,34 @@ class PortForwarder:
             logger.error(f"Error in forwarding loop for port {local_port}: {e}")
             raise
     
-    async def _handle_client(self, reader: StreamReader, writer: StreamWriter, target_host: str, target_port: int):
+    async def _handle_client(
+        self, reader: StreamReader, writer: StreamWriter, target_host: str, target_port: int, local_port: int
+    ):
         """Handle a client connection by forwarding to target"""
         remote_reader = None
         remote_writer = None
+        table = self.session_tables.get(local_port) or SessionTable(1)
+        peer = writer.get_extra_info("peername")
+        slot = table.open(tuple(peer[:2]) if peer else None)
+        balancer = self.balancers.get(local_port) or TargetBalancer(
+            [(target_host, target_port)], LoadBalance(health_check=None), self._open_upstream
+        )
+        backend = None
         
         try:
-            # Connect to target node with longer timeout and keep-alive
             try:
-                # Create socket with keep-alive
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
-                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
-                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
-                sock.setblocking(False)  # Set non-blocking for asyncio
-                
-                # Connect socket asynchronously
-                loop = asyncio.get_event_loop()
-                await asyncio.wait_for(
-                    loop.sock_connect(sock, (target_host, target_port)),
-                    timeout=10.0
-                )
+                sock, backend = await self._connect_backend(balancer, table, peer[0] if peer else None)
+                balancer.acquire(backend)
                 
                 # Now use the connected socket for asyncio stream
                 remote_reader, remote_writer = await asyncio.open_connection(sock=sock)
+                encode_header = self.proxy_headers.get(local_port)
+                if encode_header is not None:
+                    # Sent before any client byte; backends that speak first wait for it
+                    remote_writer.write(encode_header(peer, writer.get_extra_info("sockname")))
             except asyncio.TimeoutError:
-                logger.warning(f"Timeout connecting to {target_host}:{target_port}")
+                table.connect_failed(timeout=True)
+                logger.warning(f"Timeout connecting to {', '.join(b.address for b in balancer.backends)}")
                 try:
                     writer.close()
                     await writer.wait_closed()
@@ -124,7 +320,8 @@ class PortForwarder:
                     pass
                 return
             except Exception as e:
-                logger.warning(f"Failed to connect to {target_host}:{target_port}: {e}")
+                table.connect_failed()
+                logger.warning(f"Failed to connect to {', '.join(b.address for b in balancer.backends)}: {e}")
                 try:
                     writer.close()
                     await writer.wait_closed()
@@ -133,7 +330,7 @@ class PortForwarder:
                 return
             
             # Create bidirectional forwarding with better error handling
-            async def forward(src_reader: StreamReader, dst_writer: StreamWriter, direction: str):
+            async def forward(src_reader: StreamReader, dst_writer: StreamWriter, direction: str, flow: int):
                 try:
                     while True:
                         try:
@@ -141,6 +338,11 @@ class PortForwarder:
                             data = await asyncio.wait_for(src_reader.read(8192), timeout=60.0)
                             if not data:
                                 break
+                            # Looked up per chunk so live rate changes apply to open connections
+                            bucket = self.rate_limiters.get(local_port, (None, None))[flow]
+                            if bucket is not None:
+                                await bucket.consume(len(data))
+                            table.add(slot, flow, len(data))
                             dst_writer.write(data)
                             await dst_writer.drain()
                         except asyncio.TimeoutError:
@@ -168,14 +370,17 @@ class PortForwarder:
             
             # Start bidirectional forwarding
             await asyncio.gather(
-                forward(reader, remote_writer, "client->node"),
-                forward(remote_reader, writer, "node->client"),
+                forward(reader, remote_writer, "client->node", UP),
+                forward(remote_reader, writer, "node->client", DOWN),
                 return_exceptions=True
             )
             
         except Exception as e:
             logger.debug(f"Error handling client connection: {e}")
         finally:
+            table.close(slot)
+            if backend is not None:
+                balancer.release(backend)
             # Cleanup
             try:
                 writer.close()
@@ -189,6 +394,41 @@ class PortForwarder:
             except:
                 pass
     
+    async def _connect_backend(
+        self, balancer: TargetBalancer, table: SessionTable, client_ip: Optional[str]
+    ) -> Tuple[socket.socket, Backend]:
+        """Connect to the best target for a client, falling back to the next one on failure"""
+        error: Optional[BaseException] = None
+        for backend in balancer.candidates(client_ip)[:MAX_CONNECT_ATTEMPTS]:
+            sock = backend.pool.take() if backend.pool is not None else None
+            if sock is not None:
+                table.pool_hit()
+                return sock, backend
+            connect_started = time.perf_counter()
+            try:
+                sock = await self._open_upstream(backend.host, backend.port)
+            except (OSError, asyncio.TimeoutError) as e:
+                balancer.report(backend, False)
+                error = e
+                continue
+            table.connected(time.perf_counter() - connect_started)
+            balancer.report(backend, True)
+            return sock, backend
+        raise error
+    
+    @staticmethod
+    async def _open_upstream(target_host: str, target_port: int) -> socket.socket:
+        """Connect to the target with keep-alive enabled
+        
+        Hostnames come from the DNS cache and dual-stack targets are raced
+        happy-eyeballs style, all within one connect timeout.
+        """
+        async def connect() -> socket.socket:
+            targets = await dns_cache.resolve(target_host, target_port)
+            return await happy_eyeballs_connect(targets, settings.happy_eyeballs_delay_seconds, _prepare_upstream)
+        
+        return await asyncio.wait_for(connect(), timeout=CONNECT_TIMEOUT_SECONDS)
+    
     def is_forwarding(self, local_port: int) -> bool:
         """Check if port is being forwarded"""
         return local_port in self.active_forwards
@@ -197,8 +437,28 @@ class PortForwarder:
         """Get list of all forwarding ports"""
         return list(self.active_forwards.keys())
     
+    def get_stats(self) -> Dict[int, Dict[str, Any]]:
+        """Connection counters and connect-time histogram per forwarded port"""
+        stats = {}
+        for port, table in list(self.session_tables.items()):
+            config = self.forward_configs.get(port, {})
+            stats[port] = {
+                "target": f"{config.get('node_address')}:{config.get('remote_port')}",
+                **table.summary(),
+            }
+            balancer = self.balancers.get(port)
+            if balancer is not None and len(balancer.backends) > 1:
+                stats[port]["targets"] = balancer.status()
+        return stats
+    
+    def get_sessions(self, local_port: int) -> Optional[list]:
+        """Open connections of a forward, or None if the port is not forwarded"""
+        table = self.session_tables.get(local_port)
+        return table.sessions() if table is not None else None
+    
     async def cleanup_all(self):
         """Stop all forwarding"""
+        self.tunnel_ports.clear()
         ports = list(self.active_forwards.keys())
         for port in ports:
             await self.stop_forward(port)
@@ -0,0 +1,178 @@
+"""Index of ports bound on the panel by tunnel processes
+
+Every tunnel claims the (protocol, port) pairs its panel-side gost, rathole
+or backhaul server listens on. The index answers "who owns this port" with a
+dict lookup, so conflicting tunnels are rejected before any process starts,
+and hands out free ports from a configured range for specs that ask for
+``"auto"``.
+"""
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.config import settings
+
+Claim = Tuple[str, int]
+
+AUTO = "auto"
+AUTO_PORT_KEYS = ("listen_port", "remote_port", "public_port", "control_port")
+RESERVED_OWNER = "panel"
+
+_PORT_ENTRY = re.compile(r"^(?:(?:[\d.]+|\[[^\]]+\]):)?(?P<start>\d+)(?:-(?P<end>\d+))?")
+
+
+class PortConflict(Exception):
+    """A tunnel claims ports that another tunnel already owns"""
+
+    def __init__(self, conflicts: List[Tuple[Claim, str]]):
+        self.conflicts = conflicts
+        described = ", ".join(f"{proto}/{port} (used by {owner})" for (proto, port), owner in conflicts)
+        super().__init__(f"Port already in use: {described}")
+
+
+def _port(value: Any) -> Optional[int]:
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return None
+    return port if 0 < port < 65536 else None
+
+
+def _addr_port(addr: Any) -> Optional[int]:
+    if not isinstance(addr, str) or ":" not in addr:
+        return None
+    return _port(addr.rsplit(":", 1)[1])
+
+
+def _backhaul_entry_ports(entry: str) -> Iterable[int]:
+    match = _PORT_ENTRY.match(entry.split("=", 1)[0].strip())
+    if not match:
+        return ()
+    start = int(match.group("start"))
+    end = int(match.group("end") or start)
+    return range(start, min(end, 65535) + 1)
+
+
+def public_ports(core: str, tunnel_type: str, spec: Dict[str, Any]) -> Set[Claim]:
+    """Ports end users connect to on the panel, i.e. the claimed ports minus control channels"""
+    claims: Set[Claim] = set()
+    if core == "xray":
+        port = _port(spec.get("listen_port") or spec.get("remote_port"))
+        if port:
+            claims.add(("udp" if tunnel_type == "udp" else "tcp", port))
+    elif core == "rathole":
+        port = _port(spec.get("remote_port") or spec.get("listen_port"))
+        if port:
+            claims.add(("tcp", port))
+    elif core == "backhaul":
+        proto = _backhaul_proto(spec)
+        entries = spec.get("ports")
+        if isinstance(entries, list) and entries:
+            for entry in entries:
+                claims.update((proto, port) for port in _backhaul_entry_ports(str(entry)))
+        else:
+            port = _port(spec.get("public_port") or spec.get("listen_port"))
+            if port:
+                claims.add((proto, port))
+    return claims
+
+
+def _backhaul_proto(spec: Dict[str, Any]) -> str:
+    transport = (spec.get("transport") or spec.get("type") or "tcp").lower()
+    return "udp" if transport == "udp" else "tcp"
+
+
+def claimed_ports(core: str, tunnel_type: str, spec: Dict[str, Any]) -> Set[Claim]:
+    """Ports the panel binds for a tunnel, mirroring how each manager builds its listeners"""
+    claims = public_ports(core, tunnel_type, spec)
+    if core == "rathole":
+        port = _addr_port(spec.get("remote_addr"))
+        if port:
+            claims.add(("tcp", port))
+    elif core == "backhaul":
+        control = _addr_port(spec.get("bind_addr")) or _port(spec.get("control_port") or spec.get("listen_port")) or 3080
+        claims.add((_backhaul_proto(spec), control))
+    return claims
+
+
+class PortIndex:
+    """(protocol, port) -> owning tunnel id"""
+
+    def __init__(self, auto_start: int, auto_end: int, reserved: Iterable[Claim] = ()):
+        self.auto_start = auto_start
+        self.auto_end = auto_end
+        self.owners: Dict[Claim, str] = {claim: RESERVED_OWNER for claim in reserved}
+        self.claims: Dict[str, Set[Claim]] = {}
+        self._next_auto = auto_start
+
+    def conflicts(self, claims: Iterable[Claim], tunnel_id: Optional[str] = None) -> List[Tuple[Claim, str]]:
+        """Claims owned by someone other than ``tunnel_id``"""
+        found = []
+        for claim in claims:
+            owner = self.owners.get(claim)
+            if owner is not None and owner != tunnel_id:
+                found.append((claim, owner))
+        return found
+
+    def check(self, claims: Iterable[Claim], tunnel_id: Optional[str] = None):
+        conflicts = self.conflicts(claims, tunnel_id)
+        if conflicts:
+            raise PortConflict(conflicts)
+
+    def claim(self, tunnel_id: str, claims: Set[Claim]):
+        """Record ``claims`` for a tunnel, replacing whatever it held before
+
+        Ports already owned by another tunnel stay with their first owner.
+        """
+        self.release(tunnel_id)
+        owned = {claim for claim in claims if self.owners.setdefault(claim, tunnel_id) == tunnel_id}
+        self.claims[tunnel_id] = owned
+
+    def reserve(self, tunnel_id: str, claims: Iterable[Claim]):
+        """Check ``claims`` and hold them for ``tunnel_id`` on top of what it already holds
+
+        Handlers reserve before awaiting their commit so a concurrent request
+        cannot pass the same check; the registry's ``claim`` settles it after
+        the commit and ``release`` or a fresh ``claim`` undoes it on failure.
+        """
+        claims = set(claims)
+        self.check(claims, tunnel_id)
+        self.hold(tunnel_id, claims)
+
+    def hold(self, tunnel_id: str, claims: Iterable[Claim]):
+        """Add ``claims`` to what ``tunnel_id`` holds, without checking them first"""
+        self.claim(tunnel_id, self.claims.get(tunnel_id, set()) | set(claims))
+
+    def release(self, tunnel_id: str):
+        for claim in self.claims.pop(tunnel_id, ()):
+            if self.owners.get(claim) == tunnel_id:
+                del self.owners[claim]
+
+    def allocate(self, proto: str = "tcp", taken: Iterable[Claim] = ()) -> int:
+        """Next free port in the auto-assign range"""
+        taken = set(taken)
+        span = self.auto_end - self.auto_start + 1
+        for offset in range(span):
+            port = self.auto_start + (self._next_auto - self.auto_start + offset) % span
+            if (proto, port) not in self.owners and (proto, port) not in taken:
+                self._next_auto = port + 1 if port < self.auto_end else self.auto_start
+                return port
+        raise PortConflict([((proto, self.auto_start), f"no free port in {self.auto_start}-{self.auto_end}")])
+
+    def assign_auto_ports(self, core: str, tunnel_type: str, spec: Dict[str, Any], taken: Iterable[Claim] = ()) -> Dict[str, Any]:
+        """Return a copy of ``spec`` with every ``"auto"`` port replaced by a free port"""
+        spec = dict(spec)
+        taken = set(taken)
+        proto = "udp" if tunnel_type == "udp" or (spec.get("transport") or "").lower() == "udp" else "tcp"
+        for key in AUTO_PORT_KEYS:
+            if str(spec.get(key, "")).lower() == AUTO:
+                port = self.allocate(proto, taken)
+                taken.add((proto, port))
+                spec[key] = port
+        return spec
+
+
+port_index = PortIndex(
+    auto_start=settings.port_auto_range_start,
+    auto_end=settings.port_auto_range_end,
+    reserved=[("tcp", settings.panel_port), ("tcp", settings.hysteria2_port), ("udp", settings.hysteria2_port)],
+)
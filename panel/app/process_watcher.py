@@ -0,0 +1,133 @@
+"""Event-driven exit notifications for tunnel child processes
+
+Each watched child gets a pidfd registered with the event loop, so an exit is
+noticed the moment the kernel reports it instead of on the next ``poll()``.
+Kernels without pidfd support fall back to one waiter thread per child.
+"""
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ExitCallback = Callable[[int], None]
+ExitListener = Callable[[str, str, int], None]
+
+
+def describe_exit(returncode: int) -> str:
+    """Human readable exit reason for a return code"""
+    if returncode < 0:
+        try:
+            name = signal.Signals(-returncode).name
+        except ValueError:
+            name = f"signal {-returncode}"
+        return f"killed by {name}"
+    return f"exit code {returncode}"
+
+
+class ProcessWatcher:
+    """Dispatches child exits to the owning manager and to global listeners"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._watches: Dict[int, Tuple[subprocess.Popen, Optional[int], str, str, Optional[ExitCallback]]] = {}
+        self._listeners: List[ExitListener] = []
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Bind the watcher to the loop that runs exit callbacks"""
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+
+    def add_listener(self, listener: ExitListener):
+        """Register ``listener(core, tunnel_id, returncode)`` for unexpected exits"""
+        self._listeners.append(listener)
+
+    def watch(
+        self,
+        proc: subprocess.Popen,
+        core: str,
+        tunnel_id: str,
+        on_exit: Optional[ExitCallback] = None,
+    ):
+        """Report the exit of ``proc`` unless it is unwatched first"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._register(proc, core, tunnel_id, on_exit)
+        else:
+            self._loop.call_soon_threadsafe(self._register, proc, core, tunnel_id, on_exit)
+
+    def unwatch(self, proc: subprocess.Popen):
+        """Stop watching ``proc``; call before an intentional stop"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._unregister(proc.pid)
+        else:
+            self._loop.call_soon_threadsafe(self._unregister, proc.pid)
+
+    def _register(self, proc: subprocess.Popen, core: str, tunnel_id: str, on_exit: Optional[ExitCallback]):
+        self._unregister(proc.pid)
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+
+        self._watches[proc.pid] = (proc, pidfd, core, tunnel_id, on_exit)
+        if pidfd is not None:
+            self._loop.add_reader(pidfd, self._on_exit, proc.pid)
+        else:
+            threading.Thread(
+                target=self._wait_in_thread, args=(proc,), name=f"exit-watch-{proc.pid}", daemon=True
+            ).start()
+
+    def _unregister(self, pid: int):
+        entry = self._watches.pop(pid, None)
+        if entry is None:
+            return
+        pidfd = entry[1]
+        if pidfd is not None:
+            self._loop.remove_reader(pidfd)
+            os.close(pidfd)
+
+    def _wait_in_thread(self, proc: subprocess.Popen):
+        try:
+            proc.wait()
+        except Exception:
+            return
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._on_exit, proc.pid)
+
+    def _on_exit(self, pid: int):
+        entry = self._watches.get(pid)
+        if entry is None:
+            return
+        proc, _, core, tunnel_id, on_exit = entry
+        returncode = proc.poll()
+        if returncode is None:
+            return
+        self._unregister(pid)
+
+        logger.warning(
+            "%s process for tunnel %s exited (%s)", core, tunnel_id, describe_exit(returncode),
+            extra={"tunnel_id": tunnel_id, "core": core},
+        )
+        if on_exit is not None:
+            try:
+                on_exit(returncode)
+            except Exception as e:
+                logger.error("Exit handler for tunnel %s failed: %s", tunnel_id, e, exc_info=True)
+        for listener in self._listeners:
+            try:
+                listener(core, tunnel_id, returncode)
+            except Exception as e:
+                logger.error("Exit listener for tunnel %s failed: %s", tunnel_id, e, exc_info=True)
+
+
+process_watcher = ProcessWatcher()
@@ -0,0 +1,156 @@
+"""Stops tunnels that run out of quota or pass their expiry
+
+Usage pushed by nodes lands in ``Tunnel.used_mb`` and, through the ORM
+events, in the registry descriptors. Every push is checked as it is
+ingested and a short timer sweeps the registry for expiries, so a tunnel
+is cut off within seconds: its status is flipped first (which also stops
+the supervisor from restarting it), then the panel-side process is stopped
+and the node is told to remove its client.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Set, Tuple
+
+from sqlalchemy import update
+
+from app.backhaul_manager import backhaul_manager
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.gost_forwarder import gost_forwarder
+from app.port_forwarder import port_forwarder
+from app.hysteria2_client import Hysteria2Client
+from app.logging_setup import bind
+from app.metrics import TUNNEL_LIMIT_CUTOFFS
+from app.models import Tunnel
+from app.rathole_server import rathole_server_manager
+from app.tunnel_registry import TunnelDescriptor, tunnel_registry
+
+logger = logging.getLogger(__name__)
+
+
+def limit_violation(tunnel: TunnelDescriptor, now: Optional[datetime] = None) -> Optional[Tuple[str, str]]:
+    """``(limit, message)`` when a tunnel must be stopped, None while it is within its quota and lifetime"""
+    if tunnel.quota_mb > 0 and tunnel.used_mb >= tunnel.quota_mb:
+        return "quota", f"Quota exceeded: {tunnel.used_mb:.1f} of {tunnel.quota_mb:.1f} MB used"
+    if tunnel.expires_at is not None and tunnel.expires_at <= (now or datetime.utcnow()):
+        return "expiry", f"Tunnel expired at {tunnel.expires_at.isoformat()}Z"
+    return None
+
+
+def limits_payload(tunnel) -> dict:
+    """Quota and expiry sent with a node apply so the node enforces them too"""
+    return {
+        "quota_mb": tunnel.quota_mb or 0,
+        "used_mb": tunnel.used_mb or 0,
+        "expires_at": tunnel.expires_at.isoformat() if tunnel.expires_at else None,
+    }
+
+
+def _stop_panel_side(tunnel: TunnelDescriptor):
+    if tunnel.needs_gost_forwarding:
+        gost_forwarder.stop_forward(tunnel.id)
+    elif tunnel.needs_rathole_server:
+        rathole_server_manager.stop_server(tunnel.id)
+    elif tunnel.needs_backhaul_server:
+        backhaul_manager.stop_server(tunnel.id)
+
+
+class QuotaEnforcer:
+    """Checks quota and expiry on ingestion and on a timer, and cuts tunnels off"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._enforcing: Set[str] = set()
+        self._background: Set[asyncio.Task] = set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def check(self, tunnel_id: str):
+        """Cut off a tunnel in the background if it has just gone over its limits"""
+        tunnel = tunnel_registry.get_tunnel(tunnel_id)
+        if tunnel is None or tunnel.status != "active":
+            return
+        violation = limit_violation(tunnel)
+        if violation is None:
+            return
+        task = asyncio.get_running_loop().create_task(self.enforce(tunnel, *violation))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def sweep(self):
+        now = datetime.utcnow()
+        violations = [
+            (tunnel, violation)
+            for tunnel in tunnel_registry.active_tunnels()
+            if (violation := limit_violation(tunnel, now)) is not None
+        ]
+        if violations:
+            await asyncio.gather(*(self.enforce(tunnel, *violation) for tunnel, violation in violations))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Quota sweep failed: %s", e, exc_info=True)
+
+    async def enforce(self, tunnel: TunnelDescriptor, limit: str, reason: str):
+        if tunnel.id in self._enforcing:
+            return
+        self._enforcing.add(tunnel.id)
+        log = bind(logger, tunnel_id=tunnel.id, core=tunnel.core, node_id=tunnel.node_id)
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    update(Tunnel)
+                    .where(Tunnel.id == tunnel.id, Tunnel.status == "active")
+                    .values(status="error", error_message=reason)
+                )
+                await db.commit()
+            if result.rowcount == 0:
+                return
+            tunnel_registry.set_tunnel_status(tunnel.id, "error")
+            TUNNEL_LIMIT_CUTOFFS.labels(limit).inc()
+            log.warning("Stopping tunnel %s: %s", tunnel.id, reason)
+
+            try:
+                if tunnel.needs_panel_forwarding:
+                    await port_forwarder.stop_tunnel(tunnel.id)
+                else:
+                    await asyncio.to_thread(_stop_panel_side, tunnel)
+            except Exception as e:
+                log.error("Failed to stop panel side of tunnel %s: %s", tunnel.id, e)
+            if tunnel.needs_node_apply and tunnel.node_id:
+                response = await Hysteria2Client().send_to_node(
+                    node_id=tunnel.node_id,
+                    endpoint="/api/agent/tunnels/remove",
+                    data={"tunnel_id": tunnel.id},
+                )
+                if response.get("status") != "success":
+                    log.warning(
+                        "Node did not confirm removal of tunnel %s: %s",
+                        tunnel.id, response.get("message", "unknown error"),
+                    )
+        except Exception as e:
+            log.error("Failed to enforce limits on tunnel %s: %s", tunnel.id, e, exc_info=True)
+        finally:
+            self._enforcing.discard(tunnel.id)
+
+
+quota_enforcer = QuotaEnforcer(interval=settings.quota_check_interval_seconds)
@@ -0,0 +1,39 @@
+"""Per-client sliding window rate limiting"""
+import time
+from collections import OrderedDict, deque
+from typing import Deque
+
+
+class SlidingWindowLimiter:
+    """Allows ``limit`` hits per ``window`` seconds for each key
+
+    At most ``max_keys`` clients are tracked; the least recently seen are
+    dropped first so a spray of source addresses cannot grow memory unbounded.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._hits: "OrderedDict[str, Deque[float]]" = OrderedDict()
+
+    def hit(self, key: str) -> float:
+        """Record a hit; returns 0 if allowed, otherwise seconds until the next slot frees up"""
+        now = time.monotonic()
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = deque()
+            self._hits[key] = hits
+            while len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+        else:
+            self._hits.move_to_end(key)
+        while hits and now - hits[0] >= self.window:
+            hits.popleft()
+        if len(hits) >= self.limit:
+            return self.window - (now - hits[0])
+        hits.append(now)
+        return 0.0
+
+    def reset(self, key: str):
+        self._hits.pop(key, None)
@@ -1,10 +1,15 @@
 """Rathole server management for panel"""
 import subprocess
+import threading
 import time
 import logging
 from pathlib import Path
 from typing import Dict, Optional
 
+from app.cgroups import cgroups, tunnel_leaf
+from app.log_rotation import LogPump, open_process_log
+from app.process_watcher import process_watcher
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,6 +21,9 @@ class RatholeServerManager:
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.active_servers: Dict[str, subprocess.Popen] = {}
         self.server_configs: Dict[str, dict] = {}
+        self.log_pumps: Dict[str, LogPump] = {}
+        # Starts and stops run in worker threads as well as on the loop
+        self._lock = threading.RLock()
     
     def start_server(self, tunnel_id: str, remote_addr: str, token: str, proxy_port: int) -> bool:
         """
@@ -30,142 +38,156 @@ class RatholeServerManager:
         Returns:
             True if server started successfully, False otherwise
         """
-        try:
-            if ":" in remote_addr:
-                bind_addr = f"0.0.0.0:{remote_addr.split(':')[1]}"
-            else:
-                raise ValueError(f"Invalid remote_addr format: {remote_addr}")
+        with self._lock:
+            try:
+                if ":" in remote_addr:
+                    bind_addr = f"0.0.0.0:{remote_addr.split(':')[1]}"
+                else:
+                    raise ValueError(f"Invalid remote_addr format: {remote_addr}")
             
-            if tunnel_id in self.active_servers:
-                logger.warning(f"Rathole server for tunnel {tunnel_id} already exists, stopping it first")
-                self.stop_server(tunnel_id)
+                if tunnel_id in self.active_servers:
+                    logger.warning(f"Rathole server for tunnel {tunnel_id} already exists, stopping it first")
+                    self.stop_server(tunnel_id)
             
-            config = f"""[server]
-bind_addr = "{bind_addr}"
-default_token = "{token}"
+                config = f"""[server]
+    bind_addr = "{bind_addr}"
+    default_token = "{token}"
 
-[server.services.{tunnel_id}]
-bind_addr = "0.0.0.0:{proxy_port}"
-"""
+    [server.services.{tunnel_id}]
+    bind_addr = "0.0.0.0:{proxy_port}"
+    """
             
-            config_path = self.config_dir / f"{tunnel_id}.toml"
-            with open(config_path, "w") as f:
-                f.write(config)
+                config_path = self.config_dir / f"{tunnel_id}.toml"
+                with open(config_path, "w") as f:
+                    f.write(config)
             
-            self.server_configs[tunnel_id] = {
-                "remote_addr": remote_addr,
-                "token": token,
-                "proxy_port": proxy_port,
-                "bind_addr": bind_addr,
-                "config_path": str(config_path)
-            }
+                self.server_configs[tunnel_id] = {
+                    "remote_addr": remote_addr,
+                    "token": token,
+                    "proxy_port": proxy_port,
+                    "bind_addr": bind_addr,
+                    "config_path": str(config_path)
+                }
             
-            log_file = self.config_dir / f"rathole_{tunnel_id}.log"
-            try:
-                log_f = open(log_file, 'w', buffering=1)
+                log_file = self.config_dir / f"rathole_{tunnel_id}.log"
+                log_f = open_process_log(log_file)
                 log_f.write(f"Starting rathole server for tunnel {tunnel_id}\n")
                 log_f.write(f"Config: bind_addr={bind_addr}, proxy_port={proxy_port}\n")
                 log_f.write(f"Config file: {config_path}\n")
                 log_f.write(f"Config content:\n{config}\n")
-                log_f.flush()
-                proc = subprocess.Popen(
-                    ["/usr/local/bin/rathole", "-s", str(config_path)],
-                    stdout=log_f,
-                    stderr=subprocess.STDOUT,
-                    cwd=str(self.config_dir),
-                    start_new_session=True
-                )
-            except FileNotFoundError:
-                log_f = open(log_file, 'w', buffering=1)
-                log_f.write(f"Starting rathole server (system binary) for tunnel {tunnel_id}\n")
-                log_f.flush()
-                proc = subprocess.Popen(
-                    ["rathole", "-s", str(config_path)],
-                    stdout=log_f,
-                    stderr=subprocess.STDOUT,
-                    cwd=str(self.config_dir),
-                    start_new_session=True
-                )
+                leaf = cgroups.prepare(tunnel_leaf(tunnel_id))
+                try:
+                    try:
+                        proc = subprocess.Popen(
+                            ["/usr/local/bin/rathole", "-s", str(config_path)],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            cwd=str(self.config_dir),
+                            start_new_session=True
+                        )
+                    except FileNotFoundError:
+                        log_f.write(f"Starting rathole server (system binary) for tunnel {tunnel_id}\n")
+                        proc = subprocess.Popen(
+                            ["rathole", "-s", str(config_path)],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            cwd=str(self.config_dir),
+                            start_new_session=True
+                        )
+                except Exception:
+                    log_f.close()
+                    raise
             
-            self.active_servers[f"{tunnel_id}_log"] = log_f
-            self.active_servers[tunnel_id] = proc
+                cgroups.attach(leaf, proc.pid)
+                self.log_pumps[tunnel_id] = LogPump(proc.stdout, log_f)
+                self.active_servers[tunnel_id] = proc
+            
+                time.sleep(1.0)
+                if proc.poll() is not None:
+                    try:
+                        if log_file.exists():
+                            error_output = self._read_log(tunnel_id, log_file)
+                        else:
+                            error_output = "Log file not found"
+                        error_msg = f"rathole server failed to start (exit code: {proc.poll()}): {error_output[-500:] if len(error_output) > 500 else error_output}"
+                        logger.error(error_msg)
+                    except Exception as e:
+                        error_msg = f"rathole server failed to start (exit code: {proc.poll()}), could not read log: {e}"
+                        logger.error(error_msg)
+                    finally:
+                        del self.active_servers[tunnel_id]
+                        self._close_log(tunnel_id)
+                        cgroups.release(tunnel_leaf(tunnel_id))
+                        if tunnel_id in self.server_configs:
+                            del self.server_configs[tunnel_id]
+                    raise RuntimeError(error_msg)
             
-            time.sleep(1.0)
-            if proc.poll() is not None:
                 try:
-                    if log_file.exists():
-                        with open(log_file, 'r') as f:
-                            error_output = f.read()
-                    else:
-                        error_output = "Log file not found"
-                    error_msg = f"rathole server failed to start (exit code: {proc.poll()}): {error_output[-500:] if len(error_output) > 500 else error_output}"
-                    logger.error(error_msg)
+                    import socket
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    sock.settimeout(1)
+                    port = int(bind_addr.split(':')[1])
+                    result = sock.connect_ex(('127.0.0.1', port))
+                    sock.close()
+                    if result != 0:
+                        logger.warning(f"Rathole server port {port} not listening after start, but process is running. PID: {proc.pid}")
                 except Exception as e:
-                    error_msg = f"rathole server failed to start (exit code: {proc.poll()}), could not read log: {e}"
-                    logger.error(error_msg)
-                finally:
-                    del self.active_servers[tunnel_id]
-                    if f"{tunnel_id}_log" in self.active_servers:
-                        try:
-                            self.active_servers[f"{tunnel_id}_log"].close()
-                        except:
-                            pass
-                        del self.active_servers[f"{tunnel_id}_log"]
-                    if tunnel_id in self.server_configs:
-                        del self.server_configs[tunnel_id]
-                raise RuntimeError(error_msg)
+                    logger.warning(f"Could not verify rathole server port is listening: {e}")
             
-            try:
-                import socket
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(1)
-                port = int(bind_addr.split(':')[1])
-                result = sock.connect_ex(('127.0.0.1', port))
-                sock.close()
-                if result != 0:
-                    logger.warning(f"Rathole server port {port} not listening after start, but process is running. PID: {proc.pid}")
-            except Exception as e:
-                logger.warning(f"Could not verify rathole server port is listening: {e}")
-            
-            logger.info(f"Started Rathole server for tunnel {tunnel_id} on {bind_addr}, proxy port: {proxy_port}")
-            return True
+                process_watcher.watch(proc, "rathole", tunnel_id, on_exit=lambda rc: self._on_process_exit(tunnel_id, proc))
+                logger.info(f"Started Rathole server for tunnel {tunnel_id} on {bind_addr}, proxy port: {proxy_port}")
+                return True
             
-        except Exception as e:
-            logger.error(f"Failed to start Rathole server for tunnel {tunnel_id}: {e}")
-            raise
+            except Exception as e:
+                logger.error(f"Failed to start Rathole server for tunnel {tunnel_id}: {e}")
+                raise
     
     def stop_server(self, tunnel_id: str):
         """Stop Rathole server for a tunnel"""
-        if tunnel_id in self.active_servers:
-            proc = self.active_servers[tunnel_id]
-            try:
-                proc.terminate()
-                proc.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-                proc.wait()
-            except Exception as e:
-                logger.warning(f"Error stopping Rathole server for tunnel {tunnel_id}: {e}")
-            finally:
-                del self.active_servers[tunnel_id]
-                log_key = f"{tunnel_id}_log"
-                if log_key in self.active_servers:
-                    try:
-                        self.active_servers[log_key].close()
-                    except:
-                        pass
-                    del self.active_servers[log_key]
-            
-            logger.info(f"Stopped Rathole server for tunnel {tunnel_id}")
-        
-        if tunnel_id in self.server_configs:
-            config_path = Path(self.server_configs[tunnel_id]["config_path"])
-            if config_path.exists():
+        with self._lock:
+            if tunnel_id in self.active_servers:
+                proc = self.active_servers[tunnel_id]
+                process_watcher.unwatch(proc)
                 try:
-                    config_path.unlink()
+                    proc.terminate()
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
                 except Exception as e:
-                    logger.warning(f"Failed to delete config file {config_path}: {e}")
-            del self.server_configs[tunnel_id]
+                    logger.warning(f"Error stopping Rathole server for tunnel {tunnel_id}: {e}")
+                finally:
+                    del self.active_servers[tunnel_id]
+                    self._close_log(tunnel_id)
+                    cgroups.release(tunnel_leaf(tunnel_id))
+            
+                logger.info(f"Stopped Rathole server for tunnel {tunnel_id}")
+        
+            if tunnel_id in self.server_configs:
+                config_path = Path(self.server_configs[tunnel_id]["config_path"])
+                if config_path.exists():
+                    try:
+                        config_path.unlink()
+                    except Exception as e:
+                        logger.warning(f"Failed to delete config file {config_path}: {e}")
+                del self.server_configs[tunnel_id]
+    
+    def _read_log(self, tunnel_id: str, log_file: Path) -> str:
+        """Read the process log after copying any output still in the pipe"""
+        pump = self.log_pumps.get(tunnel_id)
+        if pump:
+            pump.drain()
+        return log_file.read_text(errors="replace")
+    
+    def _close_log(self, tunnel_id: str):
+        pump = self.log_pumps.pop(tunnel_id, None)
+        if pump:
+            pump.drain()
+            pump.close()
+    
+    def _on_process_exit(self, tunnel_id: str, proc: subprocess.Popen):
+        if self.active_servers.get(tunnel_id) is proc:
+            self._close_log(tunnel_id)
     
     def is_running(self, tunnel_id: str) -> bool:
         """Check if server is running for a tunnel"""
@@ -174,23 +196,39 @@ bind_addr = "0.0.0.0:{proxy_port}"
         proc = self.active_servers[tunnel_id]
         return proc.poll() is None
     
+    def restart(self, tunnel_id: str) -> bool:
+        """Start a dead server again from its last config; False if there is nothing to restart"""
+        with self._lock:
+            config = self.server_configs.get(tunnel_id)
+            if not config or self.is_running(tunnel_id):
+                return False
+            return self.start_server(
+                tunnel_id=tunnel_id,
+                remote_addr=config["remote_addr"],
+                token=config["token"],
+                proxy_port=config["proxy_port"]
+            )
+    
     def get_active_servers(self) -> list:
         """Get list of tunnel IDs with active servers"""
-        active = []
-        for tunnel_id, proc in list(self.active_servers.items()):
-            if proc.poll() is None:
-                active.append(tunnel_id)
-            else:
-                del self.active_servers[tunnel_id]
-                if tunnel_id in self.server_configs:
-                    del self.server_configs[tunnel_id]
-        return active
+        with self._lock:
+            active = []
+            for tunnel_id, proc in list(self.active_servers.items()):
+                if proc.poll() is None:
+                    active.append(tunnel_id)
+                else:
+                    del self.active_servers[tunnel_id]
+                    self._close_log(tunnel_id)
+                    if tunnel_id in self.server_configs:
+                        del self.server_configs[tunnel_id]
+            return active
     
     def cleanup_all(self):
         """Stop all Rathole servers"""
-        tunnel_ids = list(self.active_servers.keys())
-        for tunnel_id in tunnel_ids:
-            self.stop_server(tunnel_id)
+        with self._lock:
+            tunnel_ids = list(self.active_servers.keys())
+            for tunnel_id in tunnel_ids:
+                self.stop_server(tunnel_id)
 
 
 rathole_server_manager = RatholeServerManager()
@@ -0,0 +1,104 @@
+"""Restart policy, backoff and crash-loop tracking for tunnel processes"""
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from app.config import settings
+
+RESTART_POLICIES = ("always", "on-failure", "never")
+
+
+def parse_restart_policy(spec: Optional[Dict[str, Any]]) -> str:
+    """Read ``restart_policy`` from a tunnel spec, falling back to the configured default"""
+    value = (spec or {}).get("restart_policy")
+    if isinstance(value, str):
+        value = value.strip().lower().replace("_", "-")
+        if value in RESTART_POLICIES:
+            return value
+    return settings.tunnel_restart_policy
+
+
+def should_restart(policy: str, returncode: int) -> bool:
+    if policy == "always":
+        return True
+    if policy == "on-failure":
+        return returncode != 0
+    return False
+
+
+class RestartState:
+    """Restart bookkeeping for one tunnel"""
+
+    def __init__(self):
+        self.restart_count = 0
+        self.last_exit_reason: Optional[str] = None
+        self.last_exit_at: Optional[float] = None
+        self.recent_exits: Deque[float] = deque()
+        self.circuit_open = False
+
+
+class RestartTracker:
+    """Exponential backoff with jitter and a crash-loop circuit breaker
+
+    Every exit inside ``crash_window`` seconds doubles the next delay, capped at
+    ``max_delay``. More than ``crash_limit`` exits inside the window opens the
+    circuit and the tunnel stays down until it is re-applied.
+    """
+
+    def __init__(self, initial_delay: float, max_delay: float, crash_limit: int, crash_window: float):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.crash_limit = crash_limit
+        self.crash_window = crash_window
+        self.states: Dict[str, RestartState] = {}
+
+    def record_exit(self, tunnel_id: str, reason: str) -> RestartState:
+        state = self.states.setdefault(tunnel_id, RestartState())
+        now = time.monotonic()
+        state.last_exit_reason = reason
+        state.last_exit_at = time.time()
+        state.recent_exits.append(now)
+        while state.recent_exits and now - state.recent_exits[0] > self.crash_window:
+            state.recent_exits.popleft()
+        return state
+
+    def next_delay(self, tunnel_id: str) -> Optional[float]:
+        """Delay before the next restart, or None once the circuit is open"""
+        state = self.states.setdefault(tunnel_id, RestartState())
+        if len(state.recent_exits) > self.crash_limit:
+            state.circuit_open = True
+            return None
+        attempt = max(len(state.recent_exits) - 1, 0)
+        delay = min(self.max_delay, self.initial_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def record_restart(self, tunnel_id: str):
+        self.states.setdefault(tunnel_id, RestartState()).restart_count += 1
+
+    def stats(self, tunnel_id: str) -> Dict[str, Any]:
+        state = self.states.get(tunnel_id)
+        if state is None:
+            return {"restart_count": 0, "last_exit_reason": None}
+        return {
+            "restart_count": state.restart_count,
+            "last_exit_reason": state.last_exit_reason,
+        }
+
+    def reset(self, tunnel_id: str):
+        """Close the circuit and clear backoff after a tunnel is re-applied"""
+        state = self.states.get(tunnel_id)
+        if state is not None:
+            state.recent_exits.clear()
+            state.circuit_open = False
+
+    def forget(self, tunnel_id: str):
+        self.states.pop(tunnel_id, None)
+
+
+restart_tracker = RestartTracker(
+    initial_delay=settings.tunnel_restart_initial_delay,
+    max_delay=settings.tunnel_restart_max_delay,
+    crash_limit=settings.tunnel_restart_crash_limit,
+    crash_window=settings.tunnel_restart_crash_window_seconds,
+)
@@ -1,7 +1,10 @@
 """Authentication endpoints"""
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -9,9 +12,11 @@ from pydantic import BaseModel
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 
-from app.database import get_db
+from app.database import AsyncSessionLocal, get_db
 from app.models import Admin
 from app.config import settings
+from app.auth_cache import auth_cache
+from app.rate_limit import SlidingWindowLimiter
 
 router = APIRouter()
 security = HTTPBearer()
@@ -21,6 +26,12 @@ SECRET_KEY = settings.secret_key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
 
+# bcrypt is CPU bound; run it off the event loop on a small pool and cap how
+# much work may queue behind it
+password_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="bcrypt")
+password_slots = asyncio.Semaphore(settings.password_hash_workers + settings.password_hash_queue)
+login_limiter = SlidingWindowLimiter(settings.login_rate_limit, settings.login_rate_window_seconds)
+
 
 class LoginRequest(BaseModel):
     username: str
@@ -47,6 +58,22 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def run_password_job(func, *args):
+    """Run a bcrypt call on the password pool; 503 when the queue is full"""
+    if password_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is busy, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    async with password_slots:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_job(verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT token"""
     to_encode = data.copy()
@@ -61,7 +88,6 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
 ) -> Admin:
     """Get the current authenticated user"""
     credentials_exception = HTTPException(
@@ -70,8 +96,12 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    token = credentials.credentials
+    cached = auth_cache.get(token)
+    if cached is not None:
+        return cached[1]
+    
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
@@ -80,20 +110,31 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    result = await db.execute(select(Admin).where(Admin.username == token_data.username))
-    user = result.scalar_one_or_none()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Admin).where(Admin.username == token_data.username))
+        user = result.scalar_one_or_none()
     if user is None:
         raise credentials_exception
+    auth_cache.put(token, payload, user)
     return user
 
 
 @router.post("/login", response_model=LoginResponse)
-async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_db)):
+async def login(login_data: LoginRequest, request: Request, db: AsyncSession = Depends(get_db)):
     """Login endpoint"""
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = login_limiter.hit(client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    
     result = await db.execute(select(Admin).where(Admin.username == login_data.username))
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(login_data.password, user.password_hash):
+    if not user or not await verify_password_async(login_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
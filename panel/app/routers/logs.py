@@ -5,6 +5,8 @@ from datetime import datetime
 import logging
 import io
 
+from app.logging_setup import TEXT_FORMAT, add_handler
+
 
 router = APIRouter()
 
@@ -12,10 +14,10 @@ log_buffer = []
 
 
 class MemoryHandler(logging.Handler):
-    """Custom handler that stores logs in memory"""
+    """Custom handler that stores logs in memory (runs on the log listener thread)"""
     def emit(self, record):
         log_buffer.append({
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcfromtimestamp(record.created).isoformat(),
             "level": record.levelname,
             "message": self.format(record)
         })
@@ -24,9 +26,8 @@ class MemoryHandler(logging.Handler):
 
 
 handler = MemoryHandler()
-handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logging.getLogger().addHandler(handler)
-logging.getLogger().setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+add_handler(handler)
 
 
 @router.get("")
@@ -1,5 +1,5 @@
 """Nodes API endpoints"""
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import List
@@ -8,6 +8,7 @@ from pydantic import BaseModel
 
 from app.database import get_db
 from app.models import Node
+from app.listing import MAX_PAGE_SIZE, apply_keyset, etag_response, parse_fields, split_page
 
 
 router = APIRouter()
@@ -86,23 +87,48 @@ async def create_node(node: NodeCreate, db: AsyncSession = Depends(get_db)):
     )
 
 
+NODE_COLUMNS = {
+    "id": Node.id,
+    "name": Node.name,
+    "fingerprint": Node.fingerprint,
+    "status": Node.status,
+    "registered_at": Node.registered_at,
+    "last_seen": Node.last_seen,
+    "metadata": Node.node_metadata,
+}
+
+
 @router.get("", response_model=List[NodeResponse])
-async def list_nodes(db: AsyncSession = Depends(get_db)):
-    """List all nodes"""
-    result = await db.execute(select(Node))
-    nodes = result.scalars().all()
-    return [
-        NodeResponse(
-            id=n.id,
-            name=n.name,
-            fingerprint=n.fingerprint,
-            status=n.status,
-            registered_at=n.registered_at,
-            last_seen=n.last_seen,
-            metadata=n.node_metadata or {}
-        )
-        for n in nodes
-    ]
+async def list_nodes(
+    request: Request,
+    status: str | None = None,
+    fields: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """List nodes, optionally filtered by status, projected with ``fields=`` and paged with ``limit``/``cursor``"""
+    selected = parse_fields(fields, NODE_COLUMNS) or list(NODE_COLUMNS)
+    columns = [NODE_COLUMNS[f].label(f) for f in selected]
+    columns += [c for c in (Node.id, Node.registered_at) if c.key not in selected]
+    query = select(*columns)
+    if status is not None:
+        query = query.where(Node.status == status)
+    
+    query = apply_keyset(query, Node, cursor, limit, order_column=Node.registered_at)
+    rows = (await db.execute(query)).all()
+    rows, next_cursor = split_page(rows, limit, order_key="registered_at")
+    
+    payload = []
+    for row in rows:
+        item = {}
+        for field in selected:
+            value = getattr(row, field)
+            if field == "metadata":
+                value = value or {}
+            item[field] = value
+        payload.append(item)
+    return etag_response(request, payload, next_cursor)
 
 
 @router.get("/{node_id}", response_model=NodeResponse)
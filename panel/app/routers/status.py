@@ -1,11 +1,13 @@
 """Status API endpoints"""
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 import psutil
 
 from app.database import get_db
 from app.models import Tunnel, Node
+from app.loop_monitor import loop_monitor
+from app.port_forwarder import port_forwarder
 
 
 router = APIRouter()
@@ -49,3 +51,31 @@ async def get_status(db: AsyncSession = Depends(get_db)):
             "active": active_nodes,
         }
     }
+
+
+@router.get("/loop")
+async def get_loop_report(limit: int = 20):
+    """Event loop stalls grouped by the call that blocked the loop"""
+    return loop_monitor.report(limit)
+
+
+@router.delete("/loop")
+async def reset_loop_report():
+    """Clear collected event loop stall data"""
+    loop_monitor.reset()
+    return {"status": "reset"}
+
+
+@router.get("/forwards")
+async def get_forward_stats():
+    """Connection counters and target connect times of the in-process forwarder, by port"""
+    return {str(port): stats for port, stats in port_forwarder.get_stats().items()}
+
+
+@router.get("/forwards/{port}/sessions")
+async def get_forward_sessions(port: int):
+    """Open connections of one forwarded port"""
+    sessions = port_forwarder.get_sessions(port)
+    if sessions is None:
+        raise HTTPException(status_code=404, detail="Port is not forwarded")
+    return sessions
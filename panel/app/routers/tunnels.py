@@ -1,33 +1,153 @@
 """Tunnels API endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import delete as sa_delete, select
 from typing import List
-from datetime import datetime
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from pydantic import BaseModel, field_validator, model_validator
+import asyncio
 import logging
-import time
 
-from app.database import get_db
-from app.models import Tunnel, Node
+import orjson
+
+from app.config import settings
+from app.database import AsyncSessionLocal, get_db
+from app.models import Tunnel, Node, generate_uuid
 from app.hysteria2_client import Hysteria2Client
+from app.listing import MAX_PAGE_SIZE, apply_keyset, etag_response, parse_fields, split_page
+from app.logging_setup import bind
+from app.metrics import forget_tunnel
+from app.tunnel_supervisor import tunnel_supervisor
+from app.bandwidth import parse_rate_limit
+from app.load_balancer import parse_load_balance, parse_targets
+from app.cgroups import cgroups, tunnel_leaf
+from app.port_forwarder import parse_forward_options, port_forwarder
+from app.port_index import PortConflict, claimed_ports, port_index
+from app.quota_enforcer import limit_violation, limits_payload, quota_enforcer
+from app.tunnel_registry import TunnelDescriptor, tunnel_registry
 
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+def _as_utc(value: datetime | None) -> datetime | None:
+    """Expiry times are stored as naive UTC like every other timestamp column"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _without_rate_limit(spec: dict | None) -> dict:
+    """Spec minus ``rate_limit``, which the traffic shaper applies live without a restart"""
+    return {k: v for k, v in (spec or {}).items() if k != "rate_limit"}
+
+
+def _check_spec_sections(spec: dict | None, tunnel_type: str | None = None):
+    """Raise ValueError for a malformed ``rate_limit``, ``load_balance``, ``forward_to`` or forwarder choice"""
+    spec = spec or {}
+    parse_rate_limit(spec)
+    parse_load_balance(spec)
+    parse_forward_options(spec, tunnel_type)
+    if spec.get("forward_to"):
+        parse_targets(spec["forward_to"])
+
+
+def _check_spec(spec: dict | None, tunnel_type: str | None = None):
+    try:
+        _check_spec_sections(spec, tunnel_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _apply_update(update: "TunnelUpdate", tunnel: Tunnel) -> tuple[bool, bool]:
+    """Write an update onto its row; returns ``(spec_changed, limits_changed)``
+
+    ``spec_changed`` ignores ``rate_limit``, which the traffic shaper picks up
+    live, so only a change that needs the processes restarted counts.
+    """
+    spec_changed = (
+        update.spec is not None
+        and _without_rate_limit(update.spec) != _without_rate_limit(tunnel.spec)
+    )
+    if update.name is not None:
+        tunnel.name = update.name
+    if update.spec is not None:
+        tunnel.spec = update.spec
+    limits_changed = update.apply_limits(tunnel)
+    tunnel.revision += 1
+    tunnel.updated_at = datetime.utcnow()
+    return spec_changed, limits_changed
+
+
+def _restart_allowed(route: TunnelDescriptor, spec_changed: bool) -> bool:
+    """A changed spec is re-applied unless the tunnel is out of quota or expired"""
+    return spec_changed and limit_violation(route) is None
+
+
+def _restore_claims(tunnel_id: str):
+    """Give back ports reserved for a change whose commit failed"""
+    route = tunnel_registry.get_tunnel(tunnel_id)
+    if route is None:
+        port_index.release(tunnel_id)
+    else:
+        port_index.claim(tunnel_id, route.ports)
+
+
+async def _push_limits(route: TunnelDescriptor):
+    """Send changed quota/expiry of a running node tunnel without re-applying it"""
+    if route.status != "active" or not route.needs_node_apply or limit_violation(route) is not None:
+        return
+    response = await Hysteria2Client().send_to_node(
+        node_id=route.node_id,
+        endpoint="/api/agent/tunnels/limits",
+        data={"tunnel_id": route.id, "limits": limits_payload(route)}
+    )
+    if response.get("status") != "success":
+        logger.warning(
+            "Failed to update limits of tunnel %s on its node: %s", route.id, response.get("message"),
+            extra={"tunnel_id": route.id, "node_id": route.node_id},
+        )
+
+
 class TunnelCreate(BaseModel):
     name: str
     core: str
     type: str
     node_id: str | None = None
     spec: dict
+    quota_mb: float = 0
+    expires_at: datetime | None = None
+    
+    @field_validator("expires_at")
+    @classmethod
+    def normalize_expiry(cls, value: datetime | None) -> datetime | None:
+        return _as_utc(value)
 
 
 class TunnelUpdate(BaseModel):
+    """Omitted fields are left alone; ``expires_at: null`` removes the expiry"""
     name: str | None = None
     spec: dict | None = None
+    quota_mb: float | None = None
+    expires_at: datetime | None = None
+    
+    @field_validator("expires_at")
+    @classmethod
+    def normalize_expiry(cls, value: datetime | None) -> datetime | None:
+        return _as_utc(value)
+    
+    def apply_limits(self, tunnel: Tunnel) -> bool:
+        """Copy quota and expiry onto a row; returns whether either changed"""
+        changed = False
+        if self.quota_mb is not None and self.quota_mb != tunnel.quota_mb:
+            tunnel.quota_mb = self.quota_mb
+            changed = True
+        if "expires_at" in self.model_fields_set and self.expires_at != tunnel.expires_at:
+            tunnel.expires_at = self.expires_at
+            changed = True
+        return changed
 
 
 class TunnelResponse(BaseModel):
@@ -39,12 +159,26 @@ class TunnelResponse(BaseModel):
     spec: dict
     status: str
     error_message: str | None = None
+    quota_mb: float = 0
+    used_mb: float = 0
+    expires_at: datetime | None = None
     revision: int
     created_at: datetime
     updated_at: datetime
+    restart_count: int = 0
+    last_exit_reason: str | None = None
+    resources: dict | None = None
     
     class Config:
         from_attributes = True
+    
+    @model_validator(mode="after")
+    def attach_restart_stats(self):
+        stats = tunnel_supervisor.stats(self.id)
+        self.restart_count = stats["restart_count"]
+        self.last_exit_reason = stats["last_exit_reason"]
+        self.resources = cgroups.stats(tunnel_leaf(self.id))
+        return self
 
 
 @router.post("", response_model=TunnelResponse)
@@ -52,7 +186,11 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
     """Create a new tunnel and auto-apply it"""
     from app.hysteria2_client import Hysteria2Client
     
-    logger.info(f"Creating tunnel: name={tunnel.name}, type={tunnel.type}, core={tunnel.core}, node_id={tunnel.node_id}")
+    logger.info(
+        "Creating tunnel: name=%s, type=%s, core=%s, node_id=%s",
+        tunnel.name, tunnel.type, tunnel.core, tunnel.node_id,
+        extra={"core": tunnel.core, "node_id": tunnel.node_id},
+    )
     
     node = None
     if tunnel.node_id:
@@ -63,25 +201,42 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
     elif tunnel.core in {"rathole", "backhaul"}:
         raise HTTPException(status_code=400, detail=f"Node is required for {tunnel.core.title()} tunnels")
     
+    _check_spec(tunnel.spec, tunnel.type)
+    tunnel_id = generate_uuid()
+    try:
+        spec = port_index.assign_auto_ports(tunnel.core, tunnel.type, tunnel.spec)
+        port_index.reserve(tunnel_id, claimed_ports(tunnel.core, tunnel.type, spec))
+    except PortConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
     db_tunnel = Tunnel(
+        id=tunnel_id,
         name=tunnel.name,
         core=tunnel.core,
         type=tunnel.type,
         node_id=tunnel.node_id or "",
-        spec=tunnel.spec,
+        spec=spec,
+        quota_mb=tunnel.quota_mb,
+        expires_at=tunnel.expires_at,
         status="pending"
     )
     db.add(db_tunnel)
-    await db.commit()
+    try:
+        await db.commit()
+    except Exception:
+        port_index.release(tunnel_id)
+        raise
     await db.refresh(db_tunnel)
+    log = bind(logger, tunnel_id=db_tunnel.id, core=db_tunnel.core, node_id=db_tunnel.node_id)
     
     try:
-        needs_gost_forwarding = db_tunnel.type in ["tcp", "udp", "ws", "grpc", "tcpmux"] and db_tunnel.core == "xray"
-        needs_rathole_server = db_tunnel.core == "rathole"
-        needs_backhaul_server = db_tunnel.core == "backhaul"
-        needs_node_apply = db_tunnel.core in {"rathole", "backhaul"}
+        route = TunnelDescriptor(db_tunnel)
+        needs_gost_forwarding = route.needs_gost_forwarding
+        needs_rathole_server = route.needs_rathole_server
+        needs_backhaul_server = route.needs_backhaul_server
+        needs_node_apply = route.needs_node_apply
         
-        logger.info(
+        log.info(
             "Tunnel %s: gost=%s, rathole=%s, backhaul=%s",
             db_tunnel.id,
             needs_gost_forwarding,
@@ -101,16 +256,16 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
                 await db.refresh(db_tunnel)
                 return db_tunnel
             try:
-                logger.info("Starting Backhaul server for tunnel %s", db_tunnel.id)
-                manager.start_server(db_tunnel.id, db_tunnel.spec or {})
-                time.sleep(1.5)
+                log.info("Starting Backhaul server for tunnel %s", db_tunnel.id)
+                await asyncio.to_thread(manager.start_server, db_tunnel.id, db_tunnel.spec or {})
+                await asyncio.sleep(1.5)
                 if not manager.is_running(db_tunnel.id):
                     raise RuntimeError("Backhaul process started but is not running")
                 backhaul_started = True
-                logger.info("Started Backhaul server for tunnel %s", db_tunnel.id)
+                log.info("Started Backhaul server for tunnel %s", db_tunnel.id)
             except Exception as exc:
                 error_msg = f"Backhaul server error: {exc}"
-                logger.error("Failed to start Backhaul server for tunnel %s: %s", db_tunnel.id, exc, exc_info=True)
+                log.error("Failed to start Backhaul server for tunnel %s: %s", db_tunnel.id, exc, exc_info=True)
                 db_tunnel.status = "error"
                 db_tunnel.error_message = error_msg
                 await db.commit()
@@ -118,9 +273,9 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
                 return db_tunnel
         
         if needs_rathole_server:
-            remote_addr = db_tunnel.spec.get("remote_addr")
-            token = db_tunnel.spec.get("token")
-            proxy_port = db_tunnel.spec.get("remote_port") or db_tunnel.spec.get("listen_port")
+            remote_addr = route.rathole_remote_addr
+            token = route.rathole_token
+            proxy_port = route.rathole_proxy_port
             
             if remote_addr and ":" in remote_addr:
                 rathole_port = remote_addr.split(":")[1]
@@ -136,18 +291,19 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
             
             if remote_addr and token and proxy_port and hasattr(request.app.state, 'rathole_server_manager'):
                 try:
-                    logger.info(f"Starting Rathole server for tunnel {db_tunnel.id}: remote_addr={remote_addr}, token={token}, proxy_port={proxy_port}")
-                    request.app.state.rathole_server_manager.start_server(
+                    log.info("Starting Rathole server for tunnel %s: remote_addr=%s, proxy_port=%s", db_tunnel.id, remote_addr, proxy_port)
+                    await asyncio.to_thread(
+                        request.app.state.rathole_server_manager.start_server,
                         tunnel_id=db_tunnel.id,
                         remote_addr=remote_addr,
                         token=token,
-                        proxy_port=int(proxy_port)
+                        proxy_port=proxy_port
                     )
-                    logger.info(f"Successfully started Rathole server for tunnel {db_tunnel.id}")
+                    log.info("Successfully started Rathole server for tunnel %s", db_tunnel.id)
                     rathole_started = True
                 except Exception as e:
                     error_msg = str(e)
-                    logger.error(f"Failed to start Rathole server for tunnel {db_tunnel.id}: {error_msg}", exc_info=True)
+                    log.error("Failed to start Rathole server for tunnel %s: %s", db_tunnel.id, error_msg, exc_info=True)
                     db_tunnel.status = "error"
                     db_tunnel.error_message = f"Rathole server error: {error_msg}"
                     await db.commit()
@@ -163,7 +319,7 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
                     missing.append("proxy_port")
                 if not hasattr(request.app.state, 'rathole_server_manager'):
                     missing.append("rathole_server_manager")
-                logger.warning(f"Tunnel {db_tunnel.id}: Missing required fields for Rathole server: {missing}")
+                log.warning("Tunnel %s: Missing required fields for Rathole server: %s", db_tunnel.id, missing)
                 if not remote_addr or not token or not proxy_port:
                     db_tunnel.status = "error"
                     db_tunnel.error_message = f"Missing required fields for Rathole: {missing}"
@@ -177,7 +333,7 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
                 node.node_metadata["api_address"] = f"http://{node.node_metadata.get('ip_address', node.fingerprint)}:{node.node_metadata.get('api_port', 8888)}"
                 await db.commit()
             
-            logger.info(f"Applying tunnel {db_tunnel.id} to node {node.id}")
+            log.info("Applying tunnel %s to node %s", db_tunnel.id, node.id)
             response = await client.send_to_node(
                 node_id=node.id,
                 endpoint="/api/agent/tunnels/apply",
@@ -185,7 +341,8 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
                     "tunnel_id": db_tunnel.id,
                     "core": db_tunnel.core,
                     "type": db_tunnel.type,
-                    "spec": db_tunnel.spec
+                    "spec": db_tunnel.spec,
+                    "limits": limits_payload(db_tunnel)
                 }
             )
             
@@ -193,15 +350,15 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
                 db_tunnel.status = "error"
                 error_msg = response.get("message", "Unknown error from node")
                 db_tunnel.error_message = f"Node error: {error_msg}"
-                logger.error(f"Tunnel {db_tunnel.id}: {error_msg}")
+                log.error("Tunnel %s: %s", db_tunnel.id, error_msg)
                 if needs_rathole_server and hasattr(request.app.state, 'rathole_server_manager'):
                     try:
-                        request.app.state.rathole_server_manager.stop_server(db_tunnel.id)
+                        await asyncio.to_thread(request.app.state.rathole_server_manager.stop_server, db_tunnel.id)
                     except:
                         pass
                 if needs_backhaul_server and hasattr(request.app.state, "backhaul_manager"):
                     try:
-                        request.app.state.backhaul_manager.stop_server(db_tunnel.id)
+                        await asyncio.to_thread(request.app.state.backhaul_manager.stop_server, db_tunnel.id)
                     except Exception:
                         pass
                 await db.commit()
@@ -211,15 +368,15 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
             if response.get("status") != "success":
                 db_tunnel.status = "error"
                 db_tunnel.error_message = "Failed to apply tunnel to node. Check node connection."
-                logger.error(f"Tunnel {db_tunnel.id}: Failed to apply to node")
+                log.error("Tunnel %s: Failed to apply to node", db_tunnel.id)
                 if needs_rathole_server and hasattr(request.app.state, 'rathole_server_manager'):
                     try:
-                        request.app.state.rathole_server_manager.stop_server(db_tunnel.id)
+                        await asyncio.to_thread(request.app.state.rathole_server_manager.stop_server, db_tunnel.id)
                     except:
                         pass
                 if needs_backhaul_server and hasattr(request.app.state, "backhaul_manager"):
                     try:
-                        request.app.state.backhaul_manager.stop_server(db_tunnel.id)
+                        await asyncio.to_thread(request.app.state.backhaul_manager.stop_server, db_tunnel.id)
                     except Exception:
                         pass
                 await db.commit()
@@ -231,32 +388,27 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
         try:
             
             if needs_gost_forwarding:
-                listen_port = db_tunnel.spec.get("listen_port")
-                forward_to = db_tunnel.spec.get("forward_to")
-                
-                if not forward_to:
-                    remote_ip = db_tunnel.spec.get("remote_ip", "127.0.0.1")
-                    remote_port = db_tunnel.spec.get("remote_port", 8080)
-                    forward_to = f"{remote_ip}:{remote_port}"
-                
-                panel_port = listen_port or db_tunnel.spec.get("remote_port")
+                forward_to = route.forward_to
+                panel_port = route.panel_port
                 
                 if panel_port and forward_to and hasattr(request.app.state, 'gost_forwarder'):
                     try:
-                        logger.info(f"Starting gost forwarding for tunnel {db_tunnel.id}: {db_tunnel.type}://:{panel_port} -> {forward_to}")
-                        request.app.state.gost_forwarder.start_forward(
+                        log.info("Starting gost forwarding for tunnel %s: %s://:%s -> %s", db_tunnel.id, db_tunnel.type, panel_port, forward_to)
+                        await asyncio.to_thread(
+                            request.app.state.gost_forwarder.start_forward,
                             tunnel_id=db_tunnel.id,
-                            local_port=int(panel_port),
+                            local_port=panel_port,
                             forward_to=forward_to,
-                            tunnel_type=db_tunnel.type
+                            tunnel_type=db_tunnel.type,
+                            load_balance=route.load_balance
                         )
-                        time.sleep(2)
+                        await asyncio.sleep(2)
                         if not request.app.state.gost_forwarder.is_forwarding(db_tunnel.id):
                             raise RuntimeError("Gost process started but is not running")
-                        logger.info(f"Successfully started gost forwarding for tunnel {db_tunnel.id}")
+                        log.info("Successfully started gost forwarding for tunnel %s", db_tunnel.id)
                     except Exception as e:
                         error_msg = str(e)
-                        logger.error(f"Failed to start gost forwarding for tunnel {db_tunnel.id}: {error_msg}", exc_info=True)
+                        log.error("Failed to start gost forwarding for tunnel %s: %s", db_tunnel.id, error_msg, exc_info=True)
                         db_tunnel.status = "error"
                         db_tunnel.error_message = f"Gost forwarding error: {error_msg}"
                         await db.commit()
@@ -270,30 +422,42 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
                         missing.append("forward_to")
                     if not hasattr(request.app.state, 'gost_forwarder'):
                         missing.append("gost_forwarder")
-                    logger.warning(f"Tunnel {db_tunnel.id}: Missing required fields: {missing}")
+                    log.warning("Tunnel %s: Missing required fields: %s", db_tunnel.id, missing)
                     if not forward_to:
                         error_msg = "forward_to is required for gost tunnels"
                         db_tunnel.status = "error"
                         db_tunnel.error_message = error_msg
             
+            elif route.needs_panel_forwarding:
+                try:
+                    log.info("Starting panel forwarding for tunnel %s: tcp://:%s -> %s", db_tunnel.id, route.panel_port, route.forward_to)
+                    await port_forwarder.start_tunnel(route)
+                except Exception as e:
+                    log.error("Failed to start panel forwarding for tunnel %s: %s", db_tunnel.id, e, exc_info=True)
+                    db_tunnel.status = "error"
+                    db_tunnel.error_message = f"Forwarding error: {e}"
+                    await db.commit()
+                    await db.refresh(db_tunnel)
+                    return db_tunnel
+            
         except Exception as e:
-            logger.error(f"Exception in forwarding setup for tunnel {db_tunnel.id}: {e}", exc_info=True)
+            log.error("Exception in forwarding setup for tunnel %s: %s", db_tunnel.id, e, exc_info=True)
         
         await db.commit()
         await db.refresh(db_tunnel)
     except Exception as e:
-        logger.error(f"Exception in tunnel creation for {db_tunnel.id}: {e}", exc_info=True)
+        log.error("Exception in tunnel creation for %s: %s", db_tunnel.id, e, exc_info=True)
         error_msg = str(e)
         db_tunnel.status = "error"
         db_tunnel.error_message = f"Tunnel creation error: {error_msg}"
         try:
             if needs_rathole_server and hasattr(request.app.state, "rathole_server_manager"):
-                request.app.state.rathole_server_manager.stop_server(db_tunnel.id)
+                await asyncio.to_thread(request.app.state.rathole_server_manager.stop_server, db_tunnel.id)
         except Exception:
             pass
         try:
             if needs_backhaul_server and hasattr(request.app.state, "backhaul_manager"):
-                request.app.state.backhaul_manager.stop_server(db_tunnel.id)
+                await asyncio.to_thread(request.app.state.backhaul_manager.stop_server, db_tunnel.id)
         except Exception:
             pass
         await db.commit()
@@ -302,12 +466,52 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
     return db_tunnel
 
 
+RUNTIME_FIELDS = ("restart_count", "last_exit_reason", "resources")
+TUNNEL_FIELDS = list(TunnelResponse.model_fields)
+# Reading cgroup files per row is left to callers that ask for it with fields=
+DEFAULT_LIST_FIELDS = [f for f in TUNNEL_FIELDS if f != "resources"]
+
+
+def _project_tunnel(row, fields: List[str]) -> dict:
+    """Build the response dict straight from a row, bypassing TunnelResponse validation"""
+    stats = tunnel_supervisor.stats(row.id) if any(f in RUNTIME_FIELDS for f in fields) else {}
+    if "resources" in fields:
+        stats["resources"] = cgroups.stats(tunnel_leaf(row.id))
+    return {field: stats[field] if field in RUNTIME_FIELDS else getattr(row, field) for field in fields}
+
+
 @router.get("", response_model=List[TunnelResponse])
-async def list_tunnels(db: AsyncSession = Depends(get_db)):
-    """List all tunnels"""
-    result = await db.execute(select(Tunnel))
-    tunnels = result.scalars().all()
-    return tunnels
+async def list_tunnels(
+    request: Request,
+    status: str | None = None,
+    core: str | None = None,
+    node_id: str | None = None,
+    tunnel_type: str | None = Query(None, alias="type"),
+    fields: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """List tunnels, optionally filtered, projected with ``fields=`` and paged with ``limit``/``cursor``
+    
+    The next page cursor is returned in the ``X-Next-Cursor`` header.
+    """
+    selected = parse_fields(fields, TUNNEL_FIELDS) or DEFAULT_LIST_FIELDS
+    columns = {"id", "created_at"} | {f for f in selected if f not in RUNTIME_FIELDS}
+    query = select(*(getattr(Tunnel, c) for c in sorted(columns)))
+    
+    for column, value in (
+        (Tunnel.status, status),
+        (Tunnel.core, core),
+        (Tunnel.node_id, node_id),
+        (Tunnel.type, tunnel_type),
+    ):
+        if value is not None:
+            query = query.where(column == value)
+    
+    result = await db.execute(apply_keyset(query, Tunnel, cursor, limit))
+    rows, next_cursor = split_page(result.all(), limit)
+    return etag_response(request, [_project_tunnel(row, selected) for row in rows], next_cursor)
 
 
 @router.get("/{tunnel_id}", response_model=TunnelResponse)
@@ -317,7 +521,7 @@ async def get_tunnel(tunnel_id: str, db: AsyncSession = Depends(get_db)):
     tunnel = result.scalar_one_or_none()
     if not tunnel:
         raise HTTPException(status_code=404, detail="Tunnel not found")
-    return tunnel
+    return ORJSONResponse(_project_tunnel(tunnel, TUNNEL_FIELDS))
 
 
 @router.put("/{tunnel_id}", response_model=TunnelResponse)
@@ -327,7 +531,7 @@ async def update_tunnel(
     request: Request,
     db: AsyncSession = Depends(get_db)
 ):
-    """Update a tunnel and re-apply if spec changed"""
+    """Update a tunnel and re-apply if spec changed; a `rate_limit`-only change is applied live"""
     from app.hysteria2_client import Hysteria2Client
     
     result = await db.execute(select(Tunnel).where(Tunnel.id == tunnel_id))
@@ -335,54 +539,57 @@ async def update_tunnel(
     if not tunnel:
         raise HTTPException(status_code=404, detail="Tunnel not found")
     
-    spec_changed = tunnel_update.spec is not None and tunnel_update.spec != tunnel.spec
-    
-    if tunnel_update.name is not None:
-        tunnel.name = tunnel_update.name
     if tunnel_update.spec is not None:
-        tunnel.spec = tunnel_update.spec
+        _check_spec(tunnel_update.spec, tunnel.type)
+        try:
+            tunnel_update.spec = port_index.assign_auto_ports(tunnel.core, tunnel.type, tunnel_update.spec)
+            port_index.reserve(tunnel.id, claimed_ports(tunnel.core, tunnel.type, tunnel_update.spec))
+        except PortConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
     
-    tunnel.revision += 1
-    tunnel.updated_at = datetime.utcnow()
+    spec_changed, limits_changed = _apply_update(tunnel_update, tunnel)
     
-    await db.commit()
+    try:
+        await db.commit()
+    except Exception:
+        _restore_claims(tunnel.id)
+        raise
     await db.refresh(tunnel)
     
-    if spec_changed:
+    if _restart_allowed(TunnelDescriptor(tunnel), spec_changed):
+        log = bind(logger, tunnel_id=tunnel.id, core=tunnel.core, node_id=tunnel.node_id)
+        tunnel_supervisor.reset(tunnel.id)
         try:
-            needs_gost_forwarding = tunnel.type in ["tcp", "udp", "ws", "grpc", "tcpmux"] and tunnel.core == "xray"
-            needs_rathole_server = tunnel.core == "rathole"
-            needs_backhaul_server = tunnel.core == "backhaul"
-            needs_node_apply = tunnel.core in {"rathole", "backhaul"}
+            route = TunnelDescriptor(tunnel)
+            needs_gost_forwarding = route.needs_gost_forwarding
+            needs_rathole_server = route.needs_rathole_server
+            needs_backhaul_server = route.needs_backhaul_server
+            needs_node_apply = route.needs_node_apply
+            await _drop_other_forwarder(request, route)
             
             if needs_gost_forwarding:
-                listen_port = tunnel.spec.get("listen_port")
-                forward_to = tunnel.spec.get("forward_to")
-                
-                if not forward_to:
-                    remote_ip = tunnel.spec.get("remote_ip", "127.0.0.1")
-                    remote_port = tunnel.spec.get("remote_port", 8080)
-                    forward_to = f"{remote_ip}:{remote_port}"
-                
-                panel_port = listen_port or tunnel.spec.get("remote_port")
+                forward_to = route.forward_to
+                panel_port = route.panel_port
                 
                 if panel_port and forward_to and hasattr(request.app.state, 'gost_forwarder'):
                     try:
-                        request.app.state.gost_forwarder.stop_forward(tunnel.id)
-                        time.sleep(0.5)
-                        logger.info(f"Restarting gost forwarding for tunnel {tunnel.id}: {tunnel.type}://:{panel_port} -> {forward_to}")
-                        request.app.state.gost_forwarder.start_forward(
+                        await asyncio.to_thread(request.app.state.gost_forwarder.stop_forward, tunnel.id)
+                        await asyncio.sleep(0.5)
+                        log.info("Restarting gost forwarding for tunnel %s: %s://:%s -> %s", tunnel.id, tunnel.type, panel_port, forward_to)
+                        await asyncio.to_thread(
+                            request.app.state.gost_forwarder.start_forward,
                             tunnel_id=tunnel.id,
-                            local_port=int(panel_port),
+                            local_port=panel_port,
                             forward_to=forward_to,
-                            tunnel_type=tunnel.type
+                            tunnel_type=tunnel.type,
+                            load_balance=route.load_balance
                         )
                         tunnel.status = "active"
                         tunnel.error_message = None
-                        logger.info(f"Successfully restarted gost forwarding for tunnel {tunnel.id}")
+                        log.info("Successfully restarted gost forwarding for tunnel %s", tunnel.id)
                     except Exception as e:
                         error_msg = str(e)
-                        logger.error(f"Failed to restart gost forwarding for tunnel {tunnel.id}: {error_msg}", exc_info=True)
+                        log.error("Failed to restart gost forwarding for tunnel %s: %s", tunnel.id, error_msg, exc_info=True)
                         tunnel.status = "error"
                         tunnel.error_message = f"Gost forwarding error: {error_msg}"
                 else:
@@ -390,43 +597,55 @@ async def update_tunnel(
                         tunnel.status = "error"
                         tunnel.error_message = "forward_to is required for gost tunnels"
             
+            elif route.needs_panel_forwarding:
+                try:
+                    log.info("Restarting panel forwarding for tunnel %s: tcp://:%s -> %s", tunnel.id, route.panel_port, route.forward_to)
+                    await port_forwarder.start_tunnel(route)
+                    tunnel.status = "active"
+                    tunnel.error_message = None
+                except Exception as e:
+                    log.error("Failed to restart panel forwarding for tunnel %s: %s", tunnel.id, e, exc_info=True)
+                    tunnel.status = "error"
+                    tunnel.error_message = f"Forwarding error: {e}"
+            
             elif needs_rathole_server:
                 if hasattr(request.app.state, 'rathole_server_manager'):
-                    remote_addr = tunnel.spec.get("remote_addr")
-                    token = tunnel.spec.get("token")
-                    proxy_port = tunnel.spec.get("remote_port") or tunnel.spec.get("listen_port")
+                    remote_addr = route.rathole_remote_addr
+                    token = route.rathole_token
+                    proxy_port = route.rathole_proxy_port
                     
                     if remote_addr and token and proxy_port:
                         try:
-                            request.app.state.rathole_server_manager.stop_server(tunnel.id)
-                            request.app.state.rathole_server_manager.start_server(
+                            await asyncio.to_thread(request.app.state.rathole_server_manager.stop_server, tunnel.id)
+                            await asyncio.to_thread(
+                                request.app.state.rathole_server_manager.start_server,
                                 tunnel_id=tunnel.id,
                                 remote_addr=remote_addr,
                                 token=token,
-                                proxy_port=int(proxy_port)
+                                proxy_port=proxy_port
                             )
                             tunnel.status = "active"
                             tunnel.error_message = None
                         except Exception as e:
-                            logger.error(f"Failed to restart Rathole server: {e}")
+                            log.error("Failed to restart Rathole server: %s", e)
                             tunnel.status = "error"
                             tunnel.error_message = f"Rathole server error: {str(e)}"
             elif needs_backhaul_server:
                 manager = getattr(request.app.state, "backhaul_manager", None)
                 if manager:
                     try:
-                        manager.stop_server(tunnel.id)
+                        await asyncio.to_thread(manager.stop_server, tunnel.id)
                     except Exception:
                         pass
                     try:
-                        manager.start_server(tunnel.id, tunnel.spec or {})
-                        time.sleep(1.0)
+                        await asyncio.to_thread(manager.start_server, tunnel.id, tunnel.spec or {})
+                        await asyncio.sleep(1.0)
                         if not manager.is_running(tunnel.id):
                             raise RuntimeError("Backhaul process not running")
                         tunnel.status = "active"
                         tunnel.error_message = None
                     except Exception as exc:
-                        logger.error("Failed to restart Backhaul server for tunnel %s: %s", tunnel.id, exc, exc_info=True)
+                        log.error("Failed to restart Backhaul server for tunnel %s: %s", tunnel.id, exc, exc_info=True)
                         tunnel.status = "error"
                         tunnel.error_message = f"Backhaul server error: {exc}"
             
@@ -443,7 +662,8 @@ async def update_tunnel(
                                 "tunnel_id": tunnel.id,
                                 "core": tunnel.core,
                                 "type": tunnel.type,
-                                "spec": tunnel.spec
+                                "spec": tunnel.spec,
+                                "limits": limits_payload(tunnel)
                             }
                         )
                         
@@ -455,28 +675,33 @@ async def update_tunnel(
                             tunnel.error_message = f"Node error: {response.get('message', 'Unknown error')}"
                             if needs_backhaul_server and hasattr(request.app.state, "backhaul_manager"):
                                 try:
-                                    request.app.state.backhaul_manager.stop_server(tunnel.id)
+                                    await asyncio.to_thread(request.app.state.backhaul_manager.stop_server, tunnel.id)
                                 except Exception:
                                     pass
                     except Exception as e:
-                        logger.error(f"Failed to re-apply tunnel to node: {e}")
+                        log.error("Failed to re-apply tunnel to node: %s", e)
                         tunnel.status = "error"
                         tunnel.error_message = f"Node error: {str(e)}"
                         if needs_backhaul_server and hasattr(request.app.state, "backhaul_manager"):
                             try:
-                                request.app.state.backhaul_manager.stop_server(tunnel.id)
+                                await asyncio.to_thread(request.app.state.backhaul_manager.stop_server, tunnel.id)
                             except Exception:
                                 pass
             
             await db.commit()
             await db.refresh(tunnel)
         except Exception as e:
-            logger.error(f"Failed to re-apply tunnel: {e}", exc_info=True)
+            log.error("Failed to re-apply tunnel: %s", e, exc_info=True)
             tunnel.status = "error"
             tunnel.error_message = f"Re-apply error: {str(e)}"
             await db.commit()
             await db.refresh(tunnel)
+    elif limits_changed:
+        await _push_limits(TunnelDescriptor(tunnel))
     
+    if spec_changed or limits_changed:
+        # Also stops a running tunnel whose new limits it already exceeds
+        quota_enforcer.check(tunnel.id)
     return tunnel
 
 
@@ -506,7 +731,8 @@ async def apply_tunnel(tunnel_id: str, db: AsyncSession = Depends(get_db)):
                 "tunnel_id": tunnel.id,
                 "core": tunnel.core,
                 "type": tunnel.type,
-                "spec": tunnel.spec
+                "spec": tunnel.spec,
+                "limits": limits_payload(tunnel)
             }
         )
         
@@ -535,32 +761,35 @@ async def delete_tunnel(tunnel_id: str, request: Request, db: AsyncSession = Dep
     if not tunnel:
         raise HTTPException(status_code=404, detail="Tunnel not found")
     
-    needs_gost_forwarding = tunnel.type in ["tcp", "udp", "ws", "grpc"] and tunnel.core == "xray"
-    needs_rathole_server = tunnel.core == "rathole"
-    needs_backhaul_server = tunnel.core == "backhaul"
+    log = bind(logger, tunnel_id=tunnel.id, core=tunnel.core, node_id=tunnel.node_id)
+    route = TunnelDescriptor(tunnel)
+    needs_gost_forwarding = route.needs_gost_forwarding
+    needs_rathole_server = route.needs_rathole_server
+    needs_backhaul_server = route.needs_backhaul_server
+    tunnel_supervisor.forget(tunnel.id)
     
     if needs_gost_forwarding:
         if hasattr(request.app.state, 'gost_forwarder'):
             try:
-                request.app.state.gost_forwarder.stop_forward(tunnel.id)
+                await asyncio.to_thread(request.app.state.gost_forwarder.stop_forward, tunnel.id)
             except Exception as e:
-                import logging
-                logging.error(f"Failed to stop gost forwarding: {e}")
+                log.error("Failed to stop gost forwarding: %s", e)
+    
+    elif route.needs_panel_forwarding:
+        await port_forwarder.stop_tunnel(tunnel.id)
     
     elif needs_rathole_server:
         if hasattr(request.app.state, 'rathole_server_manager'):
             try:
-                request.app.state.rathole_server_manager.stop_server(tunnel.id)
+                await asyncio.to_thread(request.app.state.rathole_server_manager.stop_server, tunnel.id)
             except Exception as e:
-                import logging
-                logging.error(f"Failed to stop Rathole server: {e}")
+                log.error("Failed to stop Rathole server: %s", e)
     elif needs_backhaul_server:
         if hasattr(request.app.state, "backhaul_manager"):
             try:
-                request.app.state.backhaul_manager.stop_server(tunnel.id)
+                await asyncio.to_thread(request.app.state.backhaul_manager.stop_server, tunnel.id)
             except Exception as e:
-                import logging
-                logging.error(f"Failed to stop Backhaul server: {e}")
+                log.error("Failed to stop Backhaul server: %s", e)
     
     if tunnel.status == "active":
         result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
@@ -578,4 +807,320 @@ async def delete_tunnel(tunnel_id: str, request: Request, db: AsyncSession = Dep
     
     await db.delete(tunnel)
     await db.commit()
+    forget_tunnel(tunnel_id)
     return {"status": "deleted"}
+
+
+_bulk_tasks: set = set()
+
+
+class TunnelBulkUpdate(TunnelUpdate):
+    id: str
+
+
+class TunnelBulkRequest(BaseModel):
+    create: List[TunnelCreate] = []
+    update: List[TunnelBulkUpdate] = []
+    delete: List[str] = []
+
+
+def _start_panel_side(request: Request, route: TunnelDescriptor):
+    """Start the panel-side process for a tunnel; blocking, run in a worker thread"""
+    state = request.app.state
+    if route.needs_backhaul_server:
+        state.backhaul_manager.start_server(route.id, route.spec)
+    if route.needs_rathole_server:
+        if not route.rathole_remote_addr or not route.rathole_token or not route.rathole_proxy_port:
+            raise ValueError("Missing required fields for Rathole: remote_addr, token and remote_port/listen_port")
+        if route.rathole_remote_addr.rsplit(":", 1)[-1] == "8000":
+            raise ValueError("Rathole server cannot use port 8000 (panel API port)")
+        state.rathole_server_manager.start_server(
+            tunnel_id=route.id,
+            remote_addr=route.rathole_remote_addr,
+            token=route.rathole_token,
+            proxy_port=route.rathole_proxy_port
+        )
+    if route.needs_gost_forwarding:
+        if not route.panel_port:
+            raise ValueError("listen_port or remote_port is required for gost tunnels")
+        state.gost_forwarder.start_forward(
+            tunnel_id=route.id,
+            local_port=route.panel_port,
+            forward_to=route.forward_to,
+            tunnel_type=route.type,
+            load_balance=route.load_balance
+        )
+
+
+def _stop_panel_side(request: Request, route: TunnelDescriptor):
+    """Stop whatever the panel runs for a tunnel; blocking, run in a worker thread"""
+    state = request.app.state
+    try:
+        if route.needs_gost_forwarding:
+            state.gost_forwarder.stop_forward(route.id)
+        elif route.needs_rathole_server:
+            state.rathole_server_manager.stop_server(route.id)
+        elif route.needs_backhaul_server:
+            state.backhaul_manager.stop_server(route.id)
+    except Exception as e:
+        logger.warning("Failed to stop panel side of tunnel %s: %s", route.id, e, extra={"tunnel_id": route.id})
+
+
+async def _drop_other_forwarder(request: Request, route: TunnelDescriptor):
+    """Stop a forward left behind by the forwarder a tunnel used before its spec changed"""
+    if route.needs_panel_forwarding:
+        await asyncio.to_thread(request.app.state.gost_forwarder.stop_forward, route.id)
+    elif route.needs_gost_forwarding:
+        await port_forwarder.stop_tunnel(route.id)
+
+
+async def _stop_panel(request: Request, route: TunnelDescriptor):
+    if route.needs_panel_forwarding:
+        await port_forwarder.stop_tunnel(route.id)
+    else:
+        await asyncio.to_thread(_stop_panel_side, request, route)
+
+
+async def _activate(request: Request, route: TunnelDescriptor) -> str | None:
+    """Bring a tunnel up on the panel and its node; returns an error message or None"""
+    try:
+        await _drop_other_forwarder(request, route)
+        if route.needs_panel_forwarding:
+            await port_forwarder.start_tunnel(route)
+        else:
+            await asyncio.to_thread(_start_panel_side, request, route)
+    except Exception as e:
+        await _stop_panel(request, route)
+        return f"Panel process error: {e}"
+    
+    if route.needs_node_apply:
+        response = await Hysteria2Client().send_to_node(
+            node_id=route.node_id,
+            endpoint="/api/agent/tunnels/apply",
+            data={
+                "tunnel_id": route.id,
+                "core": route.core,
+                "type": route.type,
+                "spec": route.spec,
+                "limits": limits_payload(route),
+            }
+        )
+        if response.get("status") != "success":
+            await _stop_panel(request, route)
+            return f"Node error: {response.get('message', 'Failed to apply tunnel to node')}"
+    return None
+
+
+async def _deactivate(request: Request, route: TunnelDescriptor) -> str | None:
+    await _stop_panel(request, route)
+    if route.needs_node_apply and route.status == "active":
+        response = await Hysteria2Client().send_to_node(
+            node_id=route.node_id,
+            endpoint="/api/agent/tunnels/remove",
+            data={"tunnel_id": route.id}
+        )
+        if response.get("status") != "success":
+            return f"Node error: {response.get('message', 'Failed to remove tunnel from node')}"
+    return None
+
+
+@router.post("/bulk")
+async def bulk_tunnels(bulk: TunnelBulkRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    """Create, update and delete many tunnels at once
+    
+    Every item is validated before anything is written; a single invalid item
+    rejects the whole batch with 422. Rows are written in one transaction, then
+    deleted tunnels are stopped and afterwards the created and updated ones
+    started, concurrently within each phase (``BULK_APPLY_CONCURRENCY`` at a
+    time); one NDJSON result line is streamed per item as it finishes.
+    """
+    total = len(bulk.create) + len(bulk.update) + len(bulk.delete)
+    if total == 0:
+        raise HTTPException(status_code=400, detail="Empty bulk request")
+    if total > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_items} items per bulk request")
+    
+    errors = []
+    for index, item in enumerate(bulk.create):
+        if item.node_id:
+            if await tunnel_registry.get_node(item.node_id) is None:
+                errors.append({"op": "create", "index": index, "error": "Node not found"})
+        elif item.core in {"rathole", "backhaul"}:
+            errors.append({"op": "create", "index": index, "error": f"Node is required for {item.core.title()} tunnels"})
+    for op, items in (("create", bulk.create), ("update", bulk.update)):
+        for index, item in enumerate(items):
+            if op == "create":
+                tunnel_type = item.type
+            else:
+                route = tunnel_registry.get_tunnel(item.id)
+                tunnel_type = route.type if route else None
+            try:
+                _check_spec_sections(item.spec, tunnel_type)
+            except ValueError as e:
+                errors.append({"op": op, "index": index, "error": str(e)})
+    seen = set()
+    for op, ids in (("update", [item.id for item in bulk.update]), ("delete", bulk.delete)):
+        for index, tunnel_id in enumerate(ids):
+            if tunnel_registry.get_tunnel(tunnel_id) is None:
+                errors.append({"op": op, "index": index, "id": tunnel_id, "error": "Tunnel not found"})
+            elif tunnel_id in seen:
+                errors.append({"op": op, "index": index, "id": tunnel_id, "error": "Tunnel appears more than once"})
+            seen.add(tunnel_id)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    
+    # Ports freed by deletes in this batch may be reused by its creates and updates
+    freed = set(bulk.delete)
+    batch_owners = {}
+    
+    def check_ports(op: str, index: int, tunnel_id: str | None, core: str, tunnel_type: str, spec: dict) -> dict:
+        try:
+            spec = port_index.assign_auto_ports(core, tunnel_type, spec, taken=batch_owners)
+        except PortConflict as e:
+            errors.append({"op": op, "index": index, "error": str(e)})
+            return spec
+        claims = claimed_ports(core, tunnel_type, spec)
+        conflicts = [(c, owner) for c, owner in port_index.conflicts(claims, tunnel_id) if owner not in freed]
+        conflicts += [(c, batch_owners[c]) for c in claims if c in batch_owners]
+        if conflicts:
+            errors.append({"op": op, "index": index, "error": str(PortConflict(conflicts))})
+        for claim in claims:
+            batch_owners.setdefault(claim, tunnel_id or f"create[{index}]")
+        return spec
+    
+    for index, item in enumerate(bulk.create):
+        item.spec = check_ports("create", index, None, item.core, item.type, item.spec)
+    for index, item in enumerate(bulk.update):
+        if item.spec is not None:
+            route = tunnel_registry.get_tunnel(item.id)
+            item.spec = check_ports("update", index, item.id, route.core, route.type, item.spec)
+    if errors:
+        raise HTTPException(status_code=409, detail=errors)
+    # Hold the checked ports until the commit lands; ports of rows this batch
+    # deletes stay with them and move over when the registry applies the commit
+    create_ids = [generate_uuid() for _ in bulk.create]
+    reserved = []
+    for tunnel_id, item in zip(create_ids, bulk.create):
+        port_index.hold(tunnel_id, claimed_ports(item.core, item.type, item.spec))
+        reserved.append(tunnel_id)
+    for item in bulk.update:
+        if item.spec is not None:
+            route = tunnel_registry.get_tunnel(item.id)
+            port_index.hold(item.id, claimed_ports(route.core, route.type, item.spec))
+            reserved.append(item.id)
+    
+    deleted = [tunnel_registry.get_tunnel(tunnel_id) for tunnel_id in bulk.delete]
+    created = [
+        Tunnel(
+            id=tunnel_id,
+            name=item.name,
+            core=item.core,
+            type=item.type,
+            node_id=item.node_id or "",
+            spec=item.spec,
+            quota_mb=item.quota_mb,
+            expires_at=item.expires_at,
+            status="pending"
+        )
+        for tunnel_id, item in zip(create_ids, bulk.create)
+    ]
+    updated = []
+    changes: dict[str, tuple[bool, bool]] = {}
+    if bulk.update:
+        result = await db.execute(select(Tunnel).where(Tunnel.id.in_([item.id for item in bulk.update])))
+        rows = {t.id: t for t in result.scalars().all()}
+        for item in bulk.update:
+            row = rows[item.id]
+            changes[row.id] = _apply_update(item, row)
+            updated.append(row)
+    if bulk.delete:
+        await db.execute(sa_delete(Tunnel).where(Tunnel.id.in_(bulk.delete)))
+    db.add_all(created)
+    try:
+        await db.commit()
+    except Exception:
+        for tunnel_id in reserved:
+            _restore_claims(tunnel_id)
+        raise
+    for route in deleted:
+        tunnel_registry.discard_tunnel(route.id)
+        tunnel_supervisor.forget(route.id)
+        forget_tunnel(route.id)
+    for row in updated:
+        if changes[row.id][0]:
+            tunnel_supervisor.reset(row.id)
+    
+    jobs = (
+        [("create", i, TunnelDescriptor(row)) for i, row in enumerate(created)]
+        + [("update", i, TunnelDescriptor(row)) for i, row in enumerate(updated)]
+    )
+    # Re-register after the deletes so ports handed over inside this batch
+    # end up owned by their new tunnel
+    for _, _, route in jobs:
+        tunnel_registry.put_tunnel(route)
+    deletes = [("delete", i, route) for i, route in enumerate(deleted)]
+    slots = asyncio.Semaphore(settings.bulk_apply_concurrency)
+    lines: asyncio.Queue = asyncio.Queue()
+    
+    async def run(op: str, index: int, route: TunnelDescriptor, statuses: dict):
+        error = None
+        status = route.status
+        spec_changed, limits_changed = changes.get(route.id, (op == "create", False))
+        async with slots:
+            if op == "delete":
+                error = await _deactivate(request, route)
+                status = "deleted"
+            elif _restart_allowed(route, spec_changed):
+                error = await _activate(request, route)
+                status = "error" if error else "active"
+                statuses[route.id] = (status, error)
+            elif spec_changed:
+                # Out of quota or expired: not (re)started. A running tunnel is
+                # cut off by the enforcer below, which records its status
+                status, error = "error", limit_violation(route)[1]
+                if route.status != "active":
+                    statuses[route.id] = (status, error)
+            elif limits_changed:
+                await _push_limits(route)
+        if op == "update" and (spec_changed or limits_changed):
+            quota_enforcer.check(route.id)
+        line = {"op": op, "index": index, "id": route.id, "status": status}
+        if error:
+            line["error"] = error
+            bind(logger, tunnel_id=route.id, core=route.core, node_id=route.node_id).warning(
+                "Bulk %s of tunnel %s failed: %s", op, route.id, error
+            )
+        lines.put_nowait(line)
+    
+    async def process():
+        # Runs detached from the response so a disconnecting client does not
+        # leave half-started tunnels without a recorded status
+        statuses = {}
+        try:
+            # Deleted tunnels must have let go of their ports (and gost's
+            # pkill by port must have run) before anything reuses them
+            await asyncio.gather(*(run(op, index, route, statuses) for op, index, route in deletes))
+            await asyncio.gather(*(run(op, index, route, statuses) for op, index, route in jobs))
+        finally:
+            if statuses:
+                await _store_statuses(statuses)
+            lines.put_nowait(None)
+    
+    task = asyncio.create_task(process())
+    _bulk_tasks.add(task)
+    task.add_done_callback(_bulk_tasks.discard)
+    
+    async def results():
+        while (line := await lines.get()) is not None:
+            yield orjson.dumps(line) + b"\n"
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+async def _store_statuses(statuses: dict):
+    """Write the outcome of a bulk run in one transaction"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Tunnel).where(Tunnel.id.in_(list(statuses))))
+        for tunnel in result.scalars().all():
+            tunnel.status, tunnel.error_message = statuses[tunnel.id]
+        await session.commit()
@@ -7,6 +7,8 @@ from typing import List
 
 from app.database import get_db
 from app.models import Tunnel, Usage, Node
+from app.metrics import TUNNEL_USAGE_BYTES
+from app.quota_enforcer import quota_enforcer
 
 
 router = APIRouter()
@@ -33,9 +35,7 @@ async def push_usage(usage_data: UsagePush, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Tunnel not found")
     
     tunnel.used_mb += usage_data.bytes_used / (1024 * 1024)
-    
-    if tunnel.quota_mb > 0 and tunnel.used_mb >= tunnel.quota_mb:
-        tunnel.status = "error"
+    TUNNEL_USAGE_BYTES.labels(usage_data.tunnel_id).inc(max(0, usage_data.bytes_used))
     
     usage = Usage(
         tunnel_id=usage_data.tunnel_id,
@@ -44,6 +44,7 @@ async def push_usage(usage_data: UsagePush, db: AsyncSession = Depends(get_db)):
     )
     db.add(usage)
     await db.commit()
+    quota_enforcer.check(usage_data.tunnel_id)
     
     return {"status": "ok"}
 
@@ -60,5 +61,6 @@ async def get_tunnel_usage(tunnel_id: str, db: AsyncSession = Depends(get_db)):
         "tunnel_id": tunnel_id,
         "used_mb": tunnel.used_mb,
         "quota_mb": tunnel.quota_mb,
-        "remaining_mb": max(0, tunnel.quota_mb - tunnel.used_mb) if tunnel.quota_mb > 0 else None
+        "remaining_mb": max(0, tunnel.quota_mb - tunnel.used_mb) if tunnel.quota_mb > 0 else None,
+        "expires_at": tunnel.expires_at
     }
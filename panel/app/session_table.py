@@ -0,0 +1,125 @@
+"""Connection counters and active session table for the in-process forwarder
+
+Everything lives in flat ``array`` columns indexed by a session slot, so a
+relayed chunk costs two integer additions and an idle forward holds a few
+hundred bytes no matter how many connections it has seen. Slots of closed
+sessions are reused; the columns double when a forward runs out of them.
+Dicts are only built when the API or the metrics endpoint asks.
+"""
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+# Target connect time buckets in seconds (upper bounds, +Inf is implicit)
+CONNECT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+OPENED = 0
+CLOSED = 1
+CONNECT_FAILED = 2
+CONNECT_TIMEOUTS = 3
+BYTES_UP = 4
+BYTES_DOWN = 5
+POOL_HITS = 6
+COUNTER_NAMES = ("opened", "closed", "connect_failed", "connect_timeouts", "bytes_up", "bytes_down", "pool_hits")
+
+UP = 0
+DOWN = 1
+
+INITIAL_SLOTS = 16
+
+Address = Tuple[str, int]
+
+
+class SessionTable:
+    """Counters, connect-time histogram and live sessions of one forward"""
+
+    __slots__ = ("counters", "connect_hist", "connect_sum", "started", "bytes", "peers", "free", "active")
+
+    def __init__(self, slots: int = INITIAL_SLOTS):
+        self.counters = array("Q", bytes(8 * len(COUNTER_NAMES)))
+        self.connect_hist = array("Q", bytes(8 * (len(CONNECT_BUCKETS) + 1)))
+        self.connect_sum = 0.0
+        self.started = array("d")
+        # Interleaved per slot: bytes[2 * slot + UP], bytes[2 * slot + DOWN]
+        self.bytes = array("Q")
+        self.peers: List[Optional[Address]] = []
+        self.free: List[int] = []
+        self.active = 0
+        self._grow(slots)
+
+    def _grow(self, count: int):
+        first = len(self.started)
+        self.started.extend([0.0] * count)
+        self.bytes.extend([0] * (2 * count))
+        self.peers.extend([None] * count)
+        self.free.extend(range(first + count - 1, first - 1, -1))
+
+    def open(self, peer: Optional[Address]) -> int:
+        """Register an accepted connection; returns its slot"""
+        if not self.free:
+            self._grow(len(self.started))
+        slot = self.free.pop()
+        self.started[slot] = time.time()
+        self.bytes[2 * slot] = 0
+        self.bytes[2 * slot + 1] = 0
+        self.peers[slot] = peer
+        self.counters[OPENED] += 1
+        self.active += 1
+        return slot
+
+    def add(self, slot: int, direction: int, count: int):
+        self.bytes[2 * slot + direction] += count
+        self.counters[BYTES_UP + direction] += count
+
+    def close(self, slot: int):
+        if self.started[slot] == 0.0:
+            return
+        self.started[slot] = 0.0
+        self.peers[slot] = None
+        self.free.append(slot)
+        self.counters[CLOSED] += 1
+        self.active -= 1
+
+    def connected(self, seconds: float):
+        """Record how long the upstream connect took"""
+        index = 0
+        while index < len(CONNECT_BUCKETS) and seconds > CONNECT_BUCKETS[index]:
+            index += 1
+        self.connect_hist[index] += 1
+        self.connect_sum += seconds
+
+    def pool_hit(self):
+        """A client was spliced onto a pre-warmed upstream, no connect needed"""
+        self.counters[POOL_HITS] += 1
+
+    def connect_failed(self, timeout: bool = False):
+        self.counters[CONNECT_TIMEOUTS if timeout else CONNECT_FAILED] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        summary: Dict[str, Any] = dict(zip(COUNTER_NAMES, self.counters))
+        summary["active"] = self.active
+        connects = sum(self.connect_hist)
+        summary["connect_time"] = {
+            "count": connects,
+            "avg_ms": round(self.connect_sum / connects * 1000, 3) if connects else None,
+            "buckets": {
+                str(bound): hits for bound, hits in zip(CONNECT_BUCKETS + ("+Inf",), self.connect_hist)
+            },
+        }
+        return summary
+
+    def sessions(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        listed = []
+        for slot, started in enumerate(self.started):
+            if started == 0.0:
+                continue
+            peer = self.peers[slot]
+            listed.append({
+                "client": f"{peer[0]}:{peer[1]}" if peer else None,
+                "started_at": started,
+                "duration_seconds": round(now - started, 3),
+                "bytes_up": self.bytes[2 * slot],
+                "bytes_down": self.bytes[2 * slot + 1],
+            })
+        return listed
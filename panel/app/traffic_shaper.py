@@ -0,0 +1,283 @@
+"""Kernel traffic shaping for tunnels with a ``rate_limit``
+
+Gost, rathole and backhaul move the bytes themselves, so tunnel bandwidth
+is capped where it leaves and enters the panel host. Download traffic
+(source port = one of the tunnel's public ports) goes through an HTB class
+per tunnel on the egress interface. Upload traffic (destination port =
+public port) is policed on the ingress qdisc with one shared policer per
+tunnel. Each tunnel owns a minor id N: HTB class ``1:N``, filter priority
+N (IPv4) and N + 0x8000 (IPv6), and policer index N.
+
+The shaper reconciles against the registry, so editing a tunnel's
+``rate_limit`` changes the kernel rules in place without restarting its
+process. Without ``tc`` or CAP_NET_ADMIN everything degrades to a no-op.
+
+Shaping is opt-in (``TRAFFIC_SHAPING_ENABLED``) because the panel runs on
+the host network: the HTB root replaces the interface's root qdisc. It is
+only installed over the kernel's default qdisc (handle ``0:``, e.g. the
+``fq`` or ``mq`` picked by sysctl), which deleting ours on shutdown brings
+back. A root qdisc an administrator configured is left alone, and so is
+an existing ingress qdisc.
+"""
+import asyncio
+import logging
+import shutil
+import subprocess
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from app.bandwidth import RateLimit
+from app.config import settings
+from app.port_index import Claim
+from app.tunnel_registry import tunnel_registry
+
+logger = logging.getLogger(__name__)
+
+ROOT_HANDLE = "1:"
+INGRESS_HANDLE = "ffff:"
+IPV6_PRIO_OFFSET = 0x8000
+MAX_MINOR = IPV6_PRIO_OFFSET - 1
+
+Shape = Tuple[FrozenSet[Claim], RateLimit]
+
+
+def _default_interface() -> Optional[str]:
+    """Interface of the IPv4 default route"""
+    try:
+        with open("/proc/net/route") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == "00000000":
+                    return fields[0]
+    except (OSError, StopIteration):
+        pass
+    return None
+
+
+class TrafficShaper:
+    """Keeps tc classes, filters and policers in line with the tunnels' rate limits"""
+
+    def __init__(self, enabled: bool, interface: str):
+        self.enabled = enabled
+        self.interface = interface
+        self.applied: Dict[str, Shape] = {}
+        self.minors: Dict[str, int] = {}
+        self._ready: Optional[bool] = None
+        self._previous_root: Optional[str] = None
+        self._owns_ingress = False
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def install(self):
+        tunnel_registry.add_listener(self.notify)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self.notify()
+
+    def notify(self, tunnel_id: Optional[str] = None):
+        self._dirty.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._ready:
+            await asyncio.to_thread(self._teardown)
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            desired = {
+                tunnel.id: (tunnel.public_ports, tunnel.rate_limit)
+                for tunnel in tunnel_registry.active_tunnels()
+                # In-process forwards apply their rate_limit themselves
+                if tunnel.rate_limit is not None and tunnel.public_ports and not tunnel.needs_panel_forwarding
+            }
+            if desired == self.applied:
+                continue
+            try:
+                await asyncio.to_thread(self.reconcile, desired)
+            except Exception as e:
+                logger.error("Failed to update traffic shaping: %s", e, exc_info=True)
+
+    def reconcile(self, desired: Dict[str, Shape]):
+        """Apply ``desired`` shapes; blocking, run in a worker thread"""
+        if not desired and not self.applied:
+            return
+        if not self.available:
+            self.applied = dict(desired)
+            return
+        for tunnel_id in [t for t in self.applied if t not in desired]:
+            self._remove(tunnel_id)
+        for tunnel_id, shape in desired.items():
+            if self.applied.get(tunnel_id) != shape:
+                self._apply(tunnel_id, *shape)
+
+    @property
+    def available(self) -> bool:
+        if self._ready is None:
+            self._ready = self.enabled and self._setup()
+        return self._ready
+
+    def _tc(self, *args: str, check: bool = True) -> bool:
+        return self._tc_output(*args, check=check) is not None
+
+    def _tc_output(self, *args: str, check: bool = True) -> Optional[str]:
+        result = subprocess.run(["tc", *args], capture_output=True, text=True)
+        if result.returncode != 0:
+            if check:
+                logger.warning("tc %s failed: %s", " ".join(args), result.stderr.strip())
+            return None
+        return result.stdout
+
+    def _qdiscs(self) -> List[Tuple[str, str, str]]:
+        """``(kind, handle, parent)`` of the interface's qdiscs"""
+        qdiscs = []
+        for line in (self._tc_output("qdisc", "show", "dev", self.interface) or "").splitlines():
+            fields = line.split()
+            if len(fields) < 4 or fields[0] != "qdisc":
+                continue
+            parent = "root" if fields[3] == "root" else (fields[4] if fields[3] == "parent" and len(fields) > 4 else "")
+            qdiscs.append((fields[1], fields[2], parent))
+        return qdiscs
+
+    def _setup(self) -> bool:
+        if shutil.which("tc") is None:
+            logger.info("tc is not installed, tunnel rate limits are not enforced")
+            return False
+        self.interface = self.interface or _default_interface()
+        if not self.interface:
+            logger.warning("No default route interface found, tunnel rate limits are not enforced")
+            return False
+        dev = self.interface
+        qdiscs = self._qdiscs()
+        root = next(((kind, handle) for kind, handle, parent in qdiscs if parent == "root"), None)
+        ingress = any(kind in ("ingress", "clsact") for kind, _, _ in qdiscs)
+        if root == ("htb", ROOT_HANDLE):
+            # Our own rules, left behind by a panel that did not shut down cleanly
+            self._tc("qdisc", "del", "dev", dev, "root", check=False)
+            self._tc("qdisc", "del", "dev", dev, "handle", INGRESS_HANDLE, "ingress", check=False)
+            root, ingress = None, False
+        elif root is not None and root[1] != "0:":
+            logger.warning(
+                "%s already has a configured root qdisc (%s %s), not replacing it; "
+                "tunnel rate limits are not enforced", dev, *root,
+            )
+            return False
+        self._previous_root = root[0] if root else None
+        # default 0: unclassified traffic bypasses HTB at line rate
+        if not self._tc("qdisc", "add", "dev", dev, "root", "handle", ROOT_HANDLE, "htb", "default", "0"):
+            logger.warning("Cannot install HTB on %s, tunnel rate limits are not enforced", dev)
+            return False
+        self._owns_ingress = False
+        if ingress:
+            logger.warning("%s already has an ingress qdisc, upload limits are not enforced", dev)
+        elif self._tc("qdisc", "add", "dev", dev, "handle", INGRESS_HANDLE, "ingress"):
+            self._owns_ingress = True
+        else:
+            logger.warning("Cannot install ingress qdisc on %s, upload limits are not enforced", dev)
+        logger.info("Traffic shaping enabled on %s (replacing default %s qdisc)", dev, self._previous_root or "root")
+        return True
+
+    def _teardown(self):
+        dev = self.interface
+        # Deleting our root makes the kernel attach its default qdisc again,
+        # which is what was there before _setup
+        self._tc("qdisc", "del", "dev", dev, "root", check=False)
+        if self._owns_ingress:
+            self._tc("qdisc", "del", "dev", dev, "handle", INGRESS_HANDLE, "ingress", check=False)
+        logger.info("Traffic shaping removed from %s, %s qdisc restored", dev, self._previous_root or "default")
+        self.applied.clear()
+        self.minors.clear()
+        self._ready = None
+
+    def _minor(self, tunnel_id: str) -> Optional[int]:
+        minor = self.minors.get(tunnel_id)
+        if minor is None:
+            used = set(self.minors.values())
+            minor = next((m for m in range(1, MAX_MINOR + 1) if m not in used), None)
+            if minor is None:
+                logger.error("Out of traffic shaping classes, tunnel %s is not rate limited", tunnel_id)
+                return None
+            self.minors[tunnel_id] = minor
+        return minor
+
+    def _port_filters(self, parent: str, minor: int, ports: FrozenSet[Claim], key: str, action: List[str]):
+        dev = self.interface
+        for prio, protocol, match in ((minor, "ip", "ip"), (minor + IPV6_PRIO_OFFSET, "ipv6", "ip6")):
+            self._tc("filter", "del", "dev", dev, "parent", parent, "prio", str(prio), check=False)
+            for port in sorted({port for _, port in ports}):
+                self._tc(
+                    "filter", "add", "dev", dev, "parent", parent, "protocol", protocol, "prio", str(prio),
+                    "u32", "match", match, key, str(port), "0xffff", *action,
+                )
+
+    def _apply(self, tunnel_id: str, ports: FrozenSet[Claim], limit: RateLimit):
+        minor = self._minor(tunnel_id)
+        if minor is None:
+            return
+        dev = self.interface
+        previous = self.applied.get(tunnel_id)
+        ports_changed = previous is None or previous[0] != ports
+        classid = f"1:{minor:x}"
+
+        if limit.download_bps:
+            rate = f"{limit.download_bps}bit"
+            burst = str(limit.burst_for(limit.download_bps))
+            # replace keeps the class and its queue, so a rate change is seamless
+            self._tc("class", "replace", "dev", dev, "parent", ROOT_HANDLE, "classid", classid,
+                     "htb", "rate", rate, "ceil", rate, "burst", burst, "cburst", burst)
+            if ports_changed or not (previous and previous[1].download_bps):
+                self._port_filters(ROOT_HANDLE, minor, ports, "sport", ["flowid", classid])
+        elif previous and previous[1].download_bps:
+            self._remove_egress(minor)
+
+        if limit.upload_bps and self._owns_ingress:
+            police = ["police", "rate", f"{limit.upload_bps}bit", "burst", str(limit.burst_for(limit.upload_bps)),
+                      "conform-exceed", "drop", "index", str(minor)]
+            if not ports_changed and previous and previous[1].upload_bps:
+                self._tc("actions", "change", "action", *police)
+            else:
+                self._remove_ingress(minor)
+                self._port_filters(INGRESS_HANDLE, minor, ports, "dport", ["action", *police])
+        elif previous and previous[1].upload_bps and self._owns_ingress:
+            self._remove_ingress(minor)
+
+        self.applied[tunnel_id] = (ports, limit)
+        logger.info(
+            "Rate limited tunnel %s: upload=%s bit/s, download=%s bit/s",
+            tunnel_id, limit.upload_bps or "unlimited", limit.download_bps or "unlimited",
+            extra={"tunnel_id": tunnel_id},
+        )
+
+    def _remove_egress(self, minor: int):
+        dev = self.interface
+        for prio in (minor, minor + IPV6_PRIO_OFFSET):
+            self._tc("filter", "del", "dev", dev, "parent", ROOT_HANDLE, "prio", str(prio), check=False)
+        self._tc("class", "del", "dev", dev, "parent", ROOT_HANDLE, "classid", f"1:{minor:x}", check=False)
+
+    def _remove_ingress(self, minor: int):
+        dev = self.interface
+        for prio in (minor, minor + IPV6_PRIO_OFFSET):
+            self._tc("filter", "del", "dev", dev, "parent", INGRESS_HANDLE, "prio", str(prio), check=False)
+        self._tc("actions", "delete", "action", "police", "index", str(minor), check=False)
+
+    def _remove(self, tunnel_id: str):
+        minor = self.minors.pop(tunnel_id, None)
+        self.applied.pop(tunnel_id, None)
+        if minor is None:
+            return
+        self._remove_egress(minor)
+        if self._owns_ingress:
+            self._remove_ingress(minor)
+        logger.info("Removed rate limit of tunnel %s", tunnel_id, extra={"tunnel_id": tunnel_id})
+
+
+traffic_shaper = TrafficShaper(
+    enabled=settings.traffic_shaping_enabled,
+    interface=settings.traffic_shaping_interface,
+)
@@ -0,0 +1,264 @@
+"""In-memory registry of tunnels and nodes for runtime lookups
+
+The registry is loaded once at startup and kept current by ORM events on
+Tunnel and Node, applied when their transaction commits, so handlers and
+managers can read parsed routing decisions without re-querying the database
+or re-parsing ``spec``.
+"""
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from app.bandwidth import safe_rate_limit
+from app.database import AsyncSessionLocal
+from app.load_balancer import safe_load_balance
+from app.models import Node, Tunnel
+from app.port_forwarder import PANEL, ForwardOptions, safe_forward_options
+from app.port_index import claimed_ports, port_index, public_ports
+from app.restart_policy import parse_restart_policy
+
+logger = logging.getLogger(__name__)
+
+GOST_TYPES = frozenset({"tcp", "udp", "ws", "grpc", "tcpmux"})
+NODE_CORES = frozenset({"rathole", "backhaul"})
+
+
+def resolve_forward_to(spec: Dict[str, Any]) -> str:
+    """Gost target: ``forward_to`` or ``remote_ip:remote_port`` with the historical defaults
+
+    A list of targets is joined with commas, the form gost takes for a node list.
+    """
+    forward_to = spec.get("forward_to")
+    if isinstance(forward_to, (list, tuple)):
+        forward_to = ",".join(str(target).strip() for target in forward_to)
+    if not forward_to:
+        forward_to = f"{spec.get('remote_ip', '127.0.0.1')}:{spec.get('remote_port', 8080)}"
+    return forward_to
+
+
+def _as_port(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TunnelDescriptor:
+    """Parsed view of a tunnel row with its routing decisions precomputed"""
+
+    __slots__ = (
+        "id",
+        "name",
+        "core",
+        "type",
+        "node_id",
+        "status",
+        "revision",
+        "spec",
+        "quota_mb",
+        "used_mb",
+        "expires_at",
+        "restart_policy",
+        "needs_gost_forwarding",
+        "needs_panel_forwarding",
+        "needs_rathole_server",
+        "needs_backhaul_server",
+        "needs_node_apply",
+        "panel_port",
+        "forward_to",
+        "load_balance",
+        "forward_pool",
+        "proxy_protocol",
+        "rathole_remote_addr",
+        "rathole_token",
+        "rathole_proxy_port",
+        "ports",
+        "public_ports",
+        "rate_limit",
+    )
+
+    def __init__(self, tunnel: Tunnel):
+        spec = dict(tunnel.spec or {})
+        self.id = tunnel.id
+        self.name = tunnel.name
+        self.core = tunnel.core
+        self.type = tunnel.type
+        self.node_id = tunnel.node_id or ""
+        self.status = tunnel.status
+        self.revision = tunnel.revision
+        self.spec = spec
+        self.quota_mb = tunnel.quota_mb or 0
+        self.used_mb = tunnel.used_mb or 0
+        self.expires_at = tunnel.expires_at
+        self.restart_policy = parse_restart_policy(spec)
+
+        forwarded = tunnel.core == "xray" and tunnel.type in GOST_TYPES
+        forward = safe_forward_options(spec, tunnel.type) if forwarded else ForwardOptions()
+        self.needs_panel_forwarding = forwarded and forward.forwarder == PANEL
+        self.needs_gost_forwarding = forwarded and not self.needs_panel_forwarding
+        self.needs_rathole_server = tunnel.core == "rathole"
+        self.needs_backhaul_server = tunnel.core == "backhaul"
+        self.needs_node_apply = tunnel.core in NODE_CORES
+
+        self.panel_port = _as_port(spec.get("listen_port") or spec.get("remote_port"))
+        self.forward_to = resolve_forward_to(spec) if forwarded else None
+        self.load_balance = safe_load_balance(spec)
+        self.forward_pool = forward.pool
+        self.proxy_protocol = forward.proxy_protocol
+        self.rathole_remote_addr = spec.get("remote_addr")
+        self.rathole_token = spec.get("token")
+        self.rathole_proxy_port = _as_port(spec.get("remote_port") or spec.get("listen_port"))
+        self.ports = frozenset(claimed_ports(tunnel.core, tunnel.type, spec))
+        self.public_ports = frozenset(public_ports(tunnel.core, tunnel.type, spec))
+        self.rate_limit = safe_rate_limit(spec)
+
+
+class NodeDescriptor:
+    """Connection details for a node"""
+
+    __slots__ = ("id", "name", "status", "fingerprint", "api_address")
+
+    def __init__(self, node: Node):
+        metadata = node.node_metadata or {}
+        api_address = metadata.get("api_address") or "http://localhost:8888"
+        if not api_address.startswith("http"):
+            api_address = f"http://{api_address}"
+        self.id = node.id
+        self.name = node.name
+        self.status = node.status
+        self.fingerprint = node.fingerprint
+        self.api_address = api_address.rstrip("/")
+
+
+class TunnelRegistry:
+    """Tunnel and node descriptors keyed by id"""
+
+    def __init__(self):
+        self.tunnels: Dict[str, TunnelDescriptor] = {}
+        self.nodes: Dict[str, NodeDescriptor] = {}
+        self.listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Call ``listener(tunnel_id)`` whenever a tunnel is added, changed or dropped
+
+        Changes picked up by the ORM events reach listeners from the
+        session's ``after_commit`` hook, never for a rolled-back transaction,
+        so a listener only ever sees committed state. They still run inline
+        on the loop and must only record what changed and do the work elsewhere.
+        """
+        self.listeners.append(listener)
+
+    def _changed(self, tunnel_id: str):
+        for listener in self.listeners:
+            listener(tunnel_id)
+
+    async def load(self):
+        async with AsyncSessionLocal() as db:
+            tunnels = (await db.execute(select(Tunnel))).scalars().all()
+            nodes = (await db.execute(select(Node))).scalars().all()
+        self.tunnels = {t.id: TunnelDescriptor(t) for t in tunnels}
+        self.nodes = {n.id: NodeDescriptor(n) for n in nodes}
+        for descriptor in self.tunnels.values():
+            port_index.claim(descriptor.id, descriptor.ports)
+        logger.info("Loaded %d tunnels and %d nodes into the registry", len(self.tunnels), len(self.nodes))
+
+    def get_tunnel(self, tunnel_id: str) -> Optional[TunnelDescriptor]:
+        return self.tunnels.get(tunnel_id)
+
+    def active_tunnels(self) -> Iterator[TunnelDescriptor]:
+        return (t for t in list(self.tunnels.values()) if t.status == "active")
+
+    def put_tunnel(self, descriptor: TunnelDescriptor):
+        self.tunnels[descriptor.id] = descriptor
+        port_index.claim(descriptor.id, descriptor.ports)
+        self._changed(descriptor.id)
+
+    def discard_tunnel(self, tunnel_id: str):
+        """Forget a tunnel; also used after a bulk DELETE, which skips ORM events"""
+        self.tunnels.pop(tunnel_id, None)
+        port_index.release(tunnel_id)
+        self._changed(tunnel_id)
+
+    def set_tunnel_status(self, tunnel_id: str, status: str):
+        """Mirror a status change made with a bulk UPDATE, which skips ORM events"""
+        descriptor = self.tunnels.get(tunnel_id)
+        if descriptor is not None:
+            descriptor.status = status
+            self._changed(tunnel_id)
+
+    async def get_node(self, node_id: str) -> Optional[NodeDescriptor]:
+        """Node descriptor, loading it from the database if it is not cached yet"""
+        descriptor = self.nodes.get(node_id)
+        if descriptor is None:
+            async with AsyncSessionLocal() as db:
+                node = (await db.execute(select(Node).where(Node.id == node_id))).scalar_one_or_none()
+            if node is not None:
+                descriptor = self.nodes[node_id] = NodeDescriptor(node)
+        return descriptor
+
+
+tunnel_registry = TunnelRegistry()
+
+
+# Row events fire at flush, before the transaction is settled. Changes are
+# kept on the session and only reach the registry (and through it the port
+# index and listeners) once the commit succeeded; a rollback drops them.
+_PENDING = "tunnel_registry_changes"
+
+
+def _pending(target) -> Optional[Dict[Tuple[str, str], Callable[[], None]]]:
+    session = object_session(target)
+    if session is None:
+        return None
+    return session.info.setdefault(_PENDING, {})
+
+
+def _defer(target, key: Tuple[str, str], change: Callable[[], None]):
+    pending = _pending(target)
+    if pending is None:
+        change()
+        return
+    pending.pop(key, None)  # keep the order of the last change
+    pending[key] = change
+
+
+@event.listens_for(Tunnel, "after_insert")
+@event.listens_for(Tunnel, "after_update")
+def _sync_tunnel(mapper, connection, target):
+    descriptor = TunnelDescriptor(target)
+    _defer(target, ("tunnel", target.id), lambda: tunnel_registry.put_tunnel(descriptor))
+
+
+@event.listens_for(Tunnel, "after_delete")
+def _drop_tunnel(mapper, connection, target):
+    tunnel_id = target.id
+    _defer(target, ("tunnel", tunnel_id), lambda: tunnel_registry.discard_tunnel(tunnel_id))
+
+
+@event.listens_for(Node, "after_insert")
+@event.listens_for(Node, "after_update")
+def _sync_node(mapper, connection, target):
+    descriptor = NodeDescriptor(target)
+    _defer(target, ("node", target.id), lambda: tunnel_registry.nodes.__setitem__(descriptor.id, descriptor))
+
+
+@event.listens_for(Node, "after_delete")
+def _drop_node(mapper, connection, target):
+    node_id = target.id
+    _defer(target, ("node", node_id), lambda: tunnel_registry.nodes.pop(node_id, None))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session):
+    for change in session.info.pop(_PENDING, {}).values():
+        try:
+            change()
+        except Exception as e:
+            logger.error("Failed to update the tunnel registry: %s", e, exc_info=True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session):
+    session.info.pop(_PENDING, None)
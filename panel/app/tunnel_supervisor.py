@@ -0,0 +1,123 @@
+"""Reacts to tunnel processes that exit on their own"""
+import asyncio
+import logging
+from typing import Callable, Dict
+
+from sqlalchemy import update
+
+from app.backhaul_manager import backhaul_manager
+from app.database import AsyncSessionLocal
+from app.gost_forwarder import gost_forwarder
+from app.logging_setup import bind
+from app.metrics import TUNNEL_PROCESS_RESTARTS
+from app.models import Tunnel
+from app.process_watcher import describe_exit, process_watcher
+from app.rathole_server import rathole_server_manager
+from app.restart_policy import restart_tracker, should_restart
+from app.tunnel_registry import tunnel_registry
+
+logger = logging.getLogger(__name__)
+
+
+class TunnelSupervisor:
+    """Applies the tunnel restart policy when a process exits unexpectedly"""
+
+    def __init__(self):
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._restarters: Dict[str, Callable[[str], bool]] = {
+            "gost": gost_forwarder.restart,
+            "rathole": rathole_server_manager.restart,
+            "backhaul": backhaul_manager.restart,
+        }
+
+    def install(self):
+        process_watcher.add_listener(self.handle_exit)
+
+    def handle_exit(self, core: str, tunnel_id: str, returncode: int):
+        restart_tracker.record_exit(tunnel_id, describe_exit(returncode))
+        if tunnel_id in self._pending:
+            return
+        task = asyncio.get_running_loop().create_task(self._supervise(core, tunnel_id, returncode))
+        self._pending[tunnel_id] = task
+        task.add_done_callback(lambda t: self._discard(tunnel_id, t))
+
+    def _discard(self, tunnel_id: str, task: asyncio.Task):
+        if self._pending.get(tunnel_id) is task:
+            del self._pending[tunnel_id]
+
+    def forget(self, tunnel_id: str):
+        """Cancel any pending restart and drop restart history for a removed tunnel"""
+        task = self._pending.pop(tunnel_id, None)
+        if task:
+            task.cancel()
+        restart_tracker.forget(tunnel_id)
+
+    def reset(self, tunnel_id: str):
+        """Cancel any pending restart and close the circuit after a tunnel is re-applied"""
+        task = self._pending.pop(tunnel_id, None)
+        if task:
+            task.cancel()
+        restart_tracker.reset(tunnel_id)
+
+    def stats(self, tunnel_id: str) -> Dict[str, object]:
+        return restart_tracker.stats(tunnel_id)
+
+    async def _supervise(self, core: str, tunnel_id: str, returncode: int):
+        log = bind(logger, tunnel_id=tunnel_id, core=core)
+        reason = describe_exit(returncode)
+        try:
+            tunnel = tunnel_registry.get_tunnel(tunnel_id)
+            if tunnel is None or tunnel.status != "active":
+                return
+            policy = tunnel.restart_policy
+            if not should_restart(policy, returncode):
+                await self._mark_error(tunnel_id, f"{core} process exited unexpectedly ({reason})")
+                return
+
+            restarter = self._restarters.get(core)
+            while restarter is not None:
+                delay = restart_tracker.next_delay(tunnel_id)
+                if delay is None:
+                    log.error("Tunnel %s is crash looping, giving up on restarts", tunnel_id)
+                    await self._mark_error(
+                        tunnel_id,
+                        f"{core} process is crash looping, restarts suspended (last exit: {reason})",
+                    )
+                    return
+
+                log.warning("Restarting %s for tunnel %s in %.1fs (policy=%s)", core, tunnel_id, delay, policy)
+                await asyncio.sleep(delay)
+                tunnel = tunnel_registry.get_tunnel(tunnel_id)
+                if tunnel is None or tunnel.status != "active":
+                    return
+
+                try:
+                    restarted = await asyncio.to_thread(restarter, tunnel_id)
+                except Exception as e:
+                    reason = f"restart failed: {e}"
+                    restart_tracker.record_exit(tunnel_id, reason)
+                    log.warning("Restart of %s for tunnel %s failed: %s", core, tunnel_id, e)
+                    continue
+
+                if restarted:
+                    restart_tracker.record_restart(tunnel_id)
+                    TUNNEL_PROCESS_RESTARTS.labels(core).inc()
+                    log.info("Restarted %s for tunnel %s", core, tunnel_id)
+                return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("Failed to supervise exit of tunnel %s: %s", tunnel_id, e, exc_info=True)
+
+    async def _mark_error(self, tunnel_id: str, message: str):
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Tunnel)
+                .where(Tunnel.id == tunnel_id, Tunnel.status == "active")
+                .values(status="error", error_message=message)
+            )
+            await db.commit()
+        tunnel_registry.set_tunnel_status(tunnel_id, "error")
+
+
+tunnel_supervisor = TunnelSupervisor()
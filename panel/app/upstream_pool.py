@@ -0,0 +1,153 @@
+"""Pre-established idle upstream connections for the in-process forwarder
+
+A forward with a pool keeps at least ``min_idle`` connected sockets to its
+target, so an accepted client is spliced onto one straight away instead of
+paying a connect round trip first. After a burst of takes the pool refills
+towards ``max_idle``; sockets idle for longer than ``idle_ttl`` seconds, or
+closed by the target meanwhile, are discarded rather than handed out.
+
+Tunnels served by the in-process forwarder tune their pool in the spec::
+
+    "pool": {"min_idle": 2, "max_idle": 16, "idle_ttl_seconds": 30}
+
+Missing keys fall back to the ``forward_pool_*`` settings; ``"pool": null``
+or a ``max_idle`` of 0 turns the pool off.
+"""
+import asyncio
+import logging
+import socket
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, NamedTuple, Optional, Tuple
+
+from app.config import settings as app_settings
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_SECONDS = 30.0
+
+
+class PoolSettings(NamedTuple):
+    min_idle: int = 2
+    max_idle: int = 16
+    idle_ttl: float = 30.0
+
+
+def _number(section: Dict[str, Any], key: str, default: float) -> float:
+    value = section.get(key, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"pool.{key} must be a number")
+    if value < 0:
+        raise ValueError(f"pool.{key} must not be negative")
+    return value
+
+
+def parse_pool(spec: Optional[Dict[str, Any]]) -> Optional[PoolSettings]:
+    """Read ``pool`` from a tunnel spec; None for no pool, raises ValueError when malformed"""
+    spec = spec or {}
+    if "pool" in spec and spec["pool"] is None:
+        return None
+    section = spec.get("pool") or {}
+    if not isinstance(section, dict):
+        raise ValueError("pool must be an object or null")
+    min_idle = int(_number(section, "min_idle", app_settings.forward_pool_min_idle))
+    max_idle = int(_number(section, "max_idle", app_settings.forward_pool_max_idle))
+    idle_ttl = _number(section, "idle_ttl_seconds", app_settings.forward_pool_idle_ttl_seconds)
+    if not max_idle:
+        return None
+    if "min_idle" not in section:
+        min_idle = min(min_idle, max_idle)
+    if min_idle > max_idle:
+        raise ValueError("pool.min_idle must not exceed pool.max_idle")
+    if not idle_ttl:
+        raise ValueError("pool.idle_ttl_seconds must be positive")
+    return PoolSettings(min_idle, max_idle, idle_ttl)
+
+
+def _is_alive(sock: socket.socket) -> bool:
+    """A non-blocking peek tells a live idle socket from one the target closed"""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+
+class UpstreamPool:
+    """Idle connections to one target, refilled in the background"""
+
+    def __init__(self, connect: Callable[[], Awaitable[socket.socket]], settings: PoolSettings):
+        self.connect = connect
+        self.settings = settings
+        self.idle: Deque[Tuple[socket.socket, float]] = deque()
+        self.taken = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self.idle:
+            self.idle.popleft()[0].close()
+
+    def take(self) -> Optional[socket.socket]:
+        """A warm connected socket, or None when the pool is empty"""
+        deadline = time.monotonic() - self.settings.idle_ttl
+        while self.idle:
+            sock, since = self.idle.pop()
+            if since >= deadline and _is_alive(sock):
+                self.taken += 1
+                self._wakeup.set()
+                return sock
+            sock.close()
+        self._wakeup.set()
+        return None
+
+    def _expire(self):
+        deadline = time.monotonic() - self.settings.idle_ttl
+        while self.idle and self.idle[0][1] < deadline:
+            self.idle.popleft()[0].close()
+
+    def _target(self) -> int:
+        # Refill to what was just consumed, so a burst is absorbed next time
+        demand = max(self.settings.min_idle, self.taken)
+        self.taken = 0
+        return min(self.settings.max_idle, demand)
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            self._wakeup.clear()
+            self._expire()
+            missing = self._target() - len(self.idle)
+            if missing > 0:
+                results = await asyncio.gather(*(self.connect() for _ in range(missing)), return_exceptions=True)
+                failed = 0
+                for result in results:
+                    if isinstance(result, BaseException):
+                        failed += 1
+                    else:
+                        self.idle.append((result, time.monotonic()))
+                if failed:
+                    logger.debug("Upstream pool: %d of %d warm connects failed", failed, missing)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+                    continue
+                backoff = 1.0
+            try:
+                # Wake on takes; otherwise wake in time to drop expiring sockets
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(self.settings.idle_ttl / 2, 0.5))
+            except asyncio.TimeoutError:
+                pass
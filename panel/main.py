@@ -1,32 +1,36 @@
 """
 Smite Panel - Central Controller
 """
+import asyncio
 import os
 from contextlib import asynccontextmanager
 from pathlib import Path
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.database import AsyncSessionLocal
-from app.models import Tunnel, Node
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, FileResponse
+from fastapi.responses import RedirectResponse, FileResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 from app.config import settings
 from app.database import init_db
-from app.routers import nodes, tunnels, panel, status, logs, auth
+from app.routers import nodes, tunnels, panel, status, logs, auth, usage
 from app.hysteria2_server import Hysteria2Server
 from app.gost_forwarder import gost_forwarder
+from app.port_forwarder import port_forwarder
 from app.rathole_server import rathole_server_manager
 from app.backhaul_manager import backhaul_manager
+from app.log_rotation import bind_event_loop
+from app.logging_setup import configure_logging, shutdown_logging
+from app import metrics
+from app.loop_monitor import loop_monitor
+from app.process_watcher import process_watcher
+from app.tunnel_supervisor import tunnel_supervisor
+from app.tunnel_registry import tunnel_registry
+from app.quota_enforcer import quota_enforcer
+from app.traffic_shaper import traffic_shaper
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -34,6 +38,7 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     await init_db()
+    await tunnel_registry.load()
     
     h2_server = Hysteria2Server()
     await h2_server.start()
@@ -53,66 +58,90 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"Failed to generate CA certificate on startup: {e}")
     
+    process_watcher.attach(asyncio.get_running_loop())
+    bind_event_loop(asyncio.get_running_loop())
+    tunnel_supervisor.install()
+    
     app.state.gost_forwarder = gost_forwarder
+    port_forwarder.install()
     
     app.state.rathole_server_manager = rathole_server_manager
     app.state.backhaul_manager = backhaul_manager
     
+    metrics.register_process_source(
+        "gost", lambda: sum(1 for proc in gost_forwarder.active_forwards.values() if proc.poll() is None)
+    )
+    metrics.register_process_source(
+        "rathole", lambda: sum(1 for proc in rathole_server_manager.active_servers.values() if proc.poll() is None)
+    )
+    metrics.register_process_source(
+        "backhaul", lambda: sum(1 for proc in backhaul_manager.processes.values() if proc.poll() is None)
+    )
+    metrics.register_forward_source(lambda: port_forwarder.session_tables)
+    lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+    if settings.loop_monitor_enabled:
+        loop_monitor.start()
+    
+    # Tunnels that ran out or expired while the panel was down stay down
+    await quota_enforcer.sweep()
     await _restore_forwards()
     
     await _restore_rathole_servers()
     await _restore_backhaul_servers()
+    quota_enforcer.start()
+    traffic_shaper.install()
     
     yield
     
+    await quota_enforcer.stop()
+    await traffic_shaper.stop()
+    lag_task.cancel()
+    await loop_monitor.stop()
     if hasattr(app.state, 'h2_server'):
         await app.state.h2_server.stop()
     
-    gost_forwarder.cleanup_all()
+    await asyncio.to_thread(gost_forwarder.cleanup_all)
+    await port_forwarder.cleanup_all()
+    
+    await asyncio.to_thread(rathole_server_manager.cleanup_all)
+    await asyncio.to_thread(backhaul_manager.cleanup_all)
     
-    rathole_server_manager.cleanup_all()
-    backhaul_manager.cleanup_all()
+    shutdown_logging()
 
 
 async def _restore_forwards():
     """Restore forwarding for active tunnels on startup"""
     try:
         logger.info("Starting to restore forwarding for active tunnels...")
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(select(Tunnel).where(Tunnel.status == "active"))
-            tunnels = result.scalars().all()
-            logger.info(f"Found {len(tunnels)} active tunnels to restore")
+        tunnels = [t for t in tunnel_registry.active_tunnels() if t.needs_gost_forwarding]
+        logger.info(f"Found {len(tunnels)} active gost tunnels to restore")
+        
+        for tunnel in tunnels:
+            if not tunnel.panel_port or not tunnel.forward_to:
+                logger.warning(f"Tunnel {tunnel.id}: Missing panel_port or forward_to, skipping restore")
+                continue
             
-            for tunnel in tunnels:
-                logger.info(f"Checking tunnel {tunnel.id}: type={tunnel.type}, core={tunnel.core}")
-                needs_gost_forwarding = tunnel.type in ["tcp", "udp", "ws", "grpc", "tcpmux"] and tunnel.core == "xray"
-                if not needs_gost_forwarding:
-                    continue
-                
-                listen_port = tunnel.spec.get("listen_port")
-                forward_to = tunnel.spec.get("forward_to")
-                
-                if not forward_to:
-                    remote_ip = tunnel.spec.get("remote_ip", "127.0.0.1")
-                    remote_port = tunnel.spec.get("remote_port", 8080)
-                    forward_to = f"{remote_ip}:{remote_port}"
-                
-                panel_port = listen_port or tunnel.spec.get("remote_port")
-                if not panel_port or not forward_to:
-                    logger.warning(f"Tunnel {tunnel.id}: Missing panel_port or forward_to, skipping restore")
-                    continue
-                
-                try:
-                    logger.info(f"Restoring gost forwarding for tunnel {tunnel.id}: {tunnel.type}://:{panel_port} -> {forward_to}")
-                    gost_forwarder.start_forward(
-                        tunnel_id=tunnel.id,
-                        local_port=int(panel_port),
-                        forward_to=forward_to,
-                        tunnel_type=tunnel.type
-                    )
-                    logger.info(f"Successfully restored gost forwarding for tunnel {tunnel.id}")
-                except Exception as e:
-                    logger.error(f"Failed to restore forwarding for tunnel {tunnel.id}: {e}", exc_info=True)
+            try:
+                logger.info(f"Restoring gost forwarding for tunnel {tunnel.id}: {tunnel.type}://:{tunnel.panel_port} -> {tunnel.forward_to}")
+                gost_forwarder.start_forward(
+                    tunnel_id=tunnel.id,
+                    local_port=tunnel.panel_port,
+                    forward_to=tunnel.forward_to,
+                    tunnel_type=tunnel.type,
+                    load_balance=tunnel.load_balance
+                )
+                logger.info(f"Successfully restored gost forwarding for tunnel {tunnel.id}")
+            except Exception as e:
+                logger.error(f"Failed to restore forwarding for tunnel {tunnel.id}: {e}", exc_info=True)
+        
+        for tunnel in tunnel_registry.active_tunnels():
+            if not tunnel.needs_panel_forwarding:
+                continue
+            try:
+                await port_forwarder.start_tunnel(tunnel)
+                logger.info(f"Restored panel forwarding for tunnel {tunnel.id} on port {tunnel.panel_port}")
+            except Exception as e:
+                logger.error(f"Failed to restore panel forwarding for tunnel {tunnel.id}: {e}", exc_info=True)
     except Exception as e:
         logger.error(f"Error restoring forwards: {e}")
 
@@ -120,27 +149,18 @@ async def _restore_forwards():
 async def _restore_rathole_servers():
     """Restore Rathole servers for active tunnels on startup"""
     try:
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(select(Tunnel).where(Tunnel.status == "active"))
-            tunnels = result.scalars().all()
+        for tunnel in tunnel_registry.active_tunnels():
+            if not tunnel.needs_rathole_server:
+                continue
+            if not tunnel.rathole_remote_addr or not tunnel.rathole_token or not tunnel.rathole_proxy_port:
+                continue
             
-            for tunnel in tunnels:
-                if tunnel.core != "rathole":
-                    continue
-                
-                remote_addr = tunnel.spec.get("remote_addr")
-                token = tunnel.spec.get("token")
-                proxy_port = tunnel.spec.get("remote_port") or tunnel.spec.get("listen_port")
-                
-                if not remote_addr or not token or not proxy_port:
-                    continue
-                
-                rathole_server_manager.start_server(
-                    tunnel_id=tunnel.id,
-                    remote_addr=remote_addr,
-                    token=token,
-                    proxy_port=int(proxy_port)
-                )
+            rathole_server_manager.start_server(
+                tunnel_id=tunnel.id,
+                remote_addr=tunnel.rathole_remote_addr,
+                token=tunnel.rathole_token,
+                proxy_port=tunnel.rathole_proxy_port
+            )
     except Exception as e:
         logger.error(f"Error restoring Rathole servers: {e}")
 
@@ -148,22 +168,18 @@ async def _restore_rathole_servers():
 async def _restore_backhaul_servers():
     """Restore Backhaul servers for active tunnels on startup"""
     try:
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(select(Tunnel).where(Tunnel.status == "active"))
-            tunnels = result.scalars().all()
-
-            for tunnel in tunnels:
-                if tunnel.core != "backhaul":
-                    continue
-
-                try:
-                    backhaul_manager.start_server(tunnel.id, tunnel.spec or {})
-                except Exception as exc:
-                    logger.error(
-                        "Failed to restore Backhaul server for tunnel %s: %s",
-                        tunnel.id,
-                        exc,
-                    )
+        for tunnel in tunnel_registry.active_tunnels():
+            if not tunnel.needs_backhaul_server:
+                continue
+
+            try:
+                backhaul_manager.start_server(tunnel.id, tunnel.spec)
+            except Exception as exc:
+                logger.error(
+                    "Failed to restore Backhaul server for tunnel %s: %s",
+                    tunnel.id,
+                    exc,
+                )
     except Exception as exc:
         logger.error("Error restoring Backhaul servers: %s", exc)
 
@@ -173,6 +189,7 @@ app = FastAPI(
     description="Tunneling Control Panel",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs" if settings.docs_enabled else None,
     redoc_url="/redoc" if settings.docs_enabled else None,
 )
@@ -183,7 +200,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(panel.router, prefix="/api/panel", tags=["panel"])
@@ -191,6 +210,15 @@ app.include_router(nodes.router, prefix="/api/nodes", tags=["nodes"])
 app.include_router(tunnels.router, prefix="/api/tunnels", tags=["tunnels"])
 app.include_router(status.router, prefix="/api/status", tags=["status"])
 app.include_router(logs.router, prefix="/api/logs", tags=["logs"])
+app.include_router(usage.router, prefix="/api/usage", tags=["usage"])
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    payload, content_type = metrics.render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 static_path = Path(static_dir)
@@ -203,7 +231,7 @@ if static_path.exists() and (static_path / "index.html").exists():
     @app.get("/{full_path:path}")
     async def serve_frontend(full_path: str):
         """Serve frontend for all non-API routes"""
-        if full_path.startswith("api/") or full_path.startswith("docs") or full_path.startswith("redoc") or full_path.startswith("openapi.json"):
+        if full_path.startswith("api/") or full_path == "metrics" or full_path.startswith("docs") or full_path.startswith("redoc") or full_path.startswith("openapi.json"):
             raise HTTPException(status_code=404)
         
         file_path = static_path / full_path